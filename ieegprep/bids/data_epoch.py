@@ -10,7 +10,6 @@ This program is distributed in the hope that it will be useful, but WITHOUT ANY
 You should have received a copy of the GNU General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import os
-import gc
 import logging
 import warnings
 import numpy as np
@@ -20,12 +19,39 @@ from ieegprep.utils.misc import allocate_array
 from ieegprep.utils.console import multi_line_list, print_progressbar
 LOGGING_CAPTION_INDENT_LENGTH   = 50      # TODO: also in erdetect.core.config
 
+# lookups for the input arguments (valid data extensions, baseline normalization and out-of-bound handling)
+_VALID_FORMAT_EXTENSIONS = frozenset(VALID_FORMAT_EXTENSIONS)
+_BASELINE_METHODS = {'none': 0, 'mean': 1, 'average': 1, 'median': 2}
+_OUT_OF_BOUND_METHODS = {'error': 0, 'first_last_only': 1, 'allow': 2}
+
+# out-of-bound states of a trial-epoch (bit-flags, in the order in which they are checked)
+_OOB_SKIP_BEFORE = 1
+_OOB_CLIP_START = 2
+_OOB_SKIP_AFTER = 4
+_OOB_CLIP_END = 8
+_OOB_MESSAGES = ((_OOB_SKIP_BEFORE, 'the end of the trial-epoch lies before the start of the data-set.'),
+                 (_OOB_CLIP_START, 'the start of the trial-epoch lies before the start of the data-set.'),
+                 (_OOB_SKIP_AFTER, 'the start of the trial-epoch lies after the end of the data-set.'),
+                 (_OOB_CLIP_END, 'the end of the trial-epoch lies after the end of the data-set.'))
+
+# the maximum size (in bytes) of a block of channels that is retrieved at once when epoching by channels
+_CHANNEL_BLOCK_MAX_BYTES = 100 * 1024 ** 2
+
+# the maximum size (in bytes) of a sample-range that is retrieved at once when the reads of nearby trials are combined
+_RANGE_READ_MAX_BYTES = 100 * 1024 ** 2
+
+# the minimum size (in bytes) of the epoch data before the trials are averaged on multiple threads
+_PARALLEL_AVERAGE_MIN_BYTES = 16 * 1024 ** 2
+
+# the maximum size (in bytes) of a block of trials that is epoched at once when only the average of a condition is needed
+_CONDITION_BLOCK_MAX_BYTES = 100 * 1024 ** 2
+
 
 def load_data_epochs(data_path, retrieve_channels, onsets,
                      trial_epoch=(-1, 3), baseline_norm=None, baseline_epoch=(-1, -0.1),
                      out_of_bound_handling='error',
                      high_pass=False, early_reref=None, line_noise_removal=None, late_reref=None,
-                     preload_data=False, preproc_priority='mem'):
+                     preload_data=False, preproc_priority='mem', high_precision=False, high_pass_method='butter'):
     """
     Load and epoch the data into a matrix based on channels, the trial onsets and the epoch range (relative to the onsets)
 
@@ -69,7 +95,16 @@ def load_data_epochs(data_path, retrieve_channels, onsets,
         preload_data (bool):                Preload the entire dataset before processing. Preloading is faster but requires
                                             significantly more memory
         preproc_priority (str):             When preprocessing is required, the priority can be set to
-                                            either 'mem' (default) or 'speed'
+                                            either 'mem' (default) or 'speed'. With 'mem', an output matrix that does
+                                            not fit in the available memory is backed by a temporary file instead
+        high_precision (bool):              Return the epoch data as 64-bit floats (True) instead of 32-bit floats (False,
+                                            default). 32-bit floats halve the memory needed for the output, which is
+                                            more than enough to hold the (16 to 24-bit) iEEG sample values
+        high_pass_method (str):             The high-pass filter to apply when high_pass is True;
+                                                'butter':  (default) A zero-phase (forward-backward) Butterworth filter;
+                                                'onepole': A causal first-order IIR filter, a single cheap pass over
+                                                           each channel that is suitable for streaming data. Note that,
+                                                           unlike 'butter', this filter introduces a phase shift
 
     Returns:
         sampling_rate (int or double):      the sampling rate at which the data was acquired
@@ -84,6 +119,8 @@ def load_data_epochs(data_path, retrieve_channels, onsets,
     # check input
     #
     try:
+        if high_pass_method not in ('butter', 'onepole'):
+            raise ValueError('Unknown high-pass method argument')
         data_reader, baseline_method, out_of_bound_method = _prepare_input(data_path,
                                                                            trial_epoch, baseline_norm, baseline_epoch,
                                                                            out_of_bound_handling,
@@ -99,6 +136,15 @@ def load_data_epochs(data_path, retrieve_channels, onsets,
     #
     try:
 
+        # allocate the output matrix (channel x trials/epochs x time) once, the epoching routines write into it
+        # Note: when optimizing for memory and the matrix does not fit in the available memory, the matrix is backed by
+        #       a temporary file. Each channel-trial epoch is written to the matrix only once, so the OS can page out
+        #       the written parts instead of the allocation failing
+        trial_num_samples, _ = _epoch_num_samples(data_reader.sampling_rate, trial_epoch)
+        data = _allocate_data_epochs(None, len(retrieve_channels), len(onsets), trial_num_samples,
+                                     dtype=np.float64 if high_precision else np.float32,
+                                     spill_to_disk=preproc_priority == 'mem')
+
         # check whether preprocessing is needed (full channel loading)
         if high_pass or early_reref is not None or line_noise_removal is not None or late_reref is not None:
             # require preprocessing
@@ -113,35 +159,28 @@ def load_data_epochs(data_path, retrieve_channels, onsets,
                                                                            high_pass=high_pass, early_reref=early_reref,
                                                                            line_noise_removal=line_noise_removal,
                                                                            late_reref=late_reref,
-                                                                           priority=preproc_priority)
+                                                                           priority=preproc_priority,
+                                                                           high_pass_method=high_pass_method,
+                                                                           ref_data=data)
 
         else:
             # no preprocessing required
 
-            if not preload_data and data_reader.data_format == 'bv' and data_reader.bv_hdr['data_orientation'] == 'VECTORIZED':
-                # tests (test_epoch_nonpreproc_perf.py) show that by channels iterations seems faster for non-preloaded Brainvision vectorized data
-
-                # load the data by iterating over the channels and picking out the epochs
-                sampling_rate, data = _load_data_epochs__by_channels( data_reader, retrieve_channels, onsets,
-                                                                      trial_epoch=trial_epoch,
-                                                                      baseline_method=baseline_method, baseline_epoch=baseline_epoch,
-                                                                      out_of_bound_method=out_of_bound_method)
-
-            else:
-                # tests (test_epoch_nonpreproc_perf.py) show that all other read condition benefit from by-trial reading
-
-                # load the data by iterating over the trials
-                sampling_rate, data = _load_data_epochs__by_trials(data_reader, retrieve_channels, onsets,
-                                                                   trial_epoch=trial_epoch,
-                                                                   baseline_method=baseline_method, baseline_epoch=baseline_epoch,
-                                                                   out_of_bound_method=out_of_bound_method)
+            # pick the epoching routine that performs best for the data format and read condition
+            epoch_routine = _select_epoch_routine(data_reader, preload_data)
+            sampling_rate, data = epoch_routine(data_reader, retrieve_channels, onsets,
+                                                trial_epoch=trial_epoch,
+                                                baseline_method=baseline_method, baseline_epoch=baseline_epoch,
+                                                out_of_bound_method=out_of_bound_method,
+                                                ref_data=data)
 
     except Exception as e:
         logging.error('Error on loading and epoching data: ' + str(e))
         raise RuntimeError('Error on loading and epoching data')
 
-    # close (and unload) the data reader
-    data_reader.close()
+    finally:
+        # close (and unload) the data reader, also when an error occurred
+        data_reader.close()
 
     #
     return sampling_rate, data
@@ -151,7 +190,7 @@ def load_data_epochs_averages(data_path, retrieve_channels, conditions_onsets,
                               trial_epoch=(-1, 3), baseline_norm=None, baseline_epoch=(-1, -0.1),
                               out_of_bound_handling='error', metric_callbacks=None,
                               high_pass=False, early_reref=None, line_noise_removal=None, late_reref=None,
-                              preload_data=False, preproc_priority='mem'):
+                              preload_data=False, preproc_priority='mem', high_precision=False, high_pass_method='butter'):
 
 
     """
@@ -216,6 +255,13 @@ def load_data_epochs_averages(data_path, retrieve_channels, conditions_onsets,
                                                 significantly more memory
         preproc_priority (str):                 When preprocessing is required, the priority can be set to
                                                 either 'mem' (default) or 'speed'
+        high_precision (bool):                  Return the averages as 64-bit floats (True) instead of 32-bit floats (False,
+                                                default). Note that the trials are averaged at 64-bit precision regardless
+        high_pass_method (str):                 The high-pass filter to apply when high_pass is True;
+                                                    'butter':  (default) A zero-phase (forward-backward) Butterworth filter;
+                                                    'onepole': A causal first-order IIR filter, a single cheap pass over
+                                                               each channel that is suitable for streaming data. Note
+                                                               that, unlike 'butter', this filter introduces a phase shift
 
     Returns:
         sampling_rate (int or double):          The sampling rate at which the data was acquired
@@ -232,6 +278,8 @@ def load_data_epochs_averages(data_path, retrieve_channels, conditions_onsets,
     # check input
     #
     try:
+        if high_pass_method not in ('butter', 'onepole'):
+            raise ValueError('Unknown high-pass method argument')
         data_reader, baseline_method, out_of_bound_method = _prepare_input(data_path,
                                                                            trial_epoch, baseline_norm, baseline_epoch,
                                                                            out_of_bound_handling, preload_data=preload_data)
@@ -261,7 +309,9 @@ def load_data_epochs_averages(data_path, retrieve_channels, conditions_onsets,
                                                                                           high_pass=high_pass, early_reref=early_reref,
                                                                                           line_noise_removal=line_noise_removal,
                                                                                           late_reref=late_reref,
-                                                                                          priority=preproc_priority)
+                                                                                          priority=preproc_priority,
+                                                                                          high_pass_method=high_pass_method,
+                                                                                          dtype=np.float64 if high_precision else np.float32)
 
         else:
             # no preprocessing required
@@ -272,14 +322,16 @@ def load_data_epochs_averages(data_path, retrieve_channels, conditions_onsets,
             sampling_rate, data, metric_values = _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channels, conditions_onsets,
                                                                                                 trial_epoch=trial_epoch,
                                                                                                 baseline_method=baseline_method, baseline_epoch=baseline_epoch,
-                                                                                                out_of_bound_method=out_of_bound_method, metric_callbacks=metric_callbacks)
+                                                                                                out_of_bound_method=out_of_bound_method, metric_callbacks=metric_callbacks,
+                                                                                                dtype=np.float64 if high_precision else np.float32)
 
     except Exception as e:
         logging.error('Error on loading, epoching and averaging data: ' + str(e))
         raise RuntimeError('Error on loading, epoching and averaging data')
 
-    # close (and unload) the data reader
-    data_reader.close()
+    finally:
+        # close (and unload) the data reader, also when an error occurred
+        data_reader.close()
 
     # return success
     return sampling_rate, data, metric_values
@@ -308,13 +360,12 @@ def _prepare_input(data_path, trial_epoch, baseline_norm, baseline_epoch, out_of
         logging.error('No such file or directory: \'' + data_path + '\'')
         raise FileNotFoundError('No such file or directory: \'' + data_path + '\'')
 
-    try:
-        data_extension = data_path[data_path.rindex("."):]
-    except ValueError:
-            logging.error('Unknown data format, no extension')
-            raise ValueError('Unknown data format')
+    data_extension = os.path.splitext(data_path)[1]
+    if not data_extension:
+        logging.error('Unknown data format, no extension')
+        raise ValueError('Unknown data format')
 
-    if not any(data_extension in x for x in VALID_FORMAT_EXTENSIONS):
+    if data_extension not in _VALID_FORMAT_EXTENSIONS:
         logging.error('Unknown data format (' + data_extension + ')')
         raise ValueError('Unknown data format (' + data_extension + ')')
 
@@ -331,181 +382,739 @@ def _prepare_input(data_path, trial_epoch, baseline_norm, baseline_epoch, out_of
     except RuntimeError:
         raise RuntimeError('Error upon initializing a data reader')
 
-    # baseline normalization
-    baseline_method = 0
-    if baseline_norm is not None and len(baseline_norm) > 0:
-        if baseline_norm.lower() == 'mean' or baseline_norm.lower() == 'average':
-            baseline_method = 1
-        elif baseline_norm.lower() == 'median':
-            baseline_method = 2
-        elif baseline_norm.lower() == 'none':
-            baseline_method = 0
-        else:
-            logging.error('Unknown normalization argument (' + baseline_norm + '), this can only be one of the following options: None, \'mean\' or \'median\'')
-            raise ValueError('Unknown normalization argument')
-
-        #
-        if baseline_epoch[1] < baseline_epoch[0]:
-            logging.error('Invalid \'baseline_epoch\' parameter, the given end-point (at ' + str(baseline_epoch[1]) + ') lies before the start-point (at ' + str(baseline_epoch[0]) + ')')
-            raise ValueError('Invalid \'baseline_epoch\' parameter')
+    # validate the remaining arguments, closing the data reader if one of them is invalid
+    try:
+        # baseline normalization
+        baseline_method = 0
+        if baseline_norm is not None and len(baseline_norm) > 0:
+            baseline_method = _BASELINE_METHODS.get(baseline_norm.lower())
+            if baseline_method is None:
+                logging.error('Unknown normalization argument (' + baseline_norm + '), this can only be one of the following options: None, \'mean\' or \'median\'')
+                raise ValueError('Unknown normalization argument')
 
-        # TODO: check mef3 baseline in trial, might not be a restriction for all epoching routines
-        if data_reader.data_format == 'mef3':
-            if baseline_epoch[0] < trial_epoch[0]:
-                logging.error('Invalid \'baseline_epoch\' parameter, the given baseline start-point (at ' + str(baseline_epoch[0]) + ') lies before the trial start-point (at ' + str(trial_epoch[0]) + ')')
-                raise ValueError('Invalid \'baseline_epoch\' parameter')
-            if baseline_epoch[1] > trial_epoch[1]:
-                logging.error('Invalid \'baseline_epoch\' parameter, the given baseline end-point (at ' + str(baseline_epoch[1]) + ') lies after the trial end-point (at ' + str(trial_epoch[1]) + ')')
+            #
+            if baseline_epoch[1] < baseline_epoch[0]:
+                logging.error('Invalid \'baseline_epoch\' parameter, the given end-point (at ' + str(baseline_epoch[1]) + ') lies before the start-point (at ' + str(baseline_epoch[0]) + ')')
                 raise ValueError('Invalid \'baseline_epoch\' parameter')
 
-    # out-of-bound handling
-    if out_of_bound_handling.lower() == 'first_last_only':
-        out_of_bound_method = 1
-    elif out_of_bound_handling.lower() == 'allow':
-        out_of_bound_method = 2
-    elif out_of_bound_handling.lower() == 'error':
-        out_of_bound_method = 0
-    else:
-        logging.error('Unknown out-of-bound handling argument (' + out_of_bound_handling + '), this can only be one of the following options: \'error\', \'first_last_only\' or \'allow\'')
-        raise ValueError('Unknown out-of-bound handling argument')
+            # TODO: check mef3 baseline in trial, might not be a restriction for all epoching routines
+            if data_reader.data_format == 'mef3':
+                if baseline_epoch[0] < trial_epoch[0]:
+                    logging.error('Invalid \'baseline_epoch\' parameter, the given baseline start-point (at ' + str(baseline_epoch[0]) + ') lies before the trial start-point (at ' + str(trial_epoch[0]) + ')')
+                    raise ValueError('Invalid \'baseline_epoch\' parameter')
+                if baseline_epoch[1] > trial_epoch[1]:
+                    logging.error('Invalid \'baseline_epoch\' parameter, the given baseline end-point (at ' + str(baseline_epoch[1]) + ') lies after the trial end-point (at ' + str(trial_epoch[1]) + ')')
+                    raise ValueError('Invalid \'baseline_epoch\' parameter')
+
+        # out-of-bound handling
+        out_of_bound_method = _OUT_OF_BOUND_METHODS.get(out_of_bound_handling.lower())
+        if out_of_bound_method is None:
+            logging.error('Unknown out-of-bound handling argument (' + out_of_bound_handling + '), this can only be one of the following options: \'error\', \'first_last_only\' or \'allow\'')
+            raise ValueError('Unknown out-of-bound handling argument')
+
+    except Exception:
+        data_reader.close()
+        raise
 
     return data_reader, baseline_method, out_of_bound_method
 
 
-def __epoch_data__from_channel_data__by_trials(ref_data, channel_idx, channel_data, sampling_rate,
-                                               onsets, trial_epoch,
-                                               baseline_method, baseline_epoch, out_of_bound_method):
-    """
-    Epoch the trial-data for a single channel by looping over the trial-onsets
+def _epoch_num_samples(sampling_rate, trial_epoch, baseline_epoch=None):
     """
+    Calculate the size (in samples) of the trial-epoch and of the baseline-epoch
 
-    # calculate the size of the time dimension (in samples)
+    Args:
+        sampling_rate (int or double):      The sampling rate of the data
+        trial_epoch (tuple):                The time-span of the trial-epoch, expressed as a tuple with the start- and
+                                            end-point in seconds relative to the trial onset
+        baseline_epoch (None or tuple):     The time-span of the baseline-epoch, expressed as a tuple with the start- and
+                                            end-point in seconds relative to the trial onset
+
+    Returns:
+        trial_num_samples (int):            The number of samples in the trial-epoch
+        baseline_num_samples (int):         The number of samples in the baseline-epoch, 0 if no baseline-epoch is given
+    """
     trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * sampling_rate))
+    if baseline_epoch is None:
+        return trial_num_samples, 0
+    return trial_num_samples, int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * sampling_rate))
 
-    # loop through the trials
-    for trial_idx in range(len(onsets)):
 
-        # calculate the sample indices
-        trial_sample_start = int(round((onsets[trial_idx] + trial_epoch[0]) * sampling_rate))
-        trial_sample_end = trial_sample_start + trial_num_samples
-        baseline_start_sample = int(round((onsets[trial_idx] + baseline_epoch[0]) * sampling_rate))
-        baseline_end_sample = baseline_start_sample + baseline_num_samples
-        local_start = 0
-        local_end = trial_num_samples
-
-        # check whether the trial epoch is within bounds
-        if trial_sample_end < 0:
-            if (out_of_bound_method == 1 and trial_idx == 0) or out_of_bound_method == 2:
-                if channel_idx == 0:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set.')
-                continue
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_start < 0:
-            if (out_of_bound_method == 1 and trial_idx == 0) or out_of_bound_method == 2:
-                if channel_idx == 0:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set.')
-                local_start = trial_sample_start * -1
-                trial_sample_start = 0
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_start > channel_data.size:
-            if (out_of_bound_method == 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                if channel_idx == 0:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set.')
+def _nanmean(data, axis=None):
+    """
+    Calculate the mean along an axis of the data, ignoring NaNs
+
+    Args:
+        data (ndarray):                     The data to calculate the mean over
+        axis (int):                         The axis along which the mean is calculated (None for the mean over all values)
+
+    Returns:
+        The mean value(s)
+
+    Note:   np.nanmean first copies the data to replace the NaNs with zeros and then makes separate passes to sum and
+            count the values. Since the data will usually not contain NaNs, np.mean is used whenever possible. Both
+            yield the same result on data without NaNs
+    """
+    if np.isnan(data).any():
+        return np.nanmean(data, axis=axis)
+    return np.mean(data, axis=axis)
+
+
+def _nanmedian(data, axis=-1):
+    """
+    Calculate the median along an axis of the data, ignoring NaNs
+
+    Args:
+        data (ndarray):                     The data to calculate the median over
+        axis (int):                         The axis along which the median is calculated
+
+    Returns:
+        The median value(s)
+
+    Note:   np.nanmedian is considerably slower than np.median, when calculating along an axis (of a small size) it
+            falls back to masked arrays. Since the data will usually not contain NaNs, np.median (which selects the
+            middle values by partitioning) is used whenever possible. Both yield the same result on data without NaNs
+    """
+    if np.isnan(data).any():
+        return np.nanmedian(data, axis=axis)
+    return np.median(data, axis=axis)
+
+
+def _nanvar(data, axis=None):
+    """
+    Calculate the variance along an axis of the data, ignoring NaNs
+
+    Args:
+        data (ndarray):                     The data to calculate the variance over
+        axis (int):                         The axis along which the variance is calculated (None for the variance over all values)
+
+    Returns:
+        The variance value(s)
+
+    Note:   np.nanvar replaces the NaNs (in a copy of the data) and counts the values before calculating the variance,
+            np.var is used whenever possible. Both yield the same result on data without NaNs
+    """
+    if np.isnan(data).any():
+        return np.nanvar(data, axis=axis)
+    return np.var(data, axis=axis)
+
+
+
+def _nanmean_trials(data, out):
+    """
+    Average the trials of each channel, ignoring NaNs. When the data is large, the channels are divided over a pool of
+    threads (each averaging a block of channels)
+
+    Args:
+        data (ndarray):                     The epoch data to average (format: channel x trials x time)
+        out (ndarray):                      The output matrix to store the averages in (format: channel x time)
+
+    Note:   The reductions in numpy release the GIL, so the blocks are averaged in parallel. Every channel is reduced
+            on its own, which yields exactly the same result as averaging all channels at once
+    """
+    num_workers = min(os.cpu_count() or 1, data.shape[0])
+    if num_workers < 2 or data.nbytes < _PARALLEL_AVERAGE_MIN_BYTES:
+        out[:] = _nanmean(data, axis=1)
+        return
+
+    # average the blocks of channels on a pool of threads
+    def average_channels(channel_start, channel_end):
+        out[channel_start:channel_end] = _nanmean(data[channel_start:channel_end], axis=1)
+
+    from concurrent.futures import ThreadPoolExecutor
+    block_bounds = np.linspace(0, data.shape[0], num_workers + 1).astype(int).tolist()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(average_channels, block_bounds[block_idx], block_bounds[block_idx + 1])
+                   for block_idx in range(num_workers)]
+        for future in futures:
+            future.result()
+
+# the function to calculate the baseline value(s) with, for each baseline normalization method (1 = mean, 2 = median)
+_BASELINE_FUNCTIONS = {1: _nanmean, 2: _nanmedian}
+
+
+def _compute_trial_bounds(onsets, sampling_rate, trial_epoch, baseline_epoch, data_num_samples, out_of_bound_method,
+                          first_in_data=True, last_in_data=True):
+    """
+    Calculate the sample ranges and the out-of-bound states of a set of trials at once
+
+    Args:
+        onsets (list or tuple):             The onsets of the trials (in seconds)
+        sampling_rate (int or double):      The sampling rate of the data
+        trial_epoch (tuple):                The time-span of the trial-epoch, expressed as a tuple with the start- and
+                                            end-point in seconds relative to the trial onset
+        baseline_epoch (None or tuple):     The time-span of the baseline-epoch, expressed as a tuple with the start- and
+                                            end-point in seconds relative to the trial onset
+        data_num_samples (int):             The number of samples in the data
+        out_of_bound_method (int):          The out-of-bound handling method (0 = error, 1 = first_last_only, 2 = allow)
+        first_in_data (bool):               Whether the first trial is the first trial in the data-set, which
+                                            determines whether it is allowed out-of-bounds by the 'first_last_only' method
+        last_in_data (bool):                Whether the last trial is the last trial in the data-set, which
+                                            determines whether it is allowed out-of-bounds by the 'first_last_only' method
+
+    Returns:
+        trial_sample_starts (ndarray):      The (unclipped) start sample of each trial-epoch in the data
+        baseline_sample_starts (ndarray):   The start sample of each baseline-epoch in the data (the start sample of
+                                            each trial-epoch if no baseline-epoch is given)
+        local_starts (ndarray):             The start sample of each trial in the epoch (after clipping)
+        local_ends (ndarray):               The end sample of each trial in the epoch (after clipping)
+        clipped_starts (ndarray):           The start sample of each trial in the data (after clipping)
+        clipped_ends (ndarray):             The end sample of each trial in the data (after clipping)
+        trial_states (ndarray):             The out-of-bound state (as bit-flags) of each trial
+        allowed_states (ndarray):           The out-of-bound states (as bit-flags) of each trial that are allowed by
+                                            the out-of-bound handling method
+    """
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(sampling_rate, trial_epoch, baseline_epoch)
+
+    # calculate the sample indices for all trials at once
+    # Note: np.rint rounds half to even, which is the same as the built-in round()
+    onsets_arr = np.asarray(onsets, dtype=np.float64)
+    trial_sample_starts = np.rint((onsets_arr + trial_epoch[0]) * sampling_rate).astype(np.int64)
+    trial_sample_ends = trial_sample_starts + trial_num_samples
+    if baseline_epoch is None:
+        baseline_sample_starts = trial_sample_starts
+    else:
+        baseline_sample_starts = np.rint((onsets_arr + baseline_epoch[0]) * sampling_rate).astype(np.int64)
+
+    # determine (for each trial) the range of the trial-epoch that lies within the data
+    local_starts = np.maximum(0, -trial_sample_starts)
+    local_ends = trial_num_samples - np.maximum(0, trial_sample_ends - data_num_samples)
+    clipped_starts = np.maximum(trial_sample_starts, 0)
+    clipped_ends = np.minimum(trial_sample_ends, data_num_samples)
+
+    # tag the out-of-bound state of each trial (as bit-flags, ordered as the checks would be performed)
+    trial_states = np.zeros(len(onsets_arr), dtype=np.int8)
+    trial_states[trial_sample_ends < 0] = _OOB_SKIP_BEFORE
+    trial_states[(trial_sample_starts < 0) & (trial_sample_ends >= 0)] |= _OOB_CLIP_START
+    trial_states[trial_sample_starts > data_num_samples] = _OOB_SKIP_AFTER
+    trial_states[(trial_sample_ends > data_num_samples) & (trial_sample_starts <= data_num_samples)] |= _OOB_CLIP_END
+
+    # determine which of the out-of-bound states are allowed by the out-of-bound handling method
+    if out_of_bound_method == 2:
+        allowed_states = trial_states.copy()
+    else:
+        allowed_states = np.zeros(len(onsets_arr), dtype=np.int8)
+        if out_of_bound_method == 1 and len(onsets_arr) > 0:
+            if first_in_data:
+                allowed_states[0] |= trial_states[0] & (_OOB_SKIP_BEFORE | _OOB_CLIP_START)
+            if last_in_data:
+                allowed_states[-1] |= trial_states[-1] & (_OOB_SKIP_AFTER | _OOB_CLIP_END)
+
+    return trial_sample_starts, baseline_sample_starts, local_starts, local_ends, clipped_starts, clipped_ends, \
+           trial_states, allowed_states
+
+
+def _check_trial_bounds(onsets, trial_sample_starts, baseline_sample_starts, local_starts, local_ends,
+                        trial_states, allowed_states, trial_num_samples, baseline_num_samples, baseline_method):
+    """
+    Check the out-of-bound states and baseline ranges (as calculated by _compute_trial_bounds) of a set of trials,
+    in order of the trials. A warning is logged for each allowed out-of-bound trial and an error is raised at the first
+    trial that is not allowed to be out-of-bounds or of which the baseline cannot be extracted
+
+    Args:
+        onsets (list or tuple):             The onsets of the trials (in seconds)
+        trial_states (ndarray):             The out-of-bound state (as bit-flags) of each trial
+        allowed_states (ndarray):           The out-of-bound states (as bit-flags) of each trial that are allowed
+        trial_num_samples (int):            The number of samples in the trial-epoch
+        baseline_num_samples (int):         The number of samples in the baseline-epoch
+        baseline_method (int):              The baseline normalization method (0 = none, 1 = mean, 2 = median)
+
+    Returns:
+        baseline_local_starts (ndarray):    The start sample of each baseline relative to the start of the trial-epoch
+
+    Raises:
+        RuntimeError:                       Raised when a trial cannot be extracted or its baseline cannot be extracted
+    """
+    trials_skip = (trial_states & (_OOB_SKIP_BEFORE | _OOB_SKIP_AFTER)) != 0
+
+    # calculate the baseline range relative to the start of each trial-epoch
+    baseline_local_starts = baseline_sample_starts - trial_sample_starts
+    baseline_local_ends = baseline_local_starts + baseline_num_samples
+    baselines_invalid = np.zeros(len(trial_states), dtype=bool)
+    if baseline_method > 0:
+        baselines_invalid = ~trials_skip & ((baseline_local_starts < 0) | (baseline_local_ends > trial_num_samples) |
+                                            (baseline_local_starts < local_starts) | (baseline_local_ends > local_ends))
+
+    # only the out-of-bound trials and invalid baselines (usually few) need to be checked one by one
+    for trial_idx in np.flatnonzero((trial_states != 0) | baselines_invalid):
+        for state, message in _OOB_MESSAGES:
+            if trial_states[trial_idx] & state:
+                if allowed_states[trial_idx] & state:
+                    logging.warning('Cannot extract the trial with onset %s, %s', onsets[trial_idx], message)
+                else:
+                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', ' + message + ' Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
+                    raise RuntimeError('Cannot extract trial')
+
+        if baselines_invalid[trial_idx]:
+            if baseline_local_starts[trial_idx] < 0:
+                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the start of the baseline-epoch lies before the start of the trial-epoch')
+                raise RuntimeError('Cannot extract baseline')
+            if baseline_local_ends[trial_idx] > trial_num_samples:
+                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the end of the baseline-epoch lies outside of the trial-epoch')
+                raise RuntimeError('Cannot extract baseline')
+            logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the range for the baseline lies outside of the trial-epoch because that part of the trial-epoch was out-of-bounds')
+            raise RuntimeError('Cannot extract baseline')
+
+    return baseline_local_starts
+
+
+def _group_trial_reads(trial_indices, clipped_starts, clipped_ends, max_gap, max_span):
+    """
+    Group the sample-ranges of trials that lie close together in the data, so that the data of each group of trials
+    can be retrieved with a single read
+
+    Args:
+        trial_indices (list):               The indices of the trials to group
+        clipped_starts (list):              The start sample of each trial in the data (after clipping)
+        clipped_ends (list):                The end sample of each trial in the data (after clipping)
+        max_gap (int):                      The maximum number of samples between two trials in the same group
+        max_span (int):                     The maximum number of samples that a group of trials may span. A trial that
+                                            spans more than this on its own will still be in a group (by itself)
+
+    Returns:
+        read_groups (list):                 A list of tuples with the start sample, end sample and the trial indices of
+                                            each group, ordered by their start sample
+    """
+    read_groups = []
+    for trial_idx in sorted(trial_indices, key=clipped_starts.__getitem__):
+        trial_start = clipped_starts[trial_idx]
+        trial_end = clipped_ends[trial_idx]
+
+        # add the trial to the current group if it lies close enough and the group does not become too large
+        if read_groups:
+            group = read_groups[-1]
+            if trial_start - group[1] <= max_gap and max(group[1], trial_end) - group[0] <= max_span:
+                group[1] = max(group[1], trial_end)
+                group[2].append(trial_idx)
                 continue
+
+        # start a new group
+        read_groups.append([trial_start, trial_end, [trial_idx]])
+
+    return [tuple(group) for group in read_groups]
+
+
+def _select_epoch_routine__bv(data_reader, preload_data):
+    if not preload_data and data_reader.bv_hdr['data_orientation'] == 'VECTORIZED':
+        # tests (test_epoch_nonpreproc_perf.py) show that by channels iterations seems faster for non-preloaded Brainvision vectorized data
+        return _load_data_epochs__by_channels
+    return _load_data_epochs__by_trials
+
+
+# format specific selectors of the (non-preprocessing) epoching routine, formats without an entry use by-trial reading
+_EPOCH_ROUTINE_SELECTORS = {'bv': _select_epoch_routine__bv}
+
+
+def _select_epoch_routine(data_reader, preload_data):
+    """
+    Select the routine to epoch (non-preprocessed) data with, based on the data format and read condition
+
+    Args:
+        data_reader (IeegDataReader):       An instance of the IeegDataReader to retrieve metadata and channel data
+        preload_data (bool):                Whether the data is preloaded into memory
+
+    Returns:
+        epoch_routine (callable):           The epoching routine, either _load_data_epochs__by_channels or
+                                            _load_data_epochs__by_trials
+
+    Note:   Tests (test_epoch_nonpreproc_perf.py) show that, except for the registered format specific conditions, all
+            read conditions benefit from by-trial reading. Format-tuned routines can be added to _EPOCH_ROUTINE_SELECTORS
+            without changing the callers.
+    """
+    selector = _EPOCH_ROUTINE_SELECTORS.get(data_reader.data_format)
+    if selector is None:
+        return _load_data_epochs__by_trials
+    return selector(data_reader, preload_data)
+
+
+def _allocate_data_epochs(ref_data, num_channels, num_trials, trial_num_samples, dtype=np.float64, spill_to_disk=False):
+    """
+    Allocate an epoch output matrix (format: channel x trials/epochs x time), or check and return the output matrix that
+    was already allocated by the caller
+
+    Args:
+        ref_data (None or ndarray):         An already allocated output matrix, or None to allocate a new one
+        num_channels (int):                 The number of channels
+        num_trials (int):                   The number of trials/epochs
+        trial_num_samples (int):            The number of samples in each trial-epoch
+        dtype (type):                       The data-type of the matrix to allocate (not applied to a passed matrix)
+        spill_to_disk (bool):               Back the matrix by a temporary file (memory-mapped) when there is not enough
+                                            memory available to allocate it, instead of raising an error
+
+    Returns:
+        data (ndarray):                     The output matrix
+
+    Note 1: the matrix is kept in C-order, so the samples of a single channel-trial epoch (data[channel, trial, :]) are
+            contiguous in memory. Every epoching routine writes (and averages) along that last axis, which makes each
+            epoch write a single contiguous copy
+    Note 2: the matrix is not initialized. The epoching routines write every sample of the output (NaNs for the
+            out-of-bound parts of trials), which saves a full pass over the (potentially very large) matrix
+    """
+
+    if ref_data is None:
+        try:
+            return allocate_array((num_channels, num_trials, trial_num_samples), fill_value=None, dtype=dtype,
+                                  spill_to_disk=spill_to_disk)
+        except MemoryError:
+            raise MemoryError('Not enough memory create a data output matrix')
+
+    if ref_data.shape != (num_channels, num_trials, trial_num_samples):
+        logging.error('The dimensions of the passed output matrix ' + str(ref_data.shape) + ' do not match the expected dimensions ' + str((num_channels, num_trials, trial_num_samples)))
+        raise RuntimeError('Output matrix dimension mismatch')
+    if not ref_data.flags['C_CONTIGUOUS']:
+        logging.error('The passed output matrix is not C-contiguous, the epoch samples (last dimension) should be contiguous in memory')
+        raise RuntimeError('Output matrix not C-contiguous')
+    return ref_data
+
+
+def _epoch_copy_kernel(ref_data, channel_idx, channel_data, trials, trial_sample_starts,
+                       local_starts, local_ends, clipped_starts, clipped_ends, baselines=None):
+    """
+    Copy (and optionally subtract the baseline from) the trial-epochs of a single channel into the output matrix. The
+    trials that lie entirely within the data are gathered and stored in a single vectorized operation, only the clipped
+    (out-of-bound) trials are copied one by one and padded with NaNs where they lie outside of the data
+
+    Args:
+        ref_data (ndarray):                 The output matrix (format: channel x trials/epochs x time)
+        channel_idx (int):                  The index of the channel in the output matrix
+        channel_data (ndarray):             The data of the channel (1d, C-contiguous)
+        trials (ndarray):                   The indices of the trials to copy
+        trial_sample_starts (ndarray):      The (unclipped) start sample of each trial in the channel data
+        local_starts (ndarray):             The start sample of each trial in the epoch (after clipping)
+        local_ends (ndarray):               The end sample of each trial in the epoch (after clipping)
+        clipped_starts (ndarray):           The start sample of each trial in the channel data (after clipping)
+        clipped_ends (ndarray):             The end sample of each trial in the channel data (after clipping)
+        baselines (None or ndarray):        The baseline value to subtract for each of the trials to copy, or None to
+                                            only copy the trial data
+
+    Note: the trial data is always gathered (and thereby copied) from the channel data. Even if the channel input is a
+          data array (and not a view), it might be possible that epochs overlap; in addition, avoiding views ensures
+          there are no remaining references to the source numpy-array, allowing it to be cleared from memory
+    """
+    # the channel data should be contiguous in memory, so each trial-window (and the output) is read sequentially
+    assert channel_data.flags.c_contiguous
+    trial_num_samples = ref_data.shape[2]
+
+    # gather and store the trials that lie entirely within the data
+    # Note: the trials are gathered as rows from a (read-only) sliding window view on the channel data, which avoids
+    #       building a matrix of sample indices. The baseline subtraction is performed in the dtype of the channel
+    #       data (before storing)
+    trials_within = (local_starts[trials] == 0) & (local_ends[trials] == trial_num_samples)
+    if trials_within.any():
+        within_idx = trials[trials_within]
+        within_starts = trial_sample_starts[within_idx]
+        channel_windows = np.lib.stride_tricks.sliding_window_view(channel_data, trial_num_samples)
+
+        if within_idx[-1] - within_idx[0] + 1 == len(within_idx):
+            # the trials are consecutive (usually all but the first and last trial), which allows the gathered trials
+            # to be stored (and baseline normalized) into a single slice of the output matrix
+            # Note: np.take is not used to gather directly into the output, since it first makes a contiguous copy of
+            #       the (strided) sliding window view, which would hold every possible window of the channel data
+            out_data = ref_data[channel_idx, within_idx[0]:within_idx[-1] + 1, :]
+            if baselines is None:
+                out_data[:] = channel_windows[within_starts]
             else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_end > channel_data.size:
-            if (out_of_bound_method == 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                if channel_idx == 0:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set.')
-                local_end = trial_num_samples - (trial_sample_end - channel_data.size)
-                trial_sample_end = channel_data.size
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
+                np.subtract(channel_windows[within_starts], baselines[trials_within, None], out=out_data)
 
-        # check whether the baseline is within bounds
-        if baseline_method > 0:
-            if baseline_start_sample < 0 or baseline_end_sample > channel_data.size:
-                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the range for the baseline lies outside of the data')
-                raise RuntimeError('Cannot extract the baseline')
+        else:
+            within_data = channel_windows[within_starts]
+            if baselines is not None:
+                within_data -= baselines[trials_within, None]
+            ref_data[channel_idx, within_idx, :] = within_data
+            del within_data
+        del channel_windows
+
+    # loop through the (out-of-bound) trials that are clipped
+    # Note: only the out-of-bound part of the epoch is padded with NaNs, the output matrix is not required to be pre-filled
+    for trials_idx in np.flatnonzero(~trials_within):
+        trial_idx = trials[trials_idx]
+        trial_data = channel_data[clipped_starts[trial_idx]:clipped_ends[trial_idx]]
+        if baselines is not None:
+            trial_data = trial_data - baselines[trials_idx]
+        ref_data[channel_idx, trial_idx, :local_starts[trial_idx]] = np.nan
+        ref_data[channel_idx, trial_idx, local_starts[trial_idx]:local_ends[trial_idx]] = trial_data
+        ref_data[channel_idx, trial_idx, local_ends[trial_idx]:] = np.nan
+
+
+def _pad_clipped_trials(data, trial_states, local_starts, local_ends):
+    """
+    Pad the out-of-bound part of the trial-epochs that are clipped (i.e. lie partly outside of the data) with NaNs
+
+    Args:
+        data (ndarray):                     The epoch data, with the trials as the second-to-last and the time as the
+                                            last dimension (e.g. channel x trials/epochs x time or trials/epochs x time)
+        trial_states (ndarray):             The out-of-bound state (as bit-flags) of each trial
+        local_starts (ndarray):             The start sample of each trial in the epoch (after clipping)
+        local_ends (ndarray):               The end sample of each trial in the epoch (after clipping)
+
+    Note: the clipped trials are selected at once, so the trials that lie entirely within the data (usually all but
+          the first and last) do not need to be checked one by one while they are epoched
+    """
+    for trial_idx in np.flatnonzero((trial_states & (_OOB_CLIP_START | _OOB_CLIP_END)) != 0).tolist():
+        data[..., trial_idx, :local_starts[trial_idx]] = np.nan
+        data[..., trial_idx, local_ends[trial_idx]:] = np.nan
+
+
+def _check_channel_trial_bounds(onsets, baseline_sample_starts, trial_states, allowed_states,
+                                baseline_num_samples, channel_num_samples, baseline_method, log_warnings):
+    """
+    Check the out-of-bound states (as calculated by _compute_trial_bounds) and the baseline ranges of a set of trials
+    that are epoched from the data of a channel. A single warning is logged for the allowed out-of-bound trials and an
+    error is raised at the first trial that is not allowed to be out-of-bounds or of which the baseline lies outside of
+    the data
+
+    Args:
+        onsets (list or tuple):             The onsets of the trials (in seconds)
+        baseline_sample_starts (ndarray):   The start sample of each baseline-epoch in the data
+        trial_states (ndarray):             The out-of-bound state (as bit-flags) of each trial
+        allowed_states (ndarray):           The out-of-bound states (as bit-flags) of each trial that are allowed
+        baseline_num_samples (int):         The number of samples in the baseline-epoch
+        channel_num_samples (int):          The number of samples in the channel data
+        baseline_method (int):              The baseline normalization method (0 = none, 1 = mean, 2 = median)
+        log_warnings (bool):                Whether to log a warning for the allowed out-of-bound trials
+
+    Returns:
+        trials_skip (ndarray):              Whether each of the trials lies entirely outside of the data (and is skipped)
+
+    Raises:
+        RuntimeError:                       Raised when a trial cannot be extracted or its baseline cannot be extracted
+    """
+    baseline_sample_ends = baseline_sample_starts + baseline_num_samples
+    trials_skip = (trial_states & (_OOB_SKIP_BEFORE | _OOB_SKIP_AFTER)) != 0
+    disallowed_states = trial_states & ~allowed_states
+
+    # flag the trials that should raise an error (a disallowed state, or a baseline outside of the data)
+    trials_error = disallowed_states != 0
+    if baseline_method > 0:
+        trials_error |= ~trials_skip & ((baseline_sample_starts < 0) | (baseline_sample_ends > channel_num_samples))
+    error_idx = int(np.argmax(trials_error)) if trials_error.any() else None
+
+    # retrieve the first disallowed state (which determines the message) of the trial that errors
+    error_state = 0
+    if error_idx is not None:
+        error_state = int(disallowed_states[error_idx])
+        error_state &= -error_state
+
+    # report the allowed out-of-bound trials that precede the error (in order of the onsets)
+    # Note: a single summary warning is logged, the details for each trial are only formatted when debug logging is enabled
+    if log_warnings:
+        num_reported = len(onsets) if error_idx is None else error_idx + 1
+        reported_states = allowed_states[:num_reported].copy()
+        if error_idx is not None and error_state != 0:
+            reported_states[error_idx] &= error_state - 1
+        reported_trials = np.flatnonzero(reported_states)
+        if len(reported_trials) > 0:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                for trial_idx in reported_trials:
+                    for state, message in _OOB_MESSAGES:
+                        if reported_states[trial_idx] & state:
+                            logging.debug('Cannot extract the trial with onset %s, %s', onsets[trial_idx], message)
+            logging.warning('Cannot (fully) extract %d of %d trials, the trial-epochs lie (partly) outside of the data-set and are padded with NaNs (onsets: %s)',
+                            len(reported_trials), len(onsets), ', '.join(str(onsets[trial_idx]) for trial_idx in reported_trials))
+
+    # raise the error
+    if error_idx is not None:
+        if error_state != 0:
+            logging.error('Cannot extract the trial with onset ' + str(onsets[error_idx]) + ', ' + dict(_OOB_MESSAGES)[error_state] + ' Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
+            raise RuntimeError('Cannot extract trial')
+        logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[error_idx]) + ', the range for the baseline lies outside of the data')
+        raise RuntimeError('Cannot extract the baseline')
+
+    return trials_skip
 
-        # extract the trial data and perform baseline normalization on the trial if needed
-        if baseline_method == 0:
 
-            # Note: since we are not manipulating the data (which in the other cases converts a view to data), always
-            #       make a copy. Even if the channel input is a data array (and not a view), it might be possible that
-            #       epochs overlap; in addition, avoiding views ensures there are no remaining references to the source
-            #       numpy-array, allowing it to be cleared from memory
-            ref_data[channel_idx, trial_idx, local_start:local_end] = channel_data[trial_sample_start:trial_sample_end].copy()
+def __epoch_data__from_channel_data__by_trials(ref_data, channel_idx, channel_data, sampling_rate,
+                                               onsets, trial_epoch,
+                                               baseline_method, baseline_epoch, out_of_bound_method,
+                                               log_warnings=None, trial_bounds_cache=None):
+    """
+    Epoch the trial-data for a single channel by looping over the trial-onsets
 
-        elif baseline_method == 1:
-            baseline_mean = np.nanmean(channel_data[baseline_start_sample:baseline_end_sample])
-            ref_data[channel_idx, trial_idx, local_start:local_end] = channel_data[trial_sample_start:trial_sample_end] - baseline_mean
-        elif baseline_method == 2:
-            baseline_median = np.nanmedian(channel_data[baseline_start_sample:baseline_end_sample])
-            ref_data[channel_idx, trial_idx, local_start:local_end] = channel_data[trial_sample_start:trial_sample_end] - baseline_median
+    Args:
+        log_warnings (None or bool):        Whether to log a warning for each allowed out-of-bound trial. If None, the
+                                            warnings are only logged for the first channel (channel_idx = 0)
+        trial_bounds_cache (None or dict):  A dictionary, shared between the channels that are epoched with the same
+                                            onsets and epochs, in which the sample ranges and out-of-bound states of
+                                            the trials are stored (by the number of samples in the channel data). If
+                                            None, the trial bounds are calculated for this channel only
+    """
+
+    # calculate the size of the time dimension (in samples)
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(sampling_rate, trial_epoch, baseline_epoch)
+
+    # make sure the channel data is contiguous in memory
+    # Note: some readers can return a strided view of a channel (e.g. a row of multiplexed data). The trial windows
+    #       and baseline reductions read consecutive samples, which is only efficient (and vectorizable) on contiguous data
+    if not channel_data.flags.c_contiguous:
+        channel_data = np.ascontiguousarray(channel_data)
+
+    # retrieve the number of samples in the channel data once
+    channel_num_samples = channel_data.size
+
+    # calculate the sample ranges and out-of-bound states of all trials at once
+    # Note: the trial bounds only depend on the number of samples in the channel data (given the same onsets and
+    #       epochs), so these are calculated once and re-used for the other channels when a cache is passed
+    # Note: the cached arrays are only read from, so they can be shared between channels that are epoched in parallel
+    trial_bounds = None if trial_bounds_cache is None else trial_bounds_cache.get(channel_num_samples)
+    if trial_bounds is None:
+        trial_bounds = _compute_trial_bounds(onsets, sampling_rate, trial_epoch, baseline_epoch,
+                                             channel_num_samples, out_of_bound_method)
+        if trial_bounds_cache is not None:
+            trial_bounds_cache[channel_num_samples] = trial_bounds
+    trial_sample_starts, baseline_sample_starts, local_starts, local_ends, clipped_starts, clipped_ends, \
+        trial_states, allowed_states = trial_bounds
+    trials_skip = _check_channel_trial_bounds(onsets, baseline_sample_starts, trial_states, allowed_states,
+                                              baseline_num_samples, channel_num_samples, baseline_method,
+                                              log_warnings or (log_warnings is None and channel_idx == 0))
+
+    # the trials that lie entirely outside of the data are set to NaN
+    if trials_skip.any():
+        ref_data[channel_idx, trials_skip, :] = np.nan
+
+    # no baseline normalization, copy the trial data of the trials that can be extracted
+    trials_extract = np.flatnonzero(~trials_skip)
+    if baseline_method == 0:
+        _epoch_copy_kernel(ref_data, channel_idx, channel_data, trials_extract, trial_sample_starts,
+                           local_starts, local_ends, clipped_starts, clipped_ends)
+        return ref_data
+
+    # calculate the baseline of all the trials that can be extracted at once
+    # Note: the baseline ranges of these trials are guaranteed to lie within the data (checked above). The windows are
+    #       gathered from a sliding window view on the channel data, which avoids building a matrix of sample indices
+    baseline_data = np.lib.stride_tricks.sliding_window_view(channel_data, baseline_num_samples)[baseline_sample_starts[trials_extract]]
+    baselines = _BASELINE_FUNCTIONS[baseline_method](baseline_data, axis=1)
+    del baseline_data
+
+    # copy and baseline normalize the trial data
+    _epoch_copy_kernel(ref_data, channel_idx, channel_data, trials_extract, trial_sample_starts,
+                       local_starts, local_ends, clipped_starts, clipped_ends, baselines)
 
     # return success
     return ref_data
 
 
+def _retrieve_channel_data__by_ranges(data_reader, channel, max_read_num_samples):
+    """
+    Retrieve all the data of a single channel by reading consecutive sample ranges of a limited size
+
+    Args:
+        data_reader (IeegDataReader):       An instance of the IeegDataReader to retrieve metadata and channel data
+        channel (str):                      The channel (by name) of which the data should be retrieved
+        max_read_num_samples (int):         The maximum number of samples that is retrieved in a single read
+
+    Returns:
+        channel_data (ndarray):             The data of the channel (in the data-type that the reader returns)
+    """
+    channel_data = None
+    for range_start in range(0, data_reader.num_samples, max_read_num_samples):
+        range_end = min(range_start + max_read_num_samples, data_reader.num_samples)
+        range_data = data_reader.retrieve_sample_range_data(range_start, range_end, channel, False)[0]
+        if channel_data is None:
+            channel_data = np.empty(data_reader.num_samples, dtype=range_data.dtype)
+        channel_data[range_start:range_end] = range_data
+    return channel_data
+
+
 def _load_data_epochs__by_channels(data_reader, retrieve_channels,
                                    onsets, trial_epoch,
-                                   baseline_method, baseline_epoch, out_of_bound_method):
+                                   baseline_method, baseline_epoch, out_of_bound_method, ref_data=None, dtype=np.float64):
     """
-    Load data epochs to a matrix (format: channel x trials/epochs x time) by iterating over and loading data per channel
-    and retrieving the trial-epochs
+    Load data epochs to a matrix (format: channel x trials/epochs x time) by iterating over and loading data per block
+    of channels and retrieving the trial-epochs
 
     Args:
         data_reader (IeegDataReader):       An instance of the IeegDataReader to retrieve metadata and channel data
         retrieve_channels (list or tuple):  The channels (by name) of which the data should be retrieved, the output
                                             will be sorted accordingly
+        ref_data (None or ndarray):         An already allocated output matrix (format: channel x
+                                            trials/epochs x time) to write the epochs into. If None, a matrix will be allocated
+        dtype (type):                       The data-type of the output matrix, when one is allocated
     """
 
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
-
-    # initialize a data buffer (channel x trials/epochs x time)
-    try:
-        data = allocate_array((len(retrieve_channels), len(onsets), trial_num_samples),
-                              fill_value=np.nan, dtype=np.float64)
-    except MemoryError:
-        raise MemoryError('Not enough memory create a data output matrix')
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
+
+    # initialize a data buffer (channel x trials/epochs x time), or use the one that was passed
+    data = _allocate_data_epochs(ref_data, len(retrieve_channels), len(onsets), trial_num_samples, dtype=dtype)
+
+    # determine the number of channels to retrieve at once
+    # Note: retrieving a block of channels in a single reader call avoids the per-call overhead (e.g. opening the
+    #       file and looking up the channels) for each channel. The block size is limited to keep the memory
+    #       usage bounded (assuming 64-bit samples), since that is the reason to epoch by channels in the first place
+    block_num_channels = max(1, _CHANNEL_BLOCK_MAX_BYTES // (max(1, data_reader.num_samples) * 8))
+    max_read_num_samples = max(1, _CHANNEL_BLOCK_MAX_BYTES // 8)
+
+    # epoch the channels on a pool of threads, while the main thread retrieves the data of the next block of channels
+    # Note: only the main thread uses the data reader. Each channel is epoched into its own row of the output matrix,
+    #       and NumPy releases the GIL while copying, so the channels can be epoched in parallel. At most two blocks
+    #       of channel data (the one being epoched and the one being retrieved) are held in memory at the same time
+    from concurrent.futures import ThreadPoolExecutor
+    num_workers = max(1, min(os.cpu_count() or 1, len(retrieve_channels)))
+    trial_bounds_cache = dict()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        epoch_futures = []
+
+        # loop through the included channels (per block)
+        for block_start in range(0, len(retrieve_channels), block_num_channels):
+            block_channels = list(retrieve_channels[block_start:block_start + block_num_channels])
 
-    # loop through the included channels
-    for channel_idx in range(len(retrieve_channels)):
+            try:
 
-        try:
+                # retrieve the data of the channels in the block (as a list with a data array for each channel)
+                # Note: when a single channel does not fit in a block, the channel is retrieved in sample ranges of
+                #       the block size, so that each read remains capped
+                if max_read_num_samples < data_reader.num_samples:
+                    block_data = [_retrieve_channel_data__by_ranges(data_reader, block_channels[0], max_read_num_samples)]
+                else:
+                    block_data = data_reader.retrieve_sample_range_data(0, data_reader.num_samples, block_channels, False)
+
+                # wait for the channels of the previous block to be epoched (in order, so the first error is raised)
+                for epoch_future in epoch_futures:
+                    epoch_future.result()
+
+                # the very first channel is epoched on the main thread
+                # Note: the out-of-bound checks are the same for every channel (all channels have the same number of
+                #       samples), so an error (and the warnings) will arise on the first channel, before any other
+                #       channel is submitted
+                first_block_channel_idx = 0
+                if block_start == 0:
+                    __epoch_data__from_channel_data__by_trials(data,
+                                                              0, block_data[0],
+                                                              data_reader.sampling_rate,
+                                                              onsets, trial_epoch,
+                                                              baseline_method, baseline_epoch, out_of_bound_method,
+                                                              trial_bounds_cache=trial_bounds_cache)
+                    first_block_channel_idx = 1
+
+                # submit the data of each (other) channel to be epoched
+                epoch_futures = [executor.submit(__epoch_data__from_channel_data__by_trials, data,
+                                                 block_start + block_channel_idx, block_data[block_channel_idx],
+                                                 data_reader.sampling_rate,
+                                                 onsets, trial_epoch,
+                                                 baseline_method, baseline_epoch, out_of_bound_method,
+                                                 trial_bounds_cache=trial_bounds_cache)
+                                 for block_channel_idx in range(first_block_channel_idx, len(block_channels))]
+
+            except RuntimeError:
+                raise RuntimeError('Error upon loading and epoching data')
 
-            # retrieve the channel data
-            channel_data = data_reader.retrieve_channel_data(retrieve_channels[channel_idx], False)
+            #
+            del block_data
 
-            # epoch the channel data
-            __epoch_data__from_channel_data__by_trials(data,
-                                                      channel_idx, channel_data, data_reader.sampling_rate,
-                                                      onsets, trial_epoch,
-                                                      baseline_method, baseline_epoch, out_of_bound_method)
+        # wait for the channels of the last block to be epoched
+        try:
+            for epoch_future in epoch_futures:
+                epoch_future.result()
         except RuntimeError:
             raise RuntimeError('Error upon loading and epoching data')
 
-        #
-        del channel_data
-
     # return the sample rate and the epoched data
     return data_reader.sampling_rate, data
 
 
 def _load_data_epochs__by_trials(data_reader, retrieve_channels,
                                  onsets, trial_epoch,
-                                 baseline_method, baseline_epoch, out_of_bound_method):
+                                 baseline_method, baseline_epoch, out_of_bound_method, ref_data=None, dtype=np.float64):
     """
     Load data epochs to a matrix (format: channel x trials/epochs x time) by looping over and loading data per
     trial (for all channels) and retrieving the trial data by iterating over each of the channels
@@ -514,109 +1123,100 @@ def _load_data_epochs__by_trials(data_reader, retrieve_channels,
         data_reader (IeegDataReader):       An instance of the IeegDataReader to retrieve metadata and channel data
         retrieve_channels (list or tuple):  The channels (by name) of which the data should be retrieved, the output
                                             will be sorted accordingly
+        ref_data (None or ndarray):         An already allocated output matrix (format: channel x
+                                            trials/epochs x time) to write the epochs into. If None, a matrix will be allocated
+        dtype (type):                       The data-type of the output matrix, when one is allocated
     """
 
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
 
-    # initialize a data buffer (channel x trials/epochs x time)
-    try:
-        data = allocate_array((len(retrieve_channels), len(onsets), trial_num_samples),
-                              fill_value=np.nan, dtype=np.float64)
-    except MemoryError:
-        raise MemoryError('Not enough memory create a data output matrix')
+    # initialize a data buffer (channel x trials/epochs x time), or use the one that was passed
+    data = _allocate_data_epochs(ref_data, len(retrieve_channels), len(onsets), trial_num_samples, dtype=dtype)
 
-    # create progress bar
-    print_progressbar(0, len(onsets), prefix='Progress:', suffix='Complete', length=50)
+    # return the (empty) output matrix when there are no channels to retrieve
+    # Note: the readers return all channels when an empty list of channels is passed
+    if len(retrieve_channels) == 0:
+        return data_reader.sampling_rate, data
 
-    # loop through the trials
-    for trial_idx in range(len(onsets)):
+    # calculate the sample ranges and out-of-bound states of all trials at once, and check them (in order of the trials)
+    trial_sample_starts, baseline_sample_starts, local_starts, local_ends, clipped_starts, clipped_ends, \
+        trial_states, allowed_states = _compute_trial_bounds(onsets, data_reader.sampling_rate, trial_epoch, baseline_epoch,
+                                                             data_reader.num_samples, out_of_bound_method)
+    baseline_local_starts = _check_trial_bounds(onsets, trial_sample_starts, baseline_sample_starts,
+                                                local_starts, local_ends, trial_states, allowed_states,
+                                                trial_num_samples, baseline_num_samples, baseline_method)
+    trials_skip = (trial_states & (_OOB_SKIP_BEFORE | _OOB_SKIP_AFTER)) != 0
+
+    # the trials that lie entirely outside of the data are set to NaN, and the out-of-bound part of the trials that
+    # lie partly outside of the data are padded with NaNs, this leaves only the in-bound parts to be epoched per trial
+    if trials_skip.any():
+        data[:, trials_skip, :] = np.nan
+    _pad_clipped_trials(data, trial_states, local_starts, local_ends)
+    trials_extract = np.flatnonzero(~trials_skip).tolist()
+
+    # convert the indices to built-in integers, since the data-readers only accept those as range arguments
+    clipped_starts = clipped_starts.tolist()
+    clipped_ends = clipped_ends.tolist()
+    local_starts = local_starts.tolist()
+    local_ends = local_ends.tolist()
+    baseline_local_starts = baseline_local_starts.tolist()
+
+    # retrieve the values that are used for every trial as locals
+    num_onsets = len(onsets)
+    baseline_function = _BASELINE_FUNCTIONS.get(baseline_method)
 
-        #
-        trial_sample_start = int(round((onsets[trial_idx] + trial_epoch[0]) * data_reader.sampling_rate))
-        trial_sample_end = trial_sample_start + trial_num_samples
-        baseline_start_sample = int(round((onsets[trial_idx] + baseline_epoch[0]) * data_reader.sampling_rate)) - trial_sample_start
+    # create progress bar
+    # Note: the progress bar is only updated every percent (and at the end), with many (small) trials the
+    #       formatting and printing would otherwise take up a considerable part of the time
+    print_progressbar(0, num_onsets, prefix='Progress:', suffix='Complete', length=50)
+    progress_step = max(1, num_onsets // 100)
+
+    # loop through the trials that lie (partly) within the data
+    for trial_idx in trials_extract:
+        local_start = local_starts[trial_idx]
+        local_end = local_ends[trial_idx]
+        baseline_start_sample = baseline_local_starts[trial_idx]
         baseline_end_sample = baseline_start_sample + baseline_num_samples
-        local_start = 0
-        local_end = trial_num_samples
-
-        # check whether the trial epoch is within bounds
-        if trial_sample_end < 0:
-            if (out_of_bound_method == 1 and trial_idx == 0) or out_of_bound_method == 2:
-                logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set.')
-                continue
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_start < 0:
-            if (out_of_bound_method == 1 and trial_idx == 0) or out_of_bound_method == 2:
-                logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set.')
-                local_start = trial_sample_start * -1
-                trial_sample_start = 0
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_start > data_reader.num_samples:
-            if (out_of_bound_method == 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set.')
-                continue
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-        if trial_sample_end > data_reader.num_samples:
-            if (out_of_bound_method == 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set.')
-                local_end = trial_num_samples - (trial_sample_end - data_reader.num_samples)
-                trial_sample_end = data_reader.num_samples
-            else:
-                logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                raise RuntimeError('Cannot extract trial')
-
-        # check whether the baseline is within bounds
-        if baseline_method > 0:
-            if baseline_start_sample < 0:
-                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the start of the baseline-epoch lies before the start of the trial-epoch')
-                raise RuntimeError('Cannot extract baseline')
-            if baseline_end_sample > trial_num_samples:
-                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the end of the baseline-epoch lies outside of the trial-epoch')
-                raise RuntimeError('Cannot extract baseline')
-            if baseline_start_sample < local_start or baseline_end_sample > local_end:
-                logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the range for the baseline lies outside of the trial-epoch because that part of the trial-epoch was out-of-bounds')
-                raise RuntimeError('Cannot extract baseline')
 
         # load the trial data
         try:
-            trial_data = data_reader.retrieve_sample_range_data(trial_sample_start, trial_sample_end,
+            trial_data = data_reader.retrieve_sample_range_data(clipped_starts[trial_idx], clipped_ends[trial_idx],
                                                                 channels=retrieve_channels, ensure_own_data=False)
         except (RuntimeError, LookupError):
             raise RuntimeError('Could not load data')
 
-        # loop through the channels
-        for channel_idx in range(len(retrieve_channels)):
-
-            # extract the trial data and perform baseline normalization on the trial if needed
-            if baseline_method == 0:
-                # Note: since we are not manipulating the data (which in the other cases converts a view to data), ensure
-                #       the epoch has its own data (not a view). Avoiding views prevents trouble with overlapping
-                #       epochs; in addition, avoiding views ensures there are no remaining references to the source
-                #       numpy-array, allowing it to be cleared from memory
-                if trial_data[channel_idx].base is None:
-                    data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx]
-                else:
-                    data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx].copy()
-            elif baseline_method == 1:
-                baseline_mean = np.nanmean(trial_data[channel_idx][baseline_start_sample:baseline_end_sample])
-                data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx] - baseline_mean
-            elif baseline_method == 2:
-                baseline_median = np.nanmedian(trial_data[channel_idx][baseline_start_sample:baseline_end_sample])
-                data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx] - baseline_median
+        # extract the trial data and perform baseline normalization on the trial if needed
+        if baseline_method == 0:
+
+            # stack the data of the channels directly into the output matrix
+            # Note: the assignment into the output matrix already copies the data, so the epoch never references (a
+            #       view on) the retrieved data. This prevents trouble with overlapping epochs and allows the source
+            #       numpy-array to be cleared from memory, without the need for an additional copy
+            np.stack(trial_data, out=data[:, trial_idx, local_start:local_end])
+
+        else:
+
+            # stack the trial data (a list with the data of each channel) and calculate the baselines of all channels
+            # in a single reduction (over the time axis) instead of one per channel
+            trial_data = np.asarray(trial_data)
+            baselines = baseline_function(trial_data[:, baseline_start_sample:baseline_end_sample], axis=1)
+
+            # subtract the baselines straight into the output matrix
+            # Note: the subtraction is performed in the data-type of the retrieved data and only the result is cast
+            #       to the data-type of the output matrix (e.g. 32-bit floats), without an intermediate copy of the
+            #       normalized trial data at the (often 64-bit) precision of the retrieved data
+            np.subtract(trial_data, baselines[:, None], out=data[:, trial_idx, local_start:local_end])
 
         # clear temp data
         del trial_data
 
         # update progress bar
-        print_progressbar(trial_idx + 1, len(onsets), prefix='Progress:', suffix='Complete', length=50)
+        if (trial_idx + 1) % progress_step == 0 and trial_idx + 1 < num_onsets:
+            print_progressbar(trial_idx + 1, num_onsets, prefix='Progress:', suffix='Complete', length=50)
+
+    # complete the progress bar (also when the last trials were skipped)
+    print_progressbar(num_onsets, num_onsets, prefix='Progress:', suffix='Complete', length=50)
 
     # return the sample rate and the epoched data
     return data_reader.sampling_rate, data
@@ -624,7 +1224,8 @@ def _load_data_epochs__by_trials(data_reader, retrieve_channels,
 
 def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channels,
                                                    conditions_onsets, trial_epoch,
-                                                   baseline_method, baseline_epoch, out_of_bound_method, metric_callbacks):
+                                                   baseline_method, baseline_epoch, out_of_bound_method, metric_callbacks,
+                                                   dtype=np.float64):
     """
     Load data epoch averages to a matrix (format: channel x condition x time) by looping over conditions, looping over
     the trials within a condition and then load the data per condition-trial (for all channels) and perform
@@ -635,13 +1236,12 @@ def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channel
 
 
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
 
     # initialize a data buffer (channel x conditions x samples)
     try:
         data = allocate_array((len(retrieve_channels), len(conditions_onsets), trial_num_samples),
-                              fill_value=np.nan, dtype=np.float64)
+                              fill_value=np.nan, dtype=dtype)
     except MemoryError:
         raise MemoryError('Not enough memory create a data output matrix')
 
@@ -658,16 +1258,52 @@ def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channel
     except MemoryError:
         raise MemoryError('Not enough memory create metric output matrix')
 
-    # create progress bar
+    # return the (empty) output matrices when there are no channels to retrieve
+    # Note: the readers return all channels when an empty list of channels is passed
+    if len(retrieve_channels) == 0:
+        return data_reader.sampling_rate, data, metric_values
+
+    # create progress bar (updated every percent of the conditions and at the end)
     print_progressbar(0, len(conditions_onsets), prefix='Progress:', suffix='Complete', length=50)
+    progress_step = max(1, len(conditions_onsets) // 100)
 
     # if the conditions_onsets is a dict, then only retrieve the condition keys once
     conditions_keys = None
     if isinstance(conditions_onsets, dict):
         conditions_keys = list(conditions_onsets.keys())
 
+    # retrieve the values that are used for every trial as locals
+    sampling_rate = data_reader.sampling_rate
+    data_num_samples = data_reader.num_samples
+    num_conditions = len(conditions_onsets)
+    baseline_function = _BASELINE_FUNCTIONS.get(baseline_method)
+    max_read_num_samples = max(trial_num_samples, _RANGE_READ_MAX_BYTES // (max(1, len(retrieve_channels)) * 8))
+
+    # initialize a buffer to put all the data for a condition in (channels x trials x samples), sized to the condition
+    # with the most trials so it can be reused for every condition
+    # Note: the buffer is not initialized, every trial is either written or set to NaN (when it lies outside of the
+    #       data) before the trials are averaged. The same applies to the baseline buffer
+    max_num_trials = max((len(onsets) for onsets in (conditions_onsets.values() if conditions_keys is not None else conditions_onsets)), default=0)
+    try:
+        condition_buffer = allocate_array((len(retrieve_channels), max_num_trials, trial_num_samples),
+                                          fill_value=None, dtype=np.float64)
+    except MemoryError:
+        raise MemoryError('Not enough memory create an condition-data matrix')
+
+    # if baseline normalization is needed and the pre-average callback function is defined, then we first need
+    # to accumulate the full (i.e. channels x trials x samples) un-normalized subset to provide to the function.
+    # Therefore, we initialize an array to store the baseline values for each channel x trial, so we can normalize
+    # after the callback
+    baseline_buffer = None
+    if not baseline_method == 0 and metric_callbacks is not None:
+        try:
+            baseline_buffer = allocate_array((len(retrieve_channels), max_num_trials, baseline_num_samples),
+                                             fill_value=None, dtype=np.float64)
+        except MemoryError:
+            raise MemoryError('Not enough memory create temporary baseline-data matrix')
+
     # loop through the conditions
-    for condition_idx in range(len(conditions_onsets)):
+    for condition_idx in range(num_conditions):
 
         # retrieve the onsets for this condition
         if conditions_keys is not None:
@@ -675,91 +1311,76 @@ def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channel
         else:
             onsets = conditions_onsets[condition_idx]
 
-        # initialize a buffer to put all the data for this condition in (channels x trials x samples)
-        try:
-            condition_data = allocate_array((len(retrieve_channels), len(onsets), trial_num_samples),
-                                            fill_value=np.nan, dtype=np.float64)
-        except MemoryError:
-            raise MemoryError('Not enough memory create an condition-data matrix')
-
-        # if baseline normalization is needed and the pre-average callback function is defined, then we first need
-        # to accumulate the full (i.e. channels x trials x samples) un-normalized subset to provide to the function.
-        # Therefore, we initialize an array to store the baseline values for each channel x trial, so we can normalize
-        # after the callback
+        # use the part of the buffers that is needed for this condition (channels x trials x samples)
+        condition_data = condition_buffer[:, :len(onsets), :]
         baseline_data = None
-        if not baseline_method == 0 and metric_callbacks is not None:
-            try:
-                baseline_data = allocate_array((len(retrieve_channels), len(onsets), baseline_num_samples),
-                                               fill_value=np.nan, dtype=np.float64)
-            except MemoryError:
-                raise MemoryError('Not enough memory create temporary baseline-data matrix')
-
-        # loop through the trials in the condition
-        for trial_idx in range(len(onsets)):
-
-            # calculate the sample indices
-            trial_sample_start = int(round((onsets[trial_idx] + trial_epoch[0]) * data_reader.sampling_rate))
-            trial_sample_end = trial_sample_start + trial_num_samples
-            baseline_start_sample = int(round((onsets[trial_idx] + baseline_epoch[0]) * data_reader.sampling_rate)) - trial_sample_start
-            baseline_end_sample = baseline_start_sample + baseline_num_samples
-            local_start = 0
-            local_end = trial_num_samples
-
-            # check whether the trial epoch is within bounds
-            if trial_sample_end < 0:
-                if (out_of_bound_method == 1 and condition_idx == 0 and trial_idx == 0) or out_of_bound_method == 2:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set.')
-                    continue
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_start < 0:
-                if (out_of_bound_method == 1 and condition_idx == 0 and trial_idx == 0) or out_of_bound_method == 2:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set.')
-                    local_start = trial_sample_start * -1
-                    trial_sample_start = 0
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_start > data_reader.num_samples:
-                if (out_of_bound_method == 1 and condition_idx == len(conditions_onsets) - 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set.')
-                    continue
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_end > data_reader.num_samples:
-                if (out_of_bound_method == 1 and condition_idx == len(conditions_onsets) - 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                    logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set.')
-                    local_end = trial_num_samples - (trial_sample_end - data_reader.num_samples)
-                    trial_sample_end = data_reader.num_samples
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-
-            # check whether the baseline is within bounds
-            if baseline_method > 0:
-                if baseline_start_sample < 0:
-                    logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the start of the baseline-epoch lies before the start of the trial-epoch')
-                    raise RuntimeError('Cannot extract baseline')
-                if baseline_end_sample > trial_num_samples:
-                    logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the end of the baseline-epoch lies outside of the trial-epoch')
-                    raise RuntimeError('Cannot extract baseline')
-                if baseline_start_sample < local_start or baseline_end_sample > local_end:
-                    logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the range for the baseline lies outside of the trial-epoch because that part of the trial-epoch was out-of-bounds')
-                    raise RuntimeError('Cannot extract baseline')
-
-            # load the trial data
+        if baseline_buffer is not None:
+            baseline_data = baseline_buffer[:, :len(onsets), :]
+
+        # calculate the sample ranges and out-of-bound states of all the trials in the condition at once
+        # Note: the first and last trial in the data-set are the first trial of the first condition and the last trial
+        #       of the last condition, only those are allowed out-of-bounds with the 'first_last_only' method
+        trial_sample_starts, baseline_sample_starts, local_starts, local_ends, clipped_starts, clipped_ends, \
+            trial_states, allowed_states = _compute_trial_bounds(onsets, sampling_rate, trial_epoch, baseline_epoch,
+                                                                 data_num_samples, out_of_bound_method,
+                                                                 first_in_data=condition_idx == 0,
+                                                                 last_in_data=condition_idx == num_conditions - 1)
+        trials_skip = (trial_states & (_OOB_SKIP_BEFORE | _OOB_SKIP_AFTER)) != 0
+
+        # check the out-of-bound trials and baselines, in order of the trials
+        # Note: the baseline is taken from the retrieved trial data, which starts at the clipped start of the trial
+        baseline_local_starts = _check_trial_bounds(onsets, trial_sample_starts, baseline_sample_starts,
+                                                    local_starts, local_ends, trial_states, allowed_states,
+                                                    trial_num_samples, baseline_num_samples, baseline_method)
+
+        # convert the indices to built-in integers, since the data-readers only accept those as range arguments
+        clipped_starts = clipped_starts.tolist()
+        clipped_ends = clipped_ends.tolist()
+        local_starts = local_starts.tolist()
+        local_ends = local_ends.tolist()
+        baseline_local_starts = baseline_local_starts.tolist()
+
+        # the trials that lie entirely outside of the data are set to NaN
+        if trials_skip.any():
+            condition_data[:, trials_skip, :] = np.nan
+            if baseline_data is not None:
+                baseline_data[:, trials_skip, :] = np.nan
+
+        # pad the out-of-bound part of the trials that lie partly outside of the data with NaNs
+        _pad_clipped_trials(condition_data, trial_states, local_starts, local_ends)
+
+        # group the trials in the condition that lie (partly) within the data and close to each other, so the data
+        # of each group can be retrieved in a single read
+        # Note: this amortizes the per-call overhead of the readers (e.g. decompressing MEF blocks or seeking in
+        #       the file) over the trials when these cluster. Only small gaps (up to a trial-epoch) are read through and
+        #       the size of a read is limited to keep the memory usage bounded (assuming 64-bit samples)
+        read_groups = _group_trial_reads(np.flatnonzero(~trials_skip).tolist(), clipped_starts, clipped_ends,
+                                         max_gap=trial_num_samples, max_span=max_read_num_samples)
+
+        # loop through the groups of trials
+        range_data = trial_data = None
+        for read_start, read_end, read_trials in read_groups:
+
+            # load the data of the group of trials
             try:
-                trial_data = data_reader.retrieve_sample_range_data(trial_sample_start, trial_sample_end,
-                                                                    channels=retrieve_channels, ensure_own_data=False)
+                range_data = np.asarray(data_reader.retrieve_sample_range_data(read_start, read_end,
+                                                                               channels=retrieve_channels,
+                                                                               ensure_own_data=False))
             except (RuntimeError, LookupError):
                 raise RuntimeError('Could not load data')
 
-            # loop through the channels
-            for channel_idx in range(len(retrieve_channels)):
+            # loop through the trials in the group
+            for trial_idx in read_trials:
+                local_start = local_starts[trial_idx]
+                local_end = local_ends[trial_idx]
+                baseline_start_sample = baseline_local_starts[trial_idx]
+                baseline_end_sample = baseline_start_sample + baseline_num_samples
 
-                # extract the trial data and perform baseline normalization on the trial if needed
+                # extract the trial data from the group data
+                range_offset = clipped_starts[trial_idx] - read_start
+                trial_data = range_data[:, range_offset:range_offset + local_end - local_start]
+
+                # extract the trial data of all channels at once and perform baseline normalization on the trial if needed
                 #
                 # except when there is a function callback. When a callback is then we need to first accumulate the
                 # full (i.e. channels x trials x epoch) un-normalized subset to provide to the function, and store
@@ -767,33 +1388,22 @@ def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channel
                 #
                 if baseline_method == 0 or metric_callbacks is not None:
 
+                    # store the data of the channels directly in the condition buffer
                     # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
                     #       later. Assume metric_callback does not manipulate the data it is given
-                    condition_data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx]
-
-                if baseline_method == 1:
-
-                    if metric_callbacks is None:
-                        # no callback, normalize and store the trial data with baseline applied
-                        condition_data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx] - np.nanmean(trial_data[channel_idx][baseline_start_sample:baseline_end_sample])
-
-                    else:
-                        # callback, store the baseline values for later use
-                        # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
-                        #       later. Assume metric_callback does not manipulate the data it is given
-                        baseline_data[channel_idx, trial_idx, :] = trial_data[channel_idx][baseline_start_sample:baseline_end_sample]
+                    condition_data[:, trial_idx, local_start:local_end] = trial_data
 
-                elif baseline_method == 2:
+                    if baseline_method > 0:
+                        # callback, store the baseline values for later use (taken from the stored trial data, which
+                        # starts at local_start in the condition buffer)
+                        baseline_data[:, trial_idx, :] = condition_data[:, trial_idx, local_start + baseline_start_sample:local_start + baseline_end_sample]
 
-                    if metric_callbacks is None:
-                        # no callback, normalize and store the trial data with baseline applied
-                        condition_data[channel_idx, trial_idx, local_start:local_end] = trial_data[channel_idx] - np.nanmedian(trial_data[channel_idx][baseline_start_sample:baseline_end_sample])
+                else:
 
-                    else:
-                        # callback, store the baseline values for later use
-                        # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
-                        #       later. Assume metric_callback does not manipulate the data it is given
-                        baseline_data[channel_idx, trial_idx, :] = trial_data[channel_idx][baseline_start_sample:baseline_end_sample]
+                    # no callback, calculate the baselines of all channels in a single reduction (over the time axis), then
+                    # normalize and store the trial data with baseline applied
+                    baselines = baseline_function(trial_data[:, baseline_start_sample:baseline_end_sample], axis=1)
+                    np.subtract(trial_data, baselines[:, None], out=condition_data[:, trial_idx, local_start:local_end])
 
         # check if a pre-averaging callback function is defined
         metric = None
@@ -824,20 +1434,23 @@ def _load_data_epoch_averages__by_condition_trials(data_reader, retrieve_channel
                             if metric_value is not None:
                                 metric_values[channel_idx, condition_idx, iCallback] = metric_value
 
-            # the callback has been made, perform -if needed- the (postponed) normalization with the baseline values
-            if baseline_method == 1:
-                condition_data -= np.nanmean(baseline_data, axis=2)[:, :, None]
-            elif baseline_method == 2:
-                condition_data -= np.nanmedian(baseline_data, axis=2)[:, :, None]
+                # the callback(s) for this channel have been made, perform -if needed- the (postponed) normalization
+                # with the baseline values of this channel
+                # Note: normalizing per channel, directly after its callback(s), reuses the channel's trial and
+                #       baseline data while they are still in cache, instead of making another pass over the whole
+                #       condition. The callback(s) of the other channels only receive their own channel data
+                if baseline_method > 0:
+                    condition_data[channel_idx, :, :] -= baseline_function(baseline_data[channel_idx, :, :], axis=1)[:, None]
 
         # average the trials for each channel (within this condition) and store the results
-        data[:, condition_idx, :] = np.nanmean(condition_data, axis=1)
+        _nanmean_trials(condition_data, data[:, condition_idx, :])
 
         # clear reference to data
-        del condition_data, trial_data
+        del condition_data, baseline_data, range_data, trial_data
 
         # update progress bar
-        print_progressbar(condition_idx + 1, len(conditions_onsets), prefix='Progress:', suffix='Complete', length=50)
+        if (condition_idx + 1) % progress_step == 0 or condition_idx + 1 == num_conditions:
+            print_progressbar(condition_idx + 1, num_conditions, prefix='Progress:', suffix='Complete', length=50)
 
     # return the sample rate, the average epoch and the metric values (None if no metrics)
     return data_reader.sampling_rate, data, metric_values
@@ -873,11 +1486,14 @@ def __subload_data_epoch_averages__from_channel__by_condition_trials(ref_data, r
     else:
         channel_num_samples = channel_data.size
 
+        # make sure the channel data is contiguous in memory, so the trial (and baseline) slices are read sequentially
+        if not channel_data.flags.c_contiguous:
+            channel_data = np.ascontiguousarray(channel_data)
+
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
 
     if baseline_method > 0:
-        baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
 
         # if the epochs should be baselined and common average re-referencing should be applied, make sure that the baseline
         # window is within the trial window (because the common averages that are passed for re-referencing cover only
@@ -911,269 +1527,492 @@ def __subload_data_epoch_averages__from_channel__by_condition_trials(ref_data, r
             logging.error('Invalid \'var_epoch\' parameter, the given variance end-point (at ' + str(var_epoch[1]) + ') lies after the trial end-point (at ' + str(trial_epoch[1]) + ')')
             raise ValueError('Invalid \'var_epoch\' parameter')
 
-    # prepare excludes if needed
+    # prepare excludes if needed (convert the exclusion epochs to samples at once)
+    # Note: np.rint rounds halfway values to the nearest even value, the same as the built-in round
     exclude_epochs_starts = None
     exclude_epochs_ends = None
     if exclude_epochs is not None:
-        exclude_epochs_starts = np.full(len(exclude_epochs), 0, dtype=int)
-        exclude_epochs_ends = np.full(len(exclude_epochs), 0, dtype=int)
-        for exclude_epoch_index in range(len(exclude_epochs)):
-            exclude_epochs_starts[exclude_epoch_index] = int(round(exclude_epochs[exclude_epoch_index][0] * data_reader.sampling_rate))
-            exclude_epochs_ends[exclude_epoch_index] = int(round(exclude_epochs[exclude_epoch_index][1] * data_reader.sampling_rate))
+        exclude_epochs_starts = np.rint(np.array([exclude_epoch[0] for exclude_epoch in exclude_epochs], dtype=np.float64) * data_reader.sampling_rate).astype(int)
+        exclude_epochs_ends = np.rint(np.array([exclude_epoch[1] for exclude_epoch in exclude_epochs], dtype=np.float64) * data_reader.sampling_rate).astype(int)
 
     # if the conditions_onsets is a dict, then only retrieve the condition keys once
     conditions_keys = None
     if isinstance(conditions_onsets, dict):
         conditions_keys = list(conditions_onsets.keys())
 
-    # loop through the conditions
-    for condition_idx in range(len(conditions_onsets)):
+    # select the baseline function once
+    baseline_function = _BASELINE_FUNCTIONS.get(baseline_method)
 
-        # retrieve the onsets for this condition
+    # the condition averages of the channel are gathered in a (conditions x samples) scratch buffer and stored in the
+    # output matrix in one go after all conditions are processed
+    # Note: when the output matrix is 64-bit, then the averages are written directly into the channel's (contiguous)
+    #       part of the output. Otherwise, the conversion to the output data-type happens once per channel
+    averages_in_scratch = ref_data.dtype != np.float64
+    if not averages_in_scratch:
+        channel_averages = ref_data[channel_idx]
+    else:
+        try:
+            channel_averages = allocate_array((len(conditions_onsets), trial_num_samples), fill_value=None, dtype=np.float64)
+        except MemoryError:
+            raise MemoryError('Not enough memory to create a temporary channel average matrix')
+
+    # check whether the trials of all conditions can be extracted at once, which is the case when the channel data is
+    # passed and no exclusion epochs, variances, re-referencing or metric callbacks are involved
+    if channel_data is not None and exclude_epochs is None and var_epoch is None and CAR_per_condition is None and metric_callbacks is None:
+
+        # concatenate the onsets of all conditions (in order) and store where each condition starts and ends
+        # Note: the first and last trial in the concatenation are also the first trial of the first condition and the
+        #       last trial of the last condition, so the 'first_last_only' out-of-bound handling still applies the same
         if conditions_keys is not None:
-            onsets = conditions_onsets[conditions_keys[condition_idx]]   # order is preserved since Python 3.7
+            conditions_onsets_list = [conditions_onsets[condition_key] for condition_key in conditions_keys]
         else:
-            onsets = conditions_onsets[condition_idx]
+            conditions_onsets_list = list(conditions_onsets)
+        conditions_bounds = np.cumsum([0] + [len(onsets) for onsets in conditions_onsets_list])
+        all_onsets = [onset for onsets in conditions_onsets_list for onset in onsets]
 
-        # initialize a buffer to put all the channel's epoch data for this condition in (trials x samples)
-        # and
+        # epoch (and baseline normalize) the trials of all conditions in one go
         try:
-            condition_epoch_data = allocate_array((len(onsets), trial_num_samples),
-                                                  fill_value=np.nan, dtype=np.float64)
-            if var_epoch is not None:
-                condition_trial_variances = allocate_array(len(onsets),
-                                                           fill_value=np.nan, dtype=np.float64)
+            trials_data = allocate_array((1, len(all_onsets), trial_num_samples), fill_value=None, dtype=np.float64)
         except MemoryError:
             raise MemoryError('Not enough memory to create a temporary data matrix')
+        __epoch_data__from_channel_data__by_trials(trials_data, 0, channel_data, data_reader.sampling_rate,
+                                                   all_onsets, trial_epoch,
+                                                   baseline_method, baseline_epoch, out_of_bound_method,
+                                                   log_warnings=channel_idx == 0)
 
+        # average the trials of each condition and store the results
+        # Note: catching warning is needed to suppress unnecessary "RuntimeWarning: Mean of empty slice"
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            for condition_idx in range(len(conditions_onsets_list)):
+                channel_averages[condition_idx, :] = _nanmean(trials_data[0, conditions_bounds[condition_idx]:conditions_bounds[condition_idx + 1], :], axis=0)
+        del trials_data
 
-        # if baseline normalization is needed and the pre-average callback function is defined, then we first
-        # need to accumulate the full (i.e. channels x trials x epoch) un-normalized subset to provide to the
-        # function. Therefore, we initialize an array to store the baseline values for each channel x trial, so
-        # we can normalize after the callback
-        baseline_data = None
-        if baseline_method > 0 and metric_callbacks is not None:
-            try:
-                baseline_data = allocate_array((len(onsets), baseline_num_samples),
-                                               fill_value=np.nan, dtype=np.float64)
-            except MemoryError:
-                raise MemoryError('Not enough memory to create a temporary condition-channel baseline data matrix')
-
-        # loop through the trials in the condition
-        for trial_idx in range(len(onsets)):
-
-            # calculate the sample indices
-            trial_sample_start = int(round((onsets[trial_idx] + trial_epoch[0]) * data_reader.sampling_rate))
-            trial_sample_end = trial_sample_start + trial_num_samples
-            if baseline_method > 0:
-                baseline_start_sample = int(round((onsets[trial_idx] + baseline_epoch[0]) * data_reader.sampling_rate))
-                baseline_end_sample = baseline_start_sample + baseline_num_samples
-            local_start = 0
-            local_end = trial_num_samples
-
-            # check whether the trial epoch is within bounds
-            if trial_sample_end < 0:
-                if (out_of_bound_method == 1 and condition_idx == 0 and trial_idx == 0) or out_of_bound_method == 2:
-                    if channel_idx == 0:
-                        logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set.')
-                    continue
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_start < 0:
-                if (out_of_bound_method == 1 and condition_idx == 0 and trial_idx == 0) or out_of_bound_method == 2:
-                    if channel_idx == 0:
-                        logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set.')
-                    local_start = trial_sample_start * -1
-                    trial_sample_start = 0
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies before the start of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_start > channel_num_samples:
-                if (out_of_bound_method == 1 and condition_idx == len(conditions_onsets) - 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                    if channel_idx == 0:
-                        logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set.')
-                    continue
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the start of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-            if trial_sample_end > channel_num_samples:
-                if (out_of_bound_method == 1 and condition_idx == len(conditions_onsets) - 1 and trial_idx == len(onsets) - 1) or out_of_bound_method == 2:
-                    if channel_idx == 0:
-                        logging.warning('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set.')
-                    local_end = trial_num_samples - (trial_sample_end - channel_num_samples)
-                    trial_sample_end = channel_num_samples
-                else:
-                    logging.error('Cannot extract the trial with onset ' + str(onsets[trial_idx]) + ', the end of the trial-epoch lies after the end of the data-set. Use a different out_of_bound_handling argument to allow out-of-bound trial epochs')
-                    raise RuntimeError('Cannot extract trial')
-
-            # check whether the baseline is within bounds
-            if baseline_method > 0:
-                if baseline_start_sample < 0 or baseline_end_sample > channel_num_samples:
-                    logging.error('Cannot extract the baseline for the trial with onset ' + str(onsets[trial_idx]) + ', the range for the baseline lies outside of the data')
-                    raise RuntimeError('Cannot extract baseline')
-
-            # extract the trial data
-            if channel_data is None:
-                # retrieve using reader
+        # store the averages of the channel
+        if averages_in_scratch:
+            ref_data[channel_idx] = channel_averages
 
-                try:
-                    trial_trial_data = data_reader.retrieve_sample_range_data(trial_sample_start, trial_sample_end, channels=channel_name, ensure_own_data=False)[0]
+        #
+        return data_reader.sampling_rate, ref_data, ref_metric_values, ref_var
 
-                    # retrieve baseline data if baselining is needed and we are not performing CAR (with CAR, the
-                    # baseline should be inside of the trial epoch, therefor we just copy it from there later)
-                    if baseline_method > 0 and CAR_per_condition is None:
-                        # TODO: if baseline is within trial_trial_data, no need to read from disk like below, instead just copy from trial_trial_data
-                        trial_baseline_data = data_reader.retrieve_sample_range_data(baseline_start_sample, baseline_end_sample, channels=channel_name, ensure_own_data=False)[0]
+    # retrieve the values that are used for every trial as locals
+    sampling_rate = data_reader.sampling_rate
+    num_conditions = len(conditions_onsets)
+    max_read_num_samples = max(trial_num_samples, _RANGE_READ_MAX_BYTES // 8)
 
-                except (RuntimeError, LookupError):
-                    raise RuntimeError('Could not load data')
+    # determine the range (relative to the start of the trial) over which the variance is calculated once
+    if var_epoch is not None:
+        var_epoch_sample_offset_start = int(round((var_epoch[0] - trial_epoch[0]) * sampling_rate))
+        var_epoch_sample_offset_end   = int(round((var_epoch[1] - trial_epoch[0]) * sampling_rate))
+
+    # initialize a buffer to put all the channel's epoch data for a condition in (trials x samples), the buffer is
+    # allocated once (sized to the condition with the most trials) and the leading rows are used for each condition
+    # and
+    # Note: the epoch buffer is not initialized, every trial is either written or set to NaN (when it lies
+    #       outside of the data). The same applies to the baseline buffer
+    #
+    # Note: when there are no callbacks, only the average of the trials is needed. Large conditions are then epoched in
+    #       blocks of trials (so the buffer does not need to hold all the trials of the condition), and the NaN-ignoring
+    #       sums and counts of the blocks are accumulated trial by trial, in order. This yields exactly the same average
+    #       as averaging over all the trials of the condition at once, where the trials are also summed in order
+    max_condition_trials = max((len(onsets) for onsets in (conditions_onsets.values() if conditions_keys is not None else conditions_onsets)), default=0)
+    max_block_trials = max_condition_trials
+    if metric_callbacks is None and trial_num_samples > 1:
+        max_block_trials = min(max_condition_trials, max(1, _CONDITION_BLOCK_MAX_BYTES // (trial_num_samples * 8)))
+    try:
+        epoch_data_buffer = allocate_array((max_block_trials, trial_num_samples),
+                                           fill_value=None, dtype=np.float64)
+        if var_epoch is not None:
+            trial_variances_buffer = allocate_array(max_condition_trials,
+                                                    fill_value=None, dtype=np.float64)
+    except MemoryError:
+        raise MemoryError('Not enough memory to create a temporary data matrix')
+
+    # if baseline normalization is needed and the pre-average callback function is defined, then we first
+    # need to accumulate the full (i.e. channels x trials x epoch) un-normalized subset to provide to the
+    # function. Therefore, we initialize an array to store the baseline values for each channel x trial, so
+    # we can normalize after the callback
+    baseline_data_buffer = None
+    if baseline_method > 0 and metric_callbacks is not None:
+        try:
+            baseline_data_buffer = allocate_array((max_condition_trials, baseline_num_samples),
+                                                  fill_value=None, dtype=np.float64)
+        except MemoryError:
+            raise MemoryError('Not enough memory to create a temporary condition-channel baseline data matrix')
 
-            else:
-                # retrieve from passed channel-data
+    # the staging buffers (used when the trials are normalized after the per-trial loop) are allocated when first
+    # needed, and also reused over the conditions
+    trials_stage_buffer = None
+    baselines_stage_buffer = None
 
-                trial_trial_data = channel_data[trial_sample_start:trial_sample_end]
+    # loop through the conditions
+    for condition_idx in range(num_conditions):
 
-                # retrieve baseline data if baselining is needed and we are not performing CAR (with CAR, the
-                # baseline should be inside of the trial epoch, therefor we just copy it from there later)
-                if baseline_method > 0 and CAR_per_condition is None:
-                    trial_baseline_data = channel_data[baseline_start_sample:baseline_end_sample]
+        # retrieve the onsets for this condition
+        if conditions_keys is not None:
+            onsets = conditions_onsets[conditions_keys[condition_idx]]   # order is preserved since Python 3.7
+        else:
+            onsets = conditions_onsets[condition_idx]
 
+        # loop through the blocks of trials in the condition (a single block, unless the condition is large)
+        condition_onsets = onsets
+        num_condition_trials = len(condition_onsets)
+        num_blocks = 1
+        if 0 < max_block_trials < num_condition_trials:
+            num_blocks = -(-num_condition_trials // max_block_trials)
+        for block_idx in range(num_blocks):
+            block_start = block_idx * max_block_trials
+
+            # retrieve the onsets of the trials in the block
+            if num_blocks > 1:
+                onsets = condition_onsets[block_start:block_start + max_block_trials]
+
+            # take the part of the buffers for the trials in this block
+            condition_epoch_data = epoch_data_buffer[:len(onsets)]
+            if var_epoch is not None:
+                condition_trial_variances = trial_variances_buffer[block_start:block_start + len(onsets)]
+                condition_trial_variances.fill(np.nan)
+            baseline_data = None
+            if baseline_data_buffer is not None:
+                baseline_data = baseline_data_buffer[:len(onsets)]
+
+            # calculate the sample ranges and out-of-bound states of all the trials in the condition at once, and check them
+            # Note: the first and last trial in the data-set are the first trial of the first condition and the last trial
+            #       of the last condition, only those are allowed out-of-bounds with the 'first_last_only' method
+            trial_sample_starts, baseline_sample_starts, local_starts, local_ends, clipped_starts, clipped_ends, \
+                trial_states, allowed_states = _compute_trial_bounds(onsets, sampling_rate, trial_epoch, baseline_epoch,
+                                                                     channel_num_samples, out_of_bound_method,
+                                                                     first_in_data=condition_idx == 0 and block_start == 0,
+                                                                     last_in_data=condition_idx == num_conditions - 1 and block_start + len(onsets) >= num_condition_trials)
+            trials_skip = _check_channel_trial_bounds(onsets, baseline_sample_starts, trial_states, allowed_states,
+                                                      baseline_num_samples, channel_num_samples, baseline_method,
+                                                      log_warnings=channel_idx == 0)
+            trials_extract = np.flatnonzero(~trials_skip)
+
+            # the trials that lie entirely outside of the data are set to NaN
+            if trials_skip.any():
+                condition_epoch_data[trials_skip, :] = np.nan
+                if baseline_data is not None:
+                    baseline_data[trials_skip, :] = np.nan
+
+            # determine whether the trials can be re-referenced all at once, which requires all the trials (and their
+            # baselines, that are taken from the re-referenced trial data) to lie fully within the data
+            if CAR_per_condition is not None and channel_data is not None and exclude_epochs is None:
+                car_baseline_local_starts = (baseline_sample_starts - trial_sample_starts)[trials_extract]
+                car_at_once = bool(np.all(local_starts[trials_extract] == 0) and np.all(local_ends[trials_extract] == trial_num_samples))
+                if baseline_method > 0:
+                    car_at_once = car_at_once and bool(np.all(car_baseline_local_starts >= 0) and np.all(car_baseline_local_starts + baseline_num_samples <= trial_num_samples))
+
+            if channel_data is not None and exclude_epochs is None and CAR_per_condition is not None and car_at_once:
+                # the channel data is passed and the trials lie within the data, re-reference (and baseline normalize)
+                # all the trials of the condition at once
+
+                # gather and re-reference the trials
+                # Note: the re-referenced trials are written directly into the condition epoch buffer when all the trials
+                #       are extracted, or otherwise in place when the gathered trials are already 64-bit
+                trials_data = np.lib.stride_tricks.sliding_window_view(channel_data, trial_num_samples)[trial_sample_starts[trials_extract]]
+                if len(trials_extract) == len(onsets):
+                    trials_out = condition_epoch_data
+                elif trials_data.dtype == np.float64:
+                    trials_out = trials_data
+                else:
+                    trials_out = None
+                trials_data = np.subtract(trials_data, CAR_per_condition[condition_idx, :], out=trials_out)
+                del trials_out
+
+                # determine the variance for each trial (over the re-referenced data)
+                if var_epoch is not None:
+                    var_values = trials_data[:, var_epoch_sample_offset_start:var_epoch_sample_offset_end]
+                    trials_var = (~np.isnan(var_values)).sum(axis=1) > 1
+                    if trials_var.any():
+                        condition_trial_variances[trials_extract[trials_var]] = _nanvar(var_values[trials_var], axis=1)
+                    del var_values
+
+                # take the baselines from the re-referenced trial data, and either normalize the trials or (when there is
+                # a callback) store the baseline values for later use
+                if baseline_method > 0:
+                    baseline_indices = car_baseline_local_starts[:, None] + np.arange(baseline_num_samples)
+                    trials_baseline_data = np.take_along_axis(trials_data, baseline_indices, axis=1)
+                    if metric_callbacks is None:
+                        trials_data -= baseline_function(trials_baseline_data, axis=1)[:, None]
+                    else:
+                        baseline_data[trials_extract, :] = trials_baseline_data
+                    del baseline_indices, trials_baseline_data
 
-            #
-            # (optionally) CAR_per_condition
-            #
+                if trials_data is not condition_epoch_data:
+                    condition_epoch_data[trials_extract, :] = trials_data
+                del trials_data
 
-            if CAR_per_condition is not None:
-                trial_trial_data = np.array(trial_trial_data - CAR_per_condition[condition_idx, :])
+            elif channel_data is not None and exclude_epochs is None and CAR_per_condition is None:
+                # the channel data is passed and the trials do not need to be manipulated individually, extract (and
+                # baseline normalize) all the trials of the condition at once
 
-                # since the baseline window should be within the trial window, we can copy the values that are already re-referenced
+                # gather the baselines of all the trials that can be extracted
+                # Note: when there is a callback, the un-normalized trials are stored and the baseline values are kept
+                #       for later use. Otherwise, the trials are normalized while they are copied
+                baselines = None
                 if baseline_method > 0:
-                    trial_baseline_data = np.array(trial_trial_data[baseline_start_sample - trial_sample_start:baseline_end_sample - trial_sample_start])
+                    trials_baseline_data = np.lib.stride_tricks.sliding_window_view(channel_data, baseline_num_samples)[baseline_sample_starts[trials_extract]]
+                    if metric_callbacks is None:
+                        baselines = baseline_function(trials_baseline_data, axis=1)
+                    else:
+                        baseline_data[trials_extract, :] = trials_baseline_data
+                    del trials_baseline_data
 
-            #
-            # (optionally) exclude epochs
-            #
+                # copy (and optionally normalize) the trials
+                _epoch_copy_kernel(condition_epoch_data[None], 0, channel_data, trials_extract, trial_sample_starts,
+                                   local_starts, local_ends, clipped_starts, clipped_ends, baselines)
 
-            if exclude_epochs is not None:
+                # determine the variance for each trial
+                # Note: the variance range is relative to the (clipped) start of the trial data
+                if var_epoch is not None:
+                    for trial_idx in trials_extract.tolist():
+                        var_values = channel_data[clipped_starts[trial_idx]:clipped_ends[trial_idx]][var_epoch_sample_offset_start:var_epoch_sample_offset_end]
+                        if (~np.isnan(var_values)).sum() > 1:
+                            condition_trial_variances[trial_idx] = _nanvar(var_values)
 
-                # function to check and exclude (nan) values in a data range
-                def apply_excludes_to_range(ref_range_data, range_sample_start, range_sample_end):
+            else:
+                # loop over the trials, either because the trials need to be retrieved from the reader or because the
+                # trials need to be manipulated individually (re-referencing or excluding epochs)
+
+                # determine which ranges of the channel data should be read to extract the trials, when the data is
+                # retrieved using the reader then the trials (and their baselines) that lie close to each other are grouped
+                # so that each group can be retrieved with a single read. The passed channel-data is used as a whole
+                # Note: the baseline is taken from the (re-referenced) trial data when CAR is applied
+                if channel_data is None:
+                    read_starts = clipped_starts
+                    read_ends = clipped_ends
+                    if baseline_method > 0 and CAR_per_condition is None:
+                        read_starts = np.minimum(clipped_starts, baseline_sample_starts)
+                        read_ends = np.maximum(clipped_ends, baseline_sample_starts + baseline_num_samples)
+                    read_groups = _group_trial_reads(trials_extract.tolist(), read_starts.tolist(), read_ends.tolist(),
+                                                     max_gap=trial_num_samples, max_span=max_read_num_samples)
+                else:
+                    read_groups = [(0, channel_num_samples, trials_extract.tolist())]
+
+                # convert the indices to built-in integers, since the data-readers only accept those as range arguments
+                baseline_sample_starts = baseline_sample_starts.tolist()
+                local_starts = local_starts.tolist()
+                local_ends = local_ends.tolist()
+                clipped_starts = clipped_starts.tolist()
+                clipped_ends = clipped_ends.tolist()
+
+                # when there is no callback, the trials and their baselines are staged first, so that the baseline values
+                # of all the trials can be calculated and subtracted at once after the loop
+                # Note: the staging buffers take the data-type of the trial data (as retrieved and re-referenced), this
+                #       ensures the normalization yields the same values as when it would be applied to each trial directly.
+                #       When the data-types match, the trials are staged directly in the condition epoch buffer
+                stage_trials = baseline_method > 0 and metric_callbacks is None
+                trials_stage = None
+                baselines_stage = None
+
+                # loop through the groups of trials in the condition that lie (partly) within the data
+                for read_start, read_end, read_trials in read_groups:
+
+                    # retrieve the data of the group of trials using the reader, or use the passed channel-data
+                    if channel_data is None:
+                        try:
+                            range_data = data_reader.retrieve_sample_range_data(read_start, read_end, channels=channel_name, ensure_own_data=False)[0]
+                        except (RuntimeError, LookupError):
+                            raise RuntimeError('Could not load data')
+                    else:
+                        range_data = channel_data
+
+                    # loop through the trials in the group
+                    for trial_idx in read_trials:
+
+                        # retrieve the sample indices
+                        trial_sample_start = clipped_starts[trial_idx]
+                        trial_sample_end = clipped_ends[trial_idx]
+                        local_start = local_starts[trial_idx]
+                        local_end = local_ends[trial_idx]
+                        if baseline_method > 0:
+                            baseline_start_sample = baseline_sample_starts[trial_idx]
+                            baseline_end_sample = baseline_start_sample + baseline_num_samples
+
+                        # extract the trial data
+                        # Note: not relevant whether this is a numpy-view or not, the trial data is not manipulated in place
+                        #       (a copy is made when the exclusion epochs are applied)
+                        trial_trial_data = range_data[trial_sample_start - read_start:trial_sample_end - read_start]
+
+                        # extract the baseline data if baselining is needed and we are not performing CAR (with CAR, the
+                        # baseline should be inside of the trial epoch, therefor we just copy it from there later)
+                        if baseline_method > 0 and CAR_per_condition is None:
+                            trial_baseline_data = range_data[baseline_start_sample - read_start:baseline_end_sample - read_start]
 
-                    # check if trial start or end is within an exclude epoch
-                    exclude_starts_in_range = np.logical_and(exclude_epochs_starts >= range_sample_start, exclude_epochs_starts <= range_sample_end)
-                    exclude_ends_in_range = np.logical_and(exclude_epochs_ends >= range_sample_start, exclude_epochs_ends <= range_sample_end)
-                    exclude_surround_range = np.logical_and(exclude_epochs_starts < range_sample_start, exclude_epochs_ends > range_sample_end)
-                    excludes_indices = np.logical_or(np.logical_or(exclude_starts_in_range, exclude_ends_in_range), exclude_surround_range).nonzero()[0]
+                        #
+                        # (optionally) CAR_per_condition
+                        #
 
-                    # apply the exclusion epochs that were found
-                    for exclude_index in excludes_indices:
+                        if CAR_per_condition is not None:
+                            trial_trial_data = trial_trial_data - CAR_per_condition[condition_idx, :]
 
-                        start_nan_index = 0
-                        if exclude_starts_in_range[exclude_index]:
-                            start_nan_index = exclude_epochs_starts[exclude_index] - trial_sample_start
+                            # since the baseline window should be within the trial window, we can take the values that are already re-referenced
+                            # Note: without exclusion epochs a view is sufficient, the baseline values are only read (or copied to
+                            #       the baseline buffer when there is a callback). With exclusion epochs the trial data is
+                            #       manipulated in place, so the baseline values need to be copied before that happens
+                            if baseline_method > 0:
+                                trial_baseline_data = trial_trial_data[baseline_start_sample - trial_sample_start:baseline_end_sample - trial_sample_start]
+                                if exclude_epochs is not None:
+                                    trial_baseline_data = trial_baseline_data.copy()
 
-                        end_nan_index = len(trial_trial_data)
-                        if exclude_ends_in_range[exclude_index]:
-                            end_nan_index = exclude_epochs_ends[exclude_index] - trial_sample_start
+                        #
+                        # (optionally) exclude epochs
+                        #
 
-                        ref_range_data[start_nan_index:end_nan_index] = np.nan
+                        if exclude_epochs is not None:
 
-                #
-                if not trial_trial_data.flags['OWNDATA']:
-                    trial_trial_data = trial_trial_data.copy()
-                apply_excludes_to_range(trial_trial_data, trial_sample_start, trial_sample_end)
+                            # function to check and exclude (nan) values in a data range
+                            def apply_excludes_to_range(ref_range_data, range_sample_start, range_sample_end):
 
-                if baseline_method > 0:
-                    if not trial_baseline_data.flags['OWNDATA']:
-                        trial_baseline_data = trial_baseline_data.copy()
-                    apply_excludes_to_range(trial_baseline_data, baseline_start_sample, baseline_end_sample)
+                                # check if trial start or end is within an exclude epoch
+                                exclude_starts_in_range = np.logical_and(exclude_epochs_starts >= range_sample_start, exclude_epochs_starts <= range_sample_end)
+                                exclude_ends_in_range = np.logical_and(exclude_epochs_ends >= range_sample_start, exclude_epochs_ends <= range_sample_end)
+                                exclude_surround_range = np.logical_and(exclude_epochs_starts < range_sample_start, exclude_epochs_ends > range_sample_end)
+                                excludes_indices = np.logical_or(np.logical_or(exclude_starts_in_range, exclude_ends_in_range), exclude_surround_range).nonzero()[0]
 
-            # determine the variance for the trial
-            if var_epoch is not None:
+                                # apply the exclusion epochs that were found
+                                for exclude_index in excludes_indices:
 
-                var_epoch_sample_offset_start = int(round((var_epoch[0] - trial_epoch[0]) * data_reader.sampling_rate))
-                var_epoch_sample_offset_end   = int(round((var_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
+                                    start_nan_index = 0
+                                    if exclude_starts_in_range[exclude_index]:
+                                        start_nan_index = exclude_epochs_starts[exclude_index] - trial_sample_start
 
-                # TODO: minimum number of samples to determine var?
-                var_values = trial_trial_data[var_epoch_sample_offset_start:var_epoch_sample_offset_end]
-                if (~np.isnan(var_values)).sum() > 1:
-                    condition_trial_variances[trial_idx] = np.nanvar(var_values)
+                                    end_nan_index = len(trial_trial_data)
+                                    if exclude_ends_in_range[exclude_index]:
+                                        end_nan_index = exclude_epochs_ends[exclude_index] - trial_sample_start
 
+                                    ref_range_data[start_nan_index:end_nan_index] = np.nan
 
-            # perform baseline normalization on the trial if needed
-            #
-            # except when there is a function callback. When a callback is then we need to first accumulate the
-            # full (i.e. channels x trials x epoch) un-normalized subset to provide to the function, and store
-            # the baseline values in a separate array, so they can be applied later
-            #
-            if baseline_method == 0 or metric_callbacks is not None:
+                            #
+                            if not trial_trial_data.flags['OWNDATA']:
+                                trial_trial_data = trial_trial_data.copy()
+                            apply_excludes_to_range(trial_trial_data, trial_sample_start, trial_sample_end)
 
-                # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
-                #       later. Assume metric_callback does not manipulate the data it is given
-                condition_epoch_data[trial_idx, local_start:local_end] = trial_trial_data
+                            if baseline_method > 0:
+                                if not trial_baseline_data.flags['OWNDATA']:
+                                    trial_baseline_data = trial_baseline_data.copy()
+                                apply_excludes_to_range(trial_baseline_data, baseline_start_sample, baseline_end_sample)
 
-            if baseline_method == 1:
+                        # determine the variance for the trial
+                        if var_epoch is not None:
 
-                if metric_callbacks is None:
-                    # no callback, normalize and store the trial data with baseline applied
+                            # TODO: minimum number of samples to determine var?
+                            var_values = trial_trial_data[var_epoch_sample_offset_start:var_epoch_sample_offset_end]
+                            if (~np.isnan(var_values)).sum() > 1:
+                                condition_trial_variances[trial_idx] = _nanvar(var_values)
 
-                    if exclude_epochs is None or not np.isnan(trial_baseline_data).all():
-                        condition_epoch_data[trial_idx, local_start:local_end] = trial_trial_data - np.nanmean(trial_baseline_data)
-                    else:
-                        condition_epoch_data[trial_idx, local_start:local_end] = trial_trial_data
 
-                else:
-                    # callback, store the baseline values for later use
-                    # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
-                    #       later. Assume metric_callback does not manipulate the data it is given
-                    baseline_data[trial_idx, :] = trial_baseline_data
-
-            elif baseline_method == 2:
+                        # store the trial data and (if baseline normalization is needed) the baseline values
+                        #
+                        # without a callback, the trial and its baseline are staged so they can be normalized together with
+                        # the other trials after the loop. When there is a function callback, we need to first accumulate the
+                        # full (i.e. channels x trials x epoch) un-normalized subset to provide to the function, and store
+                        # the baseline values in a separate array, so they can be applied later
+                        #
+                        # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
+                        #       later. Assume metric_callback does not manipulate the data it is given
+                        if stage_trials:
+                            if trials_stage is None:
+                                try:
+                                    if trial_trial_data.dtype == condition_epoch_data.dtype:
+                                        trials_stage = condition_epoch_data
+                                    else:
+                                        if trials_stage_buffer is None or trials_stage_buffer.dtype != trial_trial_data.dtype:
+                                            trials_stage_buffer = allocate_array((max_block_trials, trial_num_samples),
+                                                                                 fill_value=None, dtype=trial_trial_data.dtype)
+                                        trials_stage = trials_stage_buffer[:len(onsets)]
+                                    if baselines_stage_buffer is None or baselines_stage_buffer.dtype != trial_baseline_data.dtype:
+                                        baselines_stage_buffer = allocate_array((max_block_trials, baseline_num_samples),
+                                                                                fill_value=None, dtype=trial_baseline_data.dtype)
+                                    baselines_stage = baselines_stage_buffer[:len(onsets)]
+                                except MemoryError:
+                                    raise MemoryError('Not enough memory to create a temporary condition-channel staging data matrix')
+                            trial_buffer = trials_stage
+                            baselines_stage[trial_idx, :] = trial_baseline_data
+                        else:
+                            trial_buffer = condition_epoch_data
+                            if baseline_method > 0:
+                                baseline_data[trial_idx, :] = trial_baseline_data
+                        trial_buffer[trial_idx, local_start:local_end] = trial_trial_data
+
+                # pad the out-of-bound part of the trials that lie partly outside of the data with NaNs
+                _pad_clipped_trials(condition_epoch_data if trials_stage is None else trials_stage,
+                                    trial_states, local_starts, local_ends)
+
+                # normalize the staged trials by their baselines at once
+                if trials_stage is not None:
+
+                    # Note: catching warning is needed to suppress unnecessary "RuntimeWarning: Mean of empty slice" on
+                    #       baselines that are entirely excluded
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", category=RuntimeWarning)
+                        baselines = baseline_function(baselines_stage[trials_extract], axis=1)
+
+                    # trials of which the baseline is entirely excluded are not normalized
+                    if exclude_epochs is not None:
+                        baselines[np.isnan(baselines)] = 0
+
+                    # Note: when all trials are extracted the subtraction is written directly into the condition epoch
+                    #       buffer, the subtraction is performed in the data-type of the staged trials either way
+                    if len(trials_extract) == len(onsets):
+                        np.subtract(trials_stage, baselines[:, None], out=condition_epoch_data)
+                    else:
+                        condition_epoch_data[trials_extract, :] = trials_stage[trials_extract] - baselines[:, None]
+                    del trials_stage, baselines_stage, baselines
 
-                if metric_callbacks is None:
-                    # no callback, normalize and store the trial data with baseline applied
+            # check if a pre-averaging callback function is defined
+            if metric_callbacks is not None:
 
-                    if exclude_epochs is None or not np.isnan(trial_baseline_data).all():
-                        condition_epoch_data[trial_idx, local_start:local_end] = trial_trial_data - np.nanmedian(trial_baseline_data)
-                    else:
-                        condition_epoch_data[trial_idx, local_start:local_end] = trial_trial_data
-                else:
-                    # callback, store the baseline values for later use
-                    # Note: not relevant whether this is a numpy-view or not, since we will average over the trials
-                    #       later. Assume metric_callback does not manipulate the data it is given
-                    baseline_data[trial_idx, :] = trial_baseline_data
+                if callable(metric_callbacks):
 
-        # check if a pre-averaging callback function is defined
-        if metric_callbacks is not None:
+                    # pass the trials x epoch un-normalized subset to the callback function(s) and store the result
+                    metric_value = metric_callbacks(data_reader.sampling_rate, condition_epoch_data, baseline_data)
+                    if metric_value is not None:
+                        ref_metric_values[channel_idx, condition_idx] = metric_value
 
-            if callable(metric_callbacks):
+                elif type(metric_callbacks) is tuple and len(metric_callbacks) > 0:
+                    for iCallback in range(len(metric_callbacks)):
+                        if callable(metric_callbacks[iCallback]):
 
-                # pass the trials x epoch un-normalized subset to the callback function(s) and store the result
-                metric_value = metric_callbacks(data_reader.sampling_rate, condition_epoch_data, baseline_data)
-                if metric_value is not None:
-                    ref_metric_values[channel_idx, condition_idx] = metric_value
+                            # pass the trials x epoch un-normalized subset to the callback function(s) and store the result
+                            metric_value = metric_callbacks[iCallback](data_reader.sampling_rate, condition_epoch_data, baseline_data)
+                            if metric_value is not None:
+                                ref_metric_values[channel_idx, condition_idx, iCallback] = metric_value
 
-            elif type(metric_callbacks) is tuple and len(metric_callbacks) > 0:
-                for iCallback in range(len(metric_callbacks)):
-                    if callable(metric_callbacks[iCallback]):
+                # the callback has been made, check if (postponed) normalization should occur based on the baseline
+                if baseline_method > 0:
+                    condition_epoch_data -= np.nan_to_num(baseline_function(baseline_data, axis=1)[:, None])
 
-                        # pass the trials x epoch un-normalized subset to the callback function(s) and store the result
-                        metric_value = metric_callbacks[iCallback](data_reader.sampling_rate, condition_epoch_data, baseline_data)
-                        if metric_value is not None:
-                            ref_metric_values[channel_idx, condition_idx, iCallback] = metric_value
+            # average the trials for each channel (within this condition) and store the results, or accumulate
+            # the sums and counts of the trials in the block when the condition is processed in blocks
+            if num_blocks == 1:
 
-            # the callback has been made, check if (postponed) normalization should occur based on the baseline
-            if baseline_method == 1:
-                condition_epoch_data -= np.nan_to_num(np.nanmean(baseline_data, axis=1)[:, None])
-            elif baseline_method == 2:
-                condition_epoch_data -= np.nan_to_num(np.nanmedian(baseline_data, axis=1)[:, None])
+                # Note: catching warning is needed to suppress unnecessary "RuntimeWarning: Mean of empty slice"
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    channel_averages[condition_idx, :] = _nanmean(condition_epoch_data, axis=0)
 
-        # average the trials for each channel (within this condition) and store the results
-        # Note: catching warning is needed to suppress unnecessary "RuntimeWarning: Mean of empty slice"
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            ref_data[channel_idx, condition_idx, :] = np.nanmean(condition_epoch_data, axis=0)
+            else:
+                block_valid = ~np.isnan(condition_epoch_data)
+                np.copyto(condition_epoch_data, 0, where=~block_valid)
+                if block_start == 0:
+                    condition_sums = condition_epoch_data[0].copy()
+                    condition_counts = block_valid.sum(axis=0)
+                    first_trial = 1
+                else:
+                    condition_counts += block_valid.sum(axis=0)
+                    first_trial = 0
+                for trial_idx in range(first_trial, len(onsets)):
+                    condition_sums += condition_epoch_data[trial_idx]
+                del block_valid
+
+        # take the average of the accumulated sums and counts when the condition was processed in blocks
+        if num_blocks > 1:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                channel_averages[condition_idx, :] = condition_sums / condition_counts
+            del condition_sums, condition_counts
         del condition_epoch_data
 
         # average the trial variances and store the results
@@ -1183,16 +2022,21 @@ def __subload_data_epoch_averages__from_channel__by_condition_trials(ref_data, r
             # Note: catching warning is needed to suppress unnecessary "RuntimeWarning: Mean of empty slice"
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore", category=RuntimeWarning)
-                ref_var[channel_idx, condition_idx] = np.nanmean(condition_trial_variances)
+                ref_var[channel_idx, condition_idx] = np.nanmean(trial_variances_buffer[:len(condition_onsets)])
             del condition_trial_variances
 
+    # store the averages of the channel
+    if averages_in_scratch:
+        ref_data[channel_idx] = channel_averages
+
     #
     return data_reader.sampling_rate, ref_data, ref_metric_values, ref_var
 
 
 def _load_data_epoch_averages__by_channel_condition_trial(data_reader, channels,
                                                           conditions_onsets, trial_epoch,
-                                                          baseline_method, baseline_epoch, out_of_bound_method, metric_callbacks):
+                                                          baseline_method, baseline_epoch, out_of_bound_method, metric_callbacks,
+                                                          dtype=np.float64):
     """
     Load data epoch averages to a matrix (format: channel x condition x time) by looping over channels, then over
     conditions and then within that channel-condition combination loop over each of the trials to load the specific
@@ -1201,13 +2045,13 @@ def _load_data_epoch_averages__by_channel_condition_trial(data_reader, channels,
     """
 
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
 
     # initialize a data buffer (channel x conditions x samples)
+    # Note: the buffer is not initialized, the average of every channel-condition combination is written by the subload
     try:
         data = allocate_array((len(channels), len(conditions_onsets), trial_num_samples),
-                              fill_value=np.nan, dtype=np.float64)
+                              fill_value=None, dtype=dtype)
     except MemoryError:
         raise MemoryError('Not enough memory create a data output matrix')
 
@@ -1224,10 +2068,14 @@ def _load_data_epoch_averages__by_channel_condition_trial(data_reader, channels,
     except MemoryError:
         raise MemoryError('Not enough memory create a metric output matrix')
 
-    # create progress bar
-    print_progressbar(0, len(conditions_onsets), prefix='Progress:', suffix='Complete', length=50)
+    # create progress bar (updated every percent of the channels and at the end)
+    print_progressbar(0, len(channels), prefix='Progress:', suffix='Complete', length=50)
+    progress_step = max(1, len(channels) // 100)
 
     # loop through the channels
+    # Note: the channels are processed on the calling thread. The per-channel routine reads through the (not
+    #       thread-safe) reader, calls the metric callbacks and suppresses warnings with warnings.catch_warnings, which
+    #       changes the process-global warning filters and is therefore not thread-safe either
     for channel_idx in range(len(channels)):
 
         #
@@ -1241,16 +2089,133 @@ def _load_data_epoch_averages__by_channel_condition_trial(data_reader, channels,
             raise RuntimeError('Error upon loading, epoching and averaging data')
 
         # update progress bar
-        print_progressbar(channel_idx + 1, len(channels), prefix='Progress:', suffix='Complete', length=50)
+        if (channel_idx + 1) % progress_step == 0 or channel_idx + 1 == len(channels):
+            print_progressbar(channel_idx + 1, len(channels), prefix='Progress:', suffix='Complete', length=50)
 
     # return the sample rate, the average epoch and the metric values (None if no metrics)
     return data_reader.sampling_rate, data, metric_values
 
 
+def _add_channel_to_reref_groups(channel_data, channel_groups, req_groups, group_data, group_numdata,
+                                 channel_exclude_ranges, count_samples, include_cache=None):
+    """
+    Add the data of a channel to the totals of the (early or late) re-referencing groups that require the channel
+
+    Args:
+        channel_data (ndarray):             The data of the channel
+        channel_groups (list):              The re-referencing groups (as tuples of the group and its key) that require
+                                            the channel
+        req_groups (list or tuple):         All the required re-referencing groups, used to allocate the totals
+        group_data (dict):                  For each re-referencing group (by key) the total of the data that was
+                                            added, or None when the totals are not allocated yet
+        group_numdata (dict):               For each re-referencing group (by key) the number of samples that were
+                                            added to each datapoint in the total (only used when count_samples is True)
+        channel_exclude_ranges (None or list):  The sample ranges (as start- and end-sample pairs) in the channel data
+                                                that are excluded from the totals, or None to add the whole channel
+        count_samples (bool):               Whether the number of samples added to each datapoint should be counted,
+                                            which is needed when (any of the channels) have exclusion epochs
+        include_cache (None or dict):       A dictionary with a (boolean) 'buffer', with the length of the channel data,
+                                            that is re-used to hold the inclusion vector, and the exclusion 'ranges' that
+                                            the buffer currently holds the inclusion vector of. If None, the inclusion
+                                            vector is allocated
+    """
+
+    # the channel is not part of any group (e.g. it is only re-referenced), there is nothing to add
+    if not channel_groups:
+        return
+
+    # create the arrays to hold the data of all groups if not yet initialized
+    # Note: the totals (and the number of samples) of the groups are rows in a single matrix that is allocated at once,
+    #       the group entries are views on the rows
+    # Note: the totals are accumulated in 64-bit, the same precision as the (filtered) channel data. With 32-bit totals,
+    #       the rounding error of the accumulation would already be of the order of the precision of the re-referenced output
+    if group_data[channel_groups[0][1]] is None:
+        groups_data = np.zeros((len(req_groups), len(channel_data)), dtype=np.float64)
+        if count_samples:
+            groups_numdata = np.zeros((len(req_groups), len(channel_data)), dtype=np.uint16)
+        for group_idx, group in enumerate(req_groups):
+            group_data[str(group)] = groups_data[group_idx]
+            if count_samples:
+                group_numdata[str(group)] = groups_numdata[group_idx]
+
+    # create a binary numpy vector of the samples to include if the channel has exclusion epochs
+    # Note: the inclusion vector is the same for each group, so it is only created once and used for every group
+    # Note: when the cached buffer already holds the inclusion vector for the same exclusion ranges (e.g. the channel
+    #       was just added to the early re-referencing groups and is now added to the late groups), it is used as is
+    channel_includes = None
+    if channel_exclude_ranges is not None:
+        if include_cache is not None and len(include_cache['buffer']) == len(channel_data):
+            channel_includes = include_cache['buffer']
+            if include_cache['ranges'] != channel_exclude_ranges:
+                channel_includes.fill(True)
+                for exclude_sample_start, exclude_sample_end in channel_exclude_ranges:
+                    channel_includes[exclude_sample_start:exclude_sample_end] = 0
+                include_cache['ranges'] = channel_exclude_ranges
+        else:
+            channel_includes = np.ones((len(channel_data),), dtype=bool)
+            for exclude_sample_start, exclude_sample_end in channel_exclude_ranges:
+                channel_includes[exclude_sample_start:exclude_sample_end] = 0
+
+        # the channel is excluded entirely (e.g. a bad channel), nothing is added to the groups
+        if not channel_includes.any():
+            return
+
+        # none of the exclusion epochs lie within the channel data, the whole channel can be added
+        if channel_includes.all():
+            channel_includes = None
+
+    if channel_includes is None:
+
+        # no exclusion epochs, just add the whole channel (and count the number of samples added if needed)
+        for _, group_key in channel_groups:
+            group_data[group_key] += channel_data
+            if count_samples:
+                group_numdata[group_key] += 1
+
+    else:
+        # channel has exclusion epochs
+
+        # apply the inclusion vector to the channel
+        # Note: the included channel data is the same for each group, so it is only created once
+        channel_included_data = channel_data * channel_includes
+
+        # add the channel (taking into account on the inclusion vector)
+        for _, group_key in channel_groups:
+            group_data[group_key] += channel_included_data
+            group_numdata[group_key] += channel_includes
+
+
+def _average_reref_group(group_key, group_data, group_numdata, num_group_channels):
+    """
+    Turn the total of a (completely collected) re-referencing group into the average
+
+    Args:
+        group_key (str):                    The key of the re-referencing group
+        group_data (dict):                  For each re-referencing group (by key) the total of the data
+        group_numdata (dict):               For each re-referencing group (by key) the number of samples that were
+                                            added to each datapoint in the total, if these were counted
+        num_group_channels (int):           The number of channels in the re-referencing group
+    """
+
+    # take the average over the total
+    # (if specific epochs were excluded, each sample should be divided by its own number)
+    # Note: the division is performed in place (the 16-bit counts are cast by numpy in small buffered chunks, without
+    #       a full-length temporary). Multiplying by the reciprocal instead would not yield the exact (correctly rounded) average
+    if group_numdata.get(group_key) is not None:
+        group_data[group_key] /= group_numdata[group_key]
+
+        # clear the array was used for division
+        del group_numdata[group_key]
+
+    else:
+        group_data[group_key] /= num_group_channels
+
+
 def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_channels, onsets,
                                              trial_epoch, baseline_method, baseline_epoch,
                                              out_of_bound_method, metric_callbacks,
-                                             high_pass, early_reref, line_noise_removal, late_reref, priority):
+                                             high_pass, early_reref, line_noise_removal, late_reref, priority,
+                                             high_pass_method='butter', ref_data=None, dtype=np.float64):
     """
     Load the data, preprocess and either epoch or (optionally) calculate metrics and epoch-average to a matrix.
     This function processes data per channel in order to minimize memory usage but still be able to apply preprocessing
@@ -1277,12 +2242,18 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                                             this argument should be a dictionary or tuple/list that holds one entry for each
                                             condition, with each entry in the dictionary or list expected to hold a list/tuple with
                                             the trial onset values for that condition.
+        high_pass_method (str):             The high-pass filter to apply, either a zero-phase Butterworth filter
+                                            ('butter') or a causal first-order IIR filter ('onepole')
+        ref_data (None or ndarray):         An already allocated output matrix to write the result
+                                            into (format: channel x trials/epochs x time, or channel x condition x time
+                                            when averaging). If None, a matrix will be allocated
+        dtype (type):                       The data-type of the output matrix, when one is allocated
 
     """
 
     # Note: scipy is a pretty elaborate package (causing a significant, 100ms+ time to import uncached) and
     #       is only needed with pre-processing, therefore import local instead of top of the module
-    from scipy.signal import butter, iirnotch, filtfilt
+    from scipy.signal import butter, iirnotch, tf2sos, sosfiltfilt, lfilter, lfilter_zi
 
     # if baselining and late re-ref channel selection based on variance is enabled, make sure the baseline epoch is
     # included in the trial epoch. This way the common average (which is calculated over the trial epoch) can be applied
@@ -1298,15 +2269,14 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
             raise ValueError('Invalid \'baseline_epoch\' parameter')
 
     # calculate the size of the time dimension (in samples)
-    trial_num_samples = int(round(abs(trial_epoch[1] - trial_epoch[0]) * data_reader.sampling_rate))
-    baseline_num_samples = int(round(abs(baseline_epoch[1] - baseline_epoch[0]) * data_reader.sampling_rate))
+    trial_num_samples, baseline_num_samples = _epoch_num_samples(data_reader.sampling_rate, trial_epoch, baseline_epoch)
 
-    # initialize a data buffer (channel x trials/epochs x time)
-    try:
-        data = allocate_array((len(retrieve_channels), len(onsets), trial_num_samples),
-                              fill_value=np.nan, dtype=np.float64)
-    except MemoryError:
-        raise MemoryError('Not enough memory create a data output matrix')
+    # initialize a data buffer (channel x trials/epochs x time), or use the one that was passed
+    data = _allocate_data_epochs(ref_data, len(retrieve_channels), len(onsets), trial_num_samples, dtype=dtype)
+
+    # the trial bounds (sample ranges and out-of-bound states) are the same for every channel that is epoched, these
+    # are calculated when the first channel is epoched and then re-used
+    trial_bounds_cache = dict()
 
     # initialize a metric buffer (channel x conditions x metric)
     if average:
@@ -1346,49 +2316,76 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
     # Initialize variable that track processing
     #
 
-    channel_epoched = dict()                        # tracks for each channel whether it has been epoched (fully processed)
-    for channel in retrieve_channels:
-        channel_epoched[channel] = False
+    # assign each (unique) channel an index, the processing states of the channels are tracked in boolean arrays
+    # Note: the channels to retrieve come first in the list of all channels, so the channels that are to be epoch-ed
+    #       are the first entries in the state arrays
+    channel_indices = {channel: index for index, channel in enumerate(dict.fromkeys(all_channels))}
+    num_epoch_channels = len(dict.fromkeys(retrieve_channels))
+    channels_epoched = np.zeros(num_epoch_channels, dtype=bool)     # tracks for each channel whether it has been epoched (fully processed)
 
     if early_reref is not None:
-        channel_early_reref_collected = dict()          # tracks for each channel if the channel-data is added to the early re-ref group averages
-        for channel in early_req_channels:
-            channel_early_reref_collected[channel] = False
+        channels_early_required = np.zeros(len(channel_indices), dtype=bool)    # flags the channels that are needed for early re-ref
+        channels_early_required[[channel_indices[channel] for channel in early_req_channels]] = True
+        channels_early_collected = np.zeros(len(channel_indices), dtype=bool)   # tracks for each channel if the channel-data is added to the early re-ref group averages
 
         early_group_data = dict()                       # for each early re-ref group stores the (total/average) data
         early_group_numdata = dict()                    # for each early re-ref group stores the num of samples for each datapoint in the (total) data
-        early_group_channels_collected = dict()         # tracks for each early re-ref group all the channels that need to be collected
+        early_group_channels = dict()                   # for each early re-ref group the indices of all the channels that need to be collected
         for group in early_req_groups:
             early_group_data[str(group)] = None
             early_group_numdata[str(group)] = None
-            early_group_channels_collected[str(group)] = dict()
-            for channel in early_reref.groups[group]:
-                early_group_channels_collected[str(group)][channel] = False
+            early_group_channels[str(group)] = np.array([channel_indices[channel] for channel in dict.fromkeys(early_reref.groups[group])], dtype=int)
+        early_groups_channels = np.concatenate(list(early_group_channels.values()))
+
+        # for each channel the early re-ref groups (and their keys) that require the channel, in order of the groups
+        early_channel_groups = [[] for _ in range(len(channel_indices))]
+        for group in early_req_groups:
+            for group_channel_idx in early_group_channels[str(group)].tolist():
+                early_channel_groups[group_channel_idx].append((group, str(group)))
+
+        # for each early re-ref group the number of channels that still need to be collected
+        early_group_remaining = {group_key: len(group_channels) for group_key, group_channels in early_group_channels.items()}
 
     if late_reref is not None:
-        channel_late_reref_collected = dict()          # tracks for each channel if the channel-data is added to the late re-ref group averages
-        for channel in late_req_channels:
-            channel_late_reref_collected[channel] = False
+        channels_late_required = np.zeros(len(channel_indices), dtype=bool)     # flags the channels that are needed for late re-ref
+        channels_late_required[[channel_indices[channel] for channel in late_req_channels]] = True
+        channels_late_collected = np.zeros(len(channel_indices), dtype=bool)    # tracks for each channel if the channel-data is added to the late re-ref group averages
 
         late_group_data = dict()                        # for each late re-ref group stores the (total/average) data
         late_group_numdata = dict()                     # for each late re-ref group stores the num of samples for each datapoint in the (total) data
-        late_group_channels_collected = dict()          # tracks for each late re-ref group all the channels that need to be collected
+        late_group_channels = dict()                    # for each late re-ref group the indices of all the channels that need to be collected
         for group in late_req_groups:
             late_group_data[str(group)] = None
             late_group_numdata[str(group)] = None
-            late_group_channels_collected[str(group)] = dict()
-            for channel in late_reref.groups[group]:
-                late_group_channels_collected[str(group)][channel] = False
+            late_group_channels[str(group)] = np.array([channel_indices[channel] for channel in dict.fromkeys(late_reref.groups[group])], dtype=int)
+        late_groups_channels = np.concatenate(list(late_group_channels.values()))
+
+        # for each channel the late re-ref groups (and their keys) that require the channel, in order of the groups
+        late_channel_groups = [[] for _ in range(len(channel_indices))]
+        for group in late_req_groups:
+            for group_channel_idx in late_group_channels[str(group)].tolist():
+                late_channel_groups[group_channel_idx].append((group, str(group)))
+
+        # for each late re-ref group the number of channels that still need to be collected
+        late_group_remaining = {group_key: len(group_channels) for group_key, group_channels in late_group_channels.items()}
+
+    # keep count of the progression, so the progress bar can be updated without going over the states of all channels
+    # Note: a channel counts once for every re-ref group it is part of, so the number of times each channel occurs in
+    #       the groups is determined beforehand
+    num_channels_epoched = 0
+    num_early_collected = 0
+    num_late_collected = 0
+    if early_reref is not None:
+        early_group_occurrences = np.bincount(early_groups_channels, minlength=len(channel_indices)).tolist()
+    if late_reref is not None:
+        late_group_occurrences = np.bincount(late_groups_channels, minlength=len(channel_indices)).tolist()
 
     channel_data = dict()
-    channel_hp_applied = dict()              # tracks for each channel in the channel-data matrix if high-pass filtering is applied
-    channel_early_applied = dict()           # tracks for each channel in the channel-data matrix if early re-ref is applied
-    channel_lnr_applied = dict()             # tracks for each channel in the channel-data matrix if line-noise removal is applied
-    for channel in all_channels:
+    for channel in channel_indices:
         channel_data[channel] = None
-        channel_hp_applied[channel] = False
-        channel_early_applied[channel] = False
-        channel_lnr_applied[channel] = False
+    channels_hp_applied = np.zeros(len(channel_indices), dtype=bool)        # tracks for each channel in the channel-data matrix if high-pass filtering is applied
+    channels_early_applied = np.zeros(len(channel_indices), dtype=bool)     # tracks for each channel in the channel-data matrix if early re-ref is applied
+    channels_lnr_applied = np.zeros(len(channel_indices), dtype=bool)       # tracks for each channel in the channel-data matrix if line-noise removal is applied
 
 
     #
@@ -1424,19 +2421,48 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
         # normalize the high-pass cut-off frequency using the nyquist frequency (srate / 2)
         cut_freq = pass_freq / (data_reader.sampling_rate / 2)
 
-        # design a butterworth filter and get the filter coefficients (numerator / denominator (‘ba’)
-        hp_numerator, hp_denominator = butter(order, cut_freq, btype='highpass', analog=False, output='ba', fs=fs)
+        # design a butterworth filter and get the filter coefficients as second-order sections (‘sos’)
+        # Note: the coefficients are designed once and reused for all channels. Second-order sections are numerically
+        #       more robust than numerator / denominator (‘ba’) coefficients at low cut-off frequencies
+        hp_sos = butter(order, cut_freq, btype='highpass', analog=False, output='sos', fs=fs)
+        hp_padlen = 3 * 2 * len(hp_sos)
+
+        # design a causal first-order high-pass as: R[k] = alpha * R[k - 1] + sqrt(alpha) * (I[k] - I[k - 1])
+        # Note: the initial filter state is set to the steady state of the first sample, avoiding a step-response
+        #       at the start of the data
+        hp_alpha = np.exp(-2 * np.pi * pass_freq / fs)
+        hp_onepole_numerator = np.sqrt(hp_alpha) * np.array([1.0, -1.0])
+        hp_onepole_denominator = np.array([1.0, -hp_alpha])
+        hp_onepole_zi = lfilter_zi(hp_onepole_numerator, hp_onepole_denominator)
         # TODO: the 'ba' or 'sos' returned by butter differ from what matlab gives
-
-        #sos = butter(order, normal_cutoff, btype='highpass', analog=False, output='sos', fs=fs)
         #sos2 = [[1, -2, 1, 1, -1.998780375302085, 0.998781118591159]]  # taken from matlab
-        #print(sos)
 
 
     if line_noise_removal is not None:
 
-        # design a notch filter and get the filter coefficients (numerator / denominator (‘ba’)
-        lnr_numerator, lnr_denominator = iirnotch(line_noise_removal, 30.0, data_reader.sampling_rate)
+        # design a notch filter and convert the filter coefficients (numerator / denominator (‘ba’) to second-order sections
+        lnr_sos = tf2sos(*iirnotch(line_noise_removal, 30.0, data_reader.sampling_rate))
+        lnr_padlen = 3 * 2 * len(lnr_sos)
+
+    # Note: the filter coefficients are kept in 64-bit, so the channels are filtered in 64-bit (also when the data is
+    #       read as 32-bit floats, e.g. BrainVision or EDF). The poles of the high-pass filter lie very close to the unit
+    #       circle, with 32-bit coefficients and filter states the response would deviate and errors would accumulate
+    #       over the (long) channel time-series. The filtered channel is 64-bit, which is also needed for re-referencing
+    def apply_high_pass(in_channel_data):
+        if high_pass_method == 'onepole':
+            filtered_data, _ = lfilter(hp_onepole_numerator, hp_onepole_denominator, in_channel_data,
+                                       zi=hp_onepole_zi * in_channel_data[0])
+            return filtered_data
+
+        # Note: the padding length is set to that of filtfilt with 'ba' coefficients (3 * filter order)
+        return sosfiltfilt(hp_sos, in_channel_data, padtype='odd', padlen=hp_padlen)
+
+    def apply_line_noise_removal(in_channel_data):
+
+        # Note: the notch is a single biquad section, sosfiltfilt already runs the forward and backward passes of the
+        #       section in compiled code (only the odd-extension of the padding is allocated), so there is little to
+        #       gain from a hand-written filter loop while it would add a (JIT compiler) dependency to the package
+        return sosfiltfilt(lnr_sos, in_channel_data, padtype='odd', padlen=lnr_padlen)
 
 
     #
@@ -1469,13 +2495,13 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                     prop_late_collected = .1
 
         # retrieve proportions
-        progression_channel_epoched = sum(channel_epoched.values()) / len(channel_epoched)
+        progression_channel_epoched = num_channels_epoched / num_epoch_channels
         progression_early_collected = 0
         progression_late_collected = 0
         if early_reref is not None:
-            progression_early_collected = sum([sum(v.values()) for v in early_group_channels_collected.values()]) / sum([len(v) for v in early_group_channels_collected.values()])
+            progression_early_collected = num_early_collected / len(early_groups_channels)
         if late_reref is not None:
-            progression_late_collected = sum([sum(v.values()) for v in late_group_channels_collected.values()]) / sum([len(v) for v in late_group_channels_collected.values()])
+            progression_late_collected = num_late_collected / len(late_groups_channels)
 
         # update the progress bar
         prop = prop_channel_epoched * progression_channel_epoched + prop_early_collected * progression_early_collected + prop_late_collected * progression_late_collected
@@ -1489,22 +2515,147 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
     # Process
     #
 
-    # until all channels are epoch-ed (fully processed)
-    while not all(channel_epoched.values()):
+    # Note: channel data is released by removing the (only) reference to its numpy array, upon which the memory is
+    #       freed immediately by reference counting. No explicit garbage collection (gc.collect) is performed, which
+    #       would traverse all tracked python objects for every channel while there are no reference cycles to break
+
+    # check if the channels can be processed independently of each other (no re-referencing) and optimized for speed
+    if early_reref is None and late_reref is None and priority == 'speed' and len(retrieve_channels) > 1:
+        # filter the channels in parallel (scipy's filter routines release the GIL) while the next channels are
+        # retrieved, and epoch the filtered channels in order as they become available
 
-        # loop over all the required channels
-        # Note: potentially even over the ones that do not need to be retrieved but are still needed for re-referencing
-        for channel in all_channels:
-            channel_idx = None
+        def filter_channel(in_channel_data):
+            if high_pass:
+                in_channel_data = apply_high_pass(in_channel_data)
+            if line_noise_removal is not None:
+                in_channel_data = apply_line_noise_removal(in_channel_data)
+            return in_channel_data
 
-            # check if we need this channel, which is the case when:
-            #   - it still needs to be epoch-ed
-            #   - when it is needed for early re-ref but not collected
-            #   - when it is needed for late re-ref but not collected
-            if (channel in channel_epoched.keys() and not channel_epoched[channel]) or \
-               (early_reref is not None and channel in early_req_channels and not channel_early_reref_collected[channel]) or \
-               (late_reref is not None and channel in late_req_channels and not channel_late_reref_collected[channel]):
-                # needed, process channel
+        from concurrent.futures import ThreadPoolExecutor
+        num_workers = min(os.cpu_count() or 1, len(retrieve_channels))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+
+            # submit the channels for filtering, keeping at most twice the number of workers in memory
+            filter_futures = dict()
+            for channel_idx in range(len(retrieve_channels) + num_workers * 2):
+
+                # retrieve the channel data and submit it for filtering
+                if channel_idx < len(retrieve_channels):
+                    try:
+                        filter_futures[channel_idx] = executor.submit(filter_channel, data_reader.retrieve_channel_data(retrieve_channels[channel_idx], True))
+                    except RuntimeError:
+                        raise RuntimeError('Error upon retrieving data')
+
+                # epoch the oldest channel that was submitted
+                epoch_channel_idx = channel_idx - num_workers * 2
+                if epoch_channel_idx < 0 or epoch_channel_idx >= len(retrieve_channels):
+                    continue
+                try:
+                    filtered_data = filter_futures.pop(epoch_channel_idx).result()
+                    if average:
+                        __subload_data_epoch_averages__from_channel__by_condition_trials(data, metric_values,
+                                                                                         data_reader, epoch_channel_idx, retrieve_channels[epoch_channel_idx], filtered_data,
+                                                                                         onsets, trial_epoch,
+                                                                                         baseline_method, baseline_epoch,
+                                                                                         out_of_bound_method,
+                                                                                         metric_callbacks)
+                    else:
+                        __epoch_data__from_channel_data__by_trials(data,
+                                                                   epoch_channel_idx, filtered_data,
+                                                                   data_reader.sampling_rate,
+                                                                   onsets, trial_epoch,
+                                                                   baseline_method, baseline_epoch, out_of_bound_method,
+                                                                   trial_bounds_cache=trial_bounds_cache)
+                except (MemoryError, RuntimeError):
+                    raise RuntimeError('Error upon loading and epoching data')
+                del filtered_data
+
+                # mark channel as epoch-ed (fully processed) and update the progress bar
+                epoch_channel_state_idx = channel_indices[retrieve_channels[epoch_channel_idx]]
+                if not channels_epoched[epoch_channel_state_idx]:
+                    channels_epoched[epoch_channel_state_idx] = True
+                    num_channels_epoched += 1
+                update_progressbar()
+
+    # whether early and/or late re-referencing is applied (evaluated once, instead of for every channel in every pass)
+    has_early_reref = early_reref is not None
+    has_late_reref = late_reref is not None
+
+    # convert the exclusion epochs (in seconds) of the channels to sample ranges once, so the inclusion vector of a
+    # channel can be created directly from the ranges when its data is added to the re-referencing groups
+    # Note: np.rint rounds half to even, which is the same as the built-in round(). The ranges are kept as built-in
+    #       integers so that the slicing of the inclusion vector is the same as before
+    def exclude_sample_ranges(channel_exclude_epochs):
+        if channel_exclude_epochs is None:
+            return None
+        return {channel: np.rint(np.array(exclude_epochs, dtype=np.float64).reshape(-1, 2) * data_reader.sampling_rate).astype(int).tolist()
+                for channel, exclude_epochs in channel_exclude_epochs.items()}
+    early_exclude_ranges = exclude_sample_ranges(early_reref.channel_exclude_epochs) if has_early_reref else None
+    late_exclude_ranges = exclude_sample_ranges(late_reref.channel_exclude_epochs) if has_late_reref else None
+
+    # a single buffer that is re-used (by every channel, in both early and late re-referencing) to hold the inclusion
+    # vector of a channel with exclusion epochs, instead of allocating a new vector for each channel. The exclusion
+    # ranges that the buffer holds are tracked, so the vector is not rebuilt when the next use is for the same ranges
+    reref_include_cache = None
+    if early_exclude_ranges or late_exclude_ranges:
+        reref_include_cache = {'buffer': np.empty(data_reader.num_samples, dtype=bool), 'ranges': None}
+
+    # function to determine (for all channels at once) whether a channel (still) needs to be processed, which is the case when:
+    #   - it still needs to be epoch-ed
+    #   - when it is needed for early re-ref but not collected
+    #   - when it is needed for late re-ref but not collected
+    def channels_need_processing():
+        needs_processing = np.zeros(len(channel_indices), dtype=bool)
+        needs_processing[:num_epoch_channels] = ~channels_epoched
+        if has_early_reref:
+            needs_processing |= channels_early_required & ~channels_early_collected
+        if has_late_reref:
+            needs_processing |= channels_late_required & ~channels_late_collected
+        return needs_processing.tolist()
+
+    # determine the channels that need to be processed
+    # Note: potentially even the ones that do not need to be retrieved but are still needed for re-referencing
+    # Note: a channel that is listed more than once is only processed once per pass, so that its data is not
+    #       collected into the re-referencing groups multiple times
+    # Note: in the first pass, the channels that contribute to re-referencing groups are visited before the channels
+    #       that are only re-referenced (without being part of a group). All the early re-referencing groups are then
+    #       complete by the time such a channel is visited, so it can be re-referenced directly instead of having to
+    #       wait for (and, when optimized for memory, be reloaded in) a next pass. Re-referencing still requires a next
+    #       pass for the channels that are needed to complete a group first. The order of the contributing channels
+    #       is kept, so the group totals are accumulated in the same order
+    needs_processing = channels_need_processing()
+    pending_channels = [channel for channel in channel_indices if needs_processing[channel_indices[channel]]]
+    if has_early_reref or has_late_reref:
+        channels_contribute = np.zeros(len(channel_indices), dtype=bool)
+        if has_early_reref:
+            channels_contribute |= channels_early_required
+        if has_late_reref:
+            channels_contribute |= channels_late_required
+        channels_contribute = channels_contribute.tolist()
+        pending_channels = [channel for channel in pending_channels if channels_contribute[channel_indices[channel]]] + \
+                           [channel for channel in pending_channels if not channels_contribute[channel_indices[channel]]]
+
+    # the channel data is retrieved on a (single) background thread, which allows the data of the next channel in a
+    # pass to be retrieved while the current channel is being filtered, re-referenced and epoched
+    # Note: all the retrievals go through the single worker, so the reader is never accessed concurrently. At most
+    #       one channel is prefetched ahead, which limits the additional memory to the data of a single channel
+    from concurrent.futures import ThreadPoolExecutor
+    retrieve_executor = ThreadPoolExecutor(max_workers=1)
+    retrieve_futures = dict()
+
+    # Note: the retrieval thread is always stopped before returning to the caller (also on errors), so a prefetch
+    #       that is still running cannot access the reader after the caller closed it
+    try:
+        # until all channels are processed
+        # Note: the processing state of a channel only changes when the channel itself is processed, so the channels that
+        #       need processing can be determined once per pass. After each pass, only the channels that are still waiting
+        #       for re-referencing information (from other channels) are passed over again, in the same order
+        while pending_channels:
+
+            # loop over the channels that need processing
+            for pending_idx, channel in enumerate(pending_channels):
+                channel_idx = None
+                channel_state_idx = channel_indices[channel]
 
                 # check if channel data is available
                 # Note: during speed option the channel data is kept in memory, so no reloading is required when still in memory
@@ -1512,39 +2663,43 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                     #print(channel + ": load")
 
                     # retrieve the channel data
-                    # TODO: consider data type
+                    # Note: the channel data is kept in the data-type that the reader returns, it is not promoted up front
                     #       - PyMEF will always return float64
                     #         (original data format is 32-bit integer, but outputting float64 allows NaNs for discontinuities in the time-series and still retains 53-bit significand precision to hold the exact 32-bit value)
-                    #       - Brainvision can be 16-bit integer, 32-bit integer or 32-bit float. However, the resolution in the channel acts as multiplication factor
-                    #         As such, if the multiplication factor is 1 (or empty) then the output will always be in 32-bit floats (not 64-bit to save memory).
-                    #         However, if a multiplication factor
+                    #       - Brainvision can be 16-bit integer, 32-bit integer or 32-bit float. If the channel resolutions (which act
+                    #         as multiplication factor) are all 1, then 16-bit integer and 32-bit float data are returned as 32-bit
+                    #         floats (to save memory). Otherwise, or with 32-bit integer data, the output is in 64-bit floats
+                    #       The filters (high-pass and line-noise removal) run in 64-bit (see apply_high_pass) and therefore
+                    #       return 64-bit channel data. The data is only stored at reduced precision in the output matrix,
+                    #       which holds 32-bit floats unless high_precision is requested
                     # Note: ensure it is not a view, elsewise manipulations further on might adjust the source data
                     try:
-                        channel_data[channel] = data_reader.retrieve_channel_data(channel, True)
+                        retrieve_future = retrieve_futures.pop(channel, None)
+                        if retrieve_future is None:
+                            retrieve_future = retrieve_executor.submit(data_reader.retrieve_channel_data, channel, True)
+                        channel_data[channel] = retrieve_future.result()
                     except RuntimeError:
                         raise RuntimeError('Error upon retrieving data')
 
+                # prefetch the data of the next channel in the pass (if it is not in memory already)
+                if pending_idx + 1 < len(pending_channels):
+                    next_channel = pending_channels[pending_idx + 1]
+                    if channel_data[next_channel] is None and next_channel not in retrieve_futures:
+                        retrieve_futures[next_channel] = retrieve_executor.submit(data_reader.retrieve_channel_data, next_channel, True)
+
                 #
                 # High-pass filtering
                 #
-                if high_pass and not channel_hp_applied[channel]:
+                if high_pass and not channels_hp_applied[channel_state_idx]:
                     #print(channel + ": HP")
 
                     # Filter the data
-                    channel_data[channel] = filtfilt(hp_numerator, hp_denominator, channel_data[channel], padtype='odd', padlen=3 * (max(len(hp_numerator), len(hp_denominator)) - 1))
+                    channel_data[channel] = apply_high_pass(channel_data[channel])
 
                     # TODO: more exact translation from matlab
-                    #       sosfiltfilt (so with sos) returns different values on the same data
-                    #y = filtfilt(sos, gain, channel_data[channel])
-                    #y = filtfilt(hp_numerator, hp_denominator, channel_data[channel])
-                    #y = filtfilt(hp_numerator, hp_denominator, channel_data[channel], padtype='odd', padlen=3 * (max(len(b), len(a)) - 1))
-                    #y2 = signal.sosfiltfilt(sos2, channel_data[channel], padtype=None)
-                    #python padlength = 3 * (2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum()))
-                    #print(y[1:10])
-                    #print(y2[1:10])
 
                     # set high passing as to been applied to the channel-data in memory
-                    channel_hp_applied[channel] = True
+                    channels_hp_applied[channel_state_idx] = True
 
 
                 #
@@ -1552,85 +2707,48 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                 #
 
                 # check if early re-referencing needed
-                if early_reref is not None:
+                if has_early_reref:
 
                     #
                     # Early re-referencing collect
                     #
 
                     # check if the data of this channel (at this point) is already collected for the early re-reference groups
-                    if not channel_early_reref_collected[channel]:
+                    if not channels_early_collected[channel_state_idx]:
                         # early not collected
                         #print(channel + ": Collecting early reref values from channel")
 
-                        # loop over the early-reref groups
-                        for group in early_req_groups:
-
-                            # check if this group requires this channel
-                            if channel in early_group_channels_collected[str(group)].keys():
-
-                                # create arrays to hold the group data if not yet initialized
-                                if early_group_data[str(group)] is None:
-                                    early_group_data[str(group)] = np.zeros((len(channel_data[channel]),), dtype=np.float64)
-                                    if early_reref.channel_exclude_epochs is not None:
-                                        early_group_numdata[str(group)] = np.zeros((len(channel_data[channel]),), dtype=np.uint16)
-
-                                # add to group data
-                                if early_reref.channel_exclude_epochs is None or channel not in early_reref.channel_exclude_epochs:
-
-                                    # no exclusion epochs, just add the whole channel
-                                    early_group_data[str(group)] += channel_data[channel]
-
-                                    # count the number of samples added to the total if needed
-                                    if early_reref.channel_exclude_epochs is not None:
-                                        early_group_numdata[str(group)] += 1
-
-                                else:
-                                    # channel has exclusion epochs
-
-                                    # create a binary numpy vector of the samples to include
-                                    channel_includes = np.ones((len(channel_data[channel]),), dtype=bool)
-                                    for channel_exclude_epoch in early_reref.channel_exclude_epochs[channel]:
-                                        exclude_sample_start = int(round(channel_exclude_epoch[0] * data_reader.sampling_rate))
-                                        exclude_sample_end = int(round(channel_exclude_epoch[1] * data_reader.sampling_rate))
-                                        channel_includes[exclude_sample_start:exclude_sample_end] = 0
-
-                                    # add the channel (taking into account on the inclusion vector)
-                                    early_group_data[str(group)] += (channel_data[channel] * channel_includes)
-                                    early_group_numdata[str(group)] += channel_includes
-                                    pass
-
-                                # flag channel within the group as collected
-                                early_group_channels_collected[str(group)][channel] = True
-
-                                # check whether all the channels in the group are collected
-                                if all(early_group_channels_collected[str(group)].values()):
-
-                                    # take the average over the total
-                                    # (if specific epochs were excluded, each sample should be divided by its own number)
-                                    if early_reref.channel_exclude_epochs is not None:
-                                        early_group_data[str(group)] /= early_group_numdata[str(group)]
-
-                                        # clear the array was used for division
-                                        del early_group_numdata[str(group)]
-
-                                    else:
-                                        early_group_data[str(group)] /= len(early_group_channels_collected[str(group)])
-
-                        # flag that for this channel the re-ref values have been collected
-                        channel_early_reref_collected[channel] = True
+                        # flag that for this channel the re-ref values are collected
+                        # Note: flagged before the channel is added to the groups, so that the check whether all the channels in
+                        #       a group are collected includes this channel
+                        channels_early_collected[channel_state_idx] = True
+                        num_early_collected += early_group_occurrences[channel_state_idx]
+                        for _, group_key in early_channel_groups[channel_state_idx]:
+                            early_group_remaining[group_key] -= 1
+
+                        # add the channel to the early re-ref groups that require this channel
+                        _add_channel_to_reref_groups(channel_data[channel], early_channel_groups[channel_state_idx],
+                                                     early_req_groups, early_group_data, early_group_numdata,
+                                                     None if early_exclude_ranges is None else early_exclude_ranges.get(channel),
+                                                     count_samples=early_exclude_ranges is not None,
+                                                     include_cache=reref_include_cache)
+
+                        # average the groups of which all the channels are collected
+                        for _, group_key in early_channel_groups[channel_state_idx]:
+                            if early_group_remaining[group_key] == 0:
+                                _average_reref_group(group_key, early_group_data, early_group_numdata,
+                                                     len(early_group_channels[group_key]))
 
                         # update the progress bar
                         update_progressbar()
 
                         # check if channel is no longer needed after this (for epoch-ing or for late re-ref)
                         # Note: this also means the channel was only loaded for early re-referencing
-                        if channel not in channel_epoched.keys() and (late_reref is None or channel not in channel_late_reref_collected):
+                        if channel_state_idx >= num_epoch_channels and (not has_late_reref or not channels_late_required[channel_state_idx]):
                             # channel-data is no longer needed at all
 
                             # remove the reference to the numpy array, this way the memory should be available for collection
                             channel_data[channel] = None
-                            gc.collect()
 
                             # skip to next channel
                             continue
@@ -1640,22 +2758,26 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                     #
 
                     # check if early re-referencing is not applied to this channel
-                    if not channel_early_applied[channel]:
+                    if not channels_early_applied[channel_state_idx]:
 
                         # retrieve the early re-ref group for this channel
-                        group = early_reref.channel_group[channel]
+                        group_key = str(early_reref.channel_group[channel])
 
                         # check if all the early re-referencing information is available yet (early average for this group)
-                        if all(early_group_channels_collected[str(group)].values()):
+                        if early_group_remaining[group_key] == 0:
                             # all required information is available, perform early re-referencing on the channel
 
                             #print(channel + ": performing early reref on channel")
 
                             # perform early re-ref using reref_values
-                            channel_data[channel] -= early_group_data[str(group)]
+                            # Note: the subtraction is performed in place (the ufunc writes into the channel data, also
+                            #       when the channel data is 32-bit and the 64-bit group average is cast in small buffered
+                            #       chunks), so no full-length temporary is created. The group average is deliberately not
+                            #       cast to 32-bit beforehand, that would round the average before the subtraction as well
+                            channel_data[channel] -= early_group_data[group_key]
 
                             # set early re-referencing as to have been applied to the channel-data in memory
-                            channel_early_applied[channel] = True
+                            channels_early_applied[channel_state_idx] = True
 
                             # TODO: if this is the latest channel to use the early group average, see if we can safely clear the group average array
                             #       note that early re-ref data still might be needed at late re-ref
@@ -1672,10 +2794,9 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
 
                                 # remove the reference to the numpy array, this way the memory should be available for collection
                                 channel_data[channel] = None
-                                gc.collect()
 
                                 # since we need to reload the channel the next iteration, we will also have to high-pass it again
-                                channel_hp_applied[channel] = False
+                                channels_hp_applied[channel_state_idx] = False
 
                             # continue to the next channel
                             continue
@@ -1683,15 +2804,19 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                 #
                 # Line noise removal
                 #
-                if line_noise_removal is not None and not channel_lnr_applied[channel]:
+                if line_noise_removal is not None and not channels_lnr_applied[channel_state_idx]:
 
                     #print(channel + ": LNR - " + str(line_noise_removal))
 
                     # Filter the data
-                    channel_data[channel] = filtfilt(lnr_numerator, lnr_denominator, channel_data[channel], padtype='odd', padlen=3 * (max(len(lnr_numerator), len(lnr_denominator)) - 1))
+                    # Note: the channels are filtered one at a time, also when optimized for speed. A channel only reaches
+                    #       this point after its early re-referencing is applied, so the channels become ready at different
+                    #       moments. Stacking them for a single (multi-row) filter call would copy all channel data once more
+                    #       while saving only the per-call overhead, which is negligible compared to filtering a full channel
+                    channel_data[channel] = apply_line_noise_removal(channel_data[channel])
 
                     # set line noise removal to have been applied to the channel-data in memory
-                    channel_lnr_applied[channel] = True
+                    channels_lnr_applied[channel_state_idx] = True
 
 
                 #
@@ -1699,181 +2824,150 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                 #
 
                 # check if late re-referencing needed
-                if late_reref is not None:
+                if has_late_reref:
 
                     #
                     # Late re-referencing collect
                     #
 
                     # check if the data of this channel (at this point) is already collected for the late re-reference groups
-                    if not channel_late_reref_collected[channel]:
+                    if not channels_late_collected[channel_state_idx]:
                         # late not collected
                         #print(channel + ": Collecting late reref values from channel")
 
-                        # loop over the late-reref groups
-                        for group in late_req_groups:
-
-                            # check if this group requires this channel
-                            if channel in late_group_channels_collected[str(group)].keys():
-
-                                # check if the channel selection for late re-referencing is based on the variance
-                                if late_reref.late_group_reselect_varPerc is None:
-                                    # late re-referencing does not require channel selection based on variance
-
-                                    # create arrays to hold the group common average data if not yet initialized
-                                    if late_group_data[str(group)] is None:
-                                        late_group_data[str(group)] = np.zeros((len(channel_data[channel]),), dtype=np.float64)
-                                        if late_reref.channel_exclude_epochs is not None:
-                                            late_group_numdata[str(group)] = np.zeros((len(channel_data[channel]),), dtype=np.uint16)
-
-                                    # check if there are exclusion epochs
-                                    if late_reref.channel_exclude_epochs is None or channel not in late_reref.channel_exclude_epochs:
+                        # flag that for this channel the late re-ref values are collected
+                        # Note: flagged before the channel is added to the groups, so that the check whether all the channels in
+                        #       a group are collected includes this channel
+                        channels_late_collected[channel_state_idx] = True
+                        num_late_collected += late_group_occurrences[channel_state_idx]
+                        for _, group_key in late_channel_groups[channel_state_idx]:
+                            late_group_remaining[group_key] -= 1
 
-                                        # no exclusion epochs, just add the whole channel
-                                        late_group_data[str(group)] += channel_data[channel]
-
-                                        # count the number of samples added to the total if needed
-                                        if late_reref.channel_exclude_epochs is not None:
-                                            late_group_numdata[str(group)] += 1
+                        # add the channel to the late re-ref groups that require this channel, unless the channel selection
+                        # for late re-referencing is based on the variance
+                        if late_reref.late_group_reselect_varPerc is None:
+                            _add_channel_to_reref_groups(channel_data[channel], late_channel_groups[channel_state_idx],
+                                                         late_req_groups, late_group_data, late_group_numdata,
+                                                         None if late_exclude_ranges is None else late_exclude_ranges.get(channel),
+                                                         count_samples=late_exclude_ranges is not None,
+                                                         include_cache=reref_include_cache)
+
+                        # loop over the late-reref groups that require this channel
+                        for group, group_key in late_channel_groups[channel_state_idx]:
+
+                            # check if the channel selection for late re-referencing is based on the variance
+                            if late_reref.late_group_reselect_varPerc is not None:
+                                # late re-referencing requires channel selection based on variance
+                                # Note: the condition averages are also retrieved together with the condition variance in one go, both are
+                                #       used later to determine to calculate common average for each condition in the reference
+
+                                #
+                                if channel_idx is None:
+                                    try:
+                                        channel_idx = retrieve_channels.index(channel)
+                                    except ValueError:
+                                        logging.error('Could not find epoch channel ' + channel + ' in the list of channels to retrieve')
+                                        raise RuntimeError('Could not find late ref channel in retrieve list')
+
+                                # check if there are exclusion epochs
+                                channel_exclude_epochs = None
+                                if late_reref.channel_exclude_epochs is not None and channel in late_reref.channel_exclude_epochs:
+                                    channel_exclude_epochs = late_reref.channel_exclude_epochs[channel]
+
+                                # create arrays to hold the group variances data if not yet initialized
+                                if late_group_data[group_key] is None:
+
+                                    # TODO: maybe improve
+                                    # Note: deliberately make this array larger so that the index of the channels in the 'data' variable and the 'late_group_data[group_key]' variable can match
+                                    late_group_data[group_key] = allocate_array((len(retrieve_channels), len(onsets)),
+                                                                                 fill_value=np.nan, dtype=np.float64)
+                                    #late_group_data[group_key] = allocate_array((len(late_reref.groups[group]), len(onsets)), fill_value=np.nan, dtype=np.float64)
 
-                                    else:
-                                        # channel has exclusion epochs
 
-                                        # create a binary numpy vector of the sample to include
-                                        channel_includes = np.ones((len(channel_data[channel]),), dtype=bool)
-                                        for channel_exclude_epoch in late_reref.channel_exclude_epochs[channel]:
-                                            exclude_sample_start = int(round(channel_exclude_epoch[0] * data_reader.sampling_rate))
-                                            exclude_sample_end = int(round(channel_exclude_epoch[1] * data_reader.sampling_rate))
-                                            channel_includes[exclude_sample_start:exclude_sample_end] = 0
+                                # Note 1: 'data' will hold the averages to be used to the common averages per channel per condition later, after the
+                                #         common averages are determined, the values in data will be cleared/overwritten with the actual output data
+                                __subload_data_epoch_averages__from_channel__by_condition_trials(data, None,
+                                                                                                 data_reader, channel_idx, channel, channel_data[channel],
+                                                                                                 onsets, trial_epoch,
+                                                                                                 0, None,
+                                                                                                 out_of_bound_method,
+                                                                                                 metric_callbacks=None,
+                                                                                                 exclude_epochs=channel_exclude_epochs,
+                                                                                                 var_epoch=(.015, .5), ref_var=late_group_data[group_key])
 
-                                        # add the channel (taking into account on the inclusion vector)
-                                        late_group_data[str(group)] += (channel_data[channel] * channel_includes)
-                                        late_group_numdata[str(group)] += channel_includes
+                            # check whether all the channels in the group are collected
+                            if late_group_remaining[group_key] == 0:
 
+                                # check if the channel selection for late re-referencing is based on the variance
+                                if late_reref.late_group_reselect_varPerc is None:
+                                    # late re-referencing does not require channel selection based on variance
+                                    _average_reref_group(group_key, late_group_data, late_group_numdata,
+                                                         len(late_group_channels[group_key]))
 
                                 else:
                                     # late re-referencing requires channel selection based on variance
-                                    # Note: the condition averages are also retrieved together with the condition variance in one go, both are
-                                    #       used later to determine to calculate common average for each condition in the reference
-
-                                    #
-                                    if channel_idx is None:
-                                        try:
-                                            channel_idx = retrieve_channels.index(channel)
-                                        except ValueError:
-                                            logging.error('Could not find epoch channel ' + channel + ' in the list of channels to retrieve')
-                                            raise RuntimeError('Could not find late ref channel in retrieve list')
-
-                                    # check if there are exclusion epochs
-                                    channel_exclude_epochs = None
-                                    if late_reref.channel_exclude_epochs is not None and channel in late_reref.channel_exclude_epochs:
-                                        channel_exclude_epochs = late_reref.channel_exclude_epochs[channel]
-
-                                    # create arrays to hold the group variances data if not yet initialized
-                                    if late_group_data[str(group)] is None:
-
-                                        # TODO: maybe improve
-                                        # Note: deliberately make this array larger so that the index of the channels in the 'data' variable and the 'late_group_data[str(group)]' variable can match
-                                        late_group_data[str(group)] = allocate_array((len(retrieve_channels), len(onsets)),
-                                                                                     fill_value=np.nan, dtype=np.float64)
-                                        #late_group_data[str(group)] = allocate_array((len(late_reref.groups[group]), len(onsets)), fill_value=np.nan, dtype=np.float64)
-
-
-                                    # Note 1: 'data' will hold the averages to be used to the common averages per channel per condition later, after the
-                                    #         common averages are determined, the values in data will be cleared/overwritten with the actual output data
-                                    __subload_data_epoch_averages__from_channel__by_condition_trials(data, None,
-                                                                                                     data_reader, channel_idx, channel, channel_data[channel],
-                                                                                                     onsets, trial_epoch,
-                                                                                                     0, None,
-                                                                                                     out_of_bound_method,
-                                                                                                     metric_callbacks=None,
-                                                                                                     exclude_epochs=channel_exclude_epochs,
-                                                                                                     var_epoch=(.015, .5), ref_var=late_group_data[str(group)])
-
-                                # flag channel within the group as collected
-                                late_group_channels_collected[str(group)][channel] = True
-
-                                # check whether all the channels in the group are collected
-                                if all(late_group_channels_collected[str(group)].values()):
-
-                                    # check if the channel selection for late re-referencing is based on the variance
-                                    if late_reref.late_group_reselect_varPerc is None:
-                                        # late re-referencing does not require channel selection based on variance
-
-                                        # take the average over the total
-                                        # (if specific epochs were excluded, each sample should be divided by its own number)
-                                        if late_reref.channel_exclude_epochs is not None:
-                                            late_group_data[str(group)] /= late_group_numdata[str(group)]
-
-                                            # clear the array was used divide the total to
-                                            del late_group_numdata[str(group)]
-
-                                        else:
-                                            late_group_data[str(group)] /= len(late_group_channels_collected[str(group)])
 
-                                    else:
-                                        # late re-referencing requires channel selection based on variance
+                                    # check minimum number of channels with variances within the re-referencing group
+                                    # TODO: now set to 5, discuss a default and put in config. Perhaps as warning?
+                                    variance_channels_per_condition = np.sum(~np.isnan(late_group_data[group_key]), axis=0)
+                                    if np.any(variance_channels_per_condition < 5):
+                                        logging.error('One or more stim-pairs/conditions have too few channel variances within the current late re-referencing group ' + str(group) + ' to perform channel selection by variance.\n'
+                                                      'If re-referencing with CAR per headbox, consider using just CAR.\n')
+                                        raise RuntimeError('Too few channel variances to perform channel selection')
 
-                                        # check minimum number of channels with variances within the re-referencing group
-                                        # TODO: now set to 5, discuss a default and put in config. Perhaps as warning?
-                                        variance_channels_per_condition = np.sum(~np.isnan(late_group_data[str(group)]), axis=0)
-                                        if np.any(variance_channels_per_condition < 5):
-                                            logging.error('One or more stim-pairs/conditions have too few channel variances within the current late re-referencing group ' + str(group) + ' to perform channel selection by variance.\n'
-                                                          'If re-referencing with CAR per headbox, consider using just CAR.\n')
-                                            raise RuntimeError('Too few channel variances to perform channel selection')
+                                    # determine the variance threshold (below which to include channels) per condition
+                                    variance_threshold_per_condition = np.nanquantile(late_group_data[group_key], late_reref.late_group_reselect_varPerc, axis=0)
 
-                                        # determine the variance threshold (below which to include channels) per condition
-                                        variance_threshold_per_condition = np.nanquantile(late_group_data[str(group)], late_reref.late_group_reselect_varPerc, axis=0)
+                                    # create a matrix to hold the trial epoch common average for each condition
+                                    group_CAR_per_condition = allocate_array((len(onsets), trial_num_samples),
+                                                                             fill_value=np.nan, dtype=np.float64)
 
-                                        # create a matrix to hold the trial epoch common average for each condition
-                                        group_CAR_per_condition = allocate_array((len(onsets), trial_num_samples),
-                                                                                 fill_value=np.nan, dtype=np.float64)
+                                    # only build the (per condition) channel listings when they will be logged
+                                    log_info = logging.getLogger().isEnabledFor(logging.INFO)
 
-                                        # loop over the conditions
-                                        for condition_index in range(late_group_data[str(group)].shape[1]):
+                                    # loop over the conditions
+                                    for condition_index in range(late_group_data[group_key].shape[1]):
 
-                                            # TODO: optionally mention condition name (stim-pairs)
-                                            logging.info('Re-referencing group: ' + str(group) + ' - Condition index: ' + str(condition_index))
-                                            logging.info('    - R2 threshold: ' + str(round(variance_threshold_per_condition[condition_index], 1)) + '  (at quantile: ' + str(late_reref.late_group_reselect_varPerc) + ')')
+                                        # TODO: optionally mention condition name (stim-pairs)
+                                        logging.info('Re-referencing group: %s - Condition index: %s', group, condition_index)
+                                        logging.info('    - R2 threshold: %s  (at quantile: %s)', round(variance_threshold_per_condition[condition_index], 1), late_reref.late_group_reselect_varPerc)
 
-                                            # retrieve the indices of the channels that should be used for re-referencing based on the threshold for this condition
-                                            lowest_var_channels = (late_group_data[str(group)][:, condition_index] < variance_threshold_per_condition[condition_index]).nonzero()[0]
+                                        # retrieve the indices of the channels that should be used for re-referencing based on the threshold for this condition
+                                        lowest_var_channels = (late_group_data[group_key][:, condition_index] < variance_threshold_per_condition[condition_index]).nonzero()[0]
 
-                                            # output channels with variances
-                                            var_channels_print = [retrieve_channels[var_channel] + ' (' + str(round(late_group_data[str(group)][var_channel, condition_index], 1)) + ')' for var_channel in lowest_var_channels]
-                                            var_channels_print = [str_print.ljust(len(max(var_channels_print, key=len)), ' ') for str_print in var_channels_print]
+                                        # output channels with variances
+                                        if log_info:
+                                            var_channels_print = [retrieve_channels[var_channel] + ' (' + str(round(late_group_data[group_key][var_channel, condition_index], 1)) + ')' for var_channel in lowest_var_channels]
+                                            if len(var_channels_print) > 0:
+                                                var_channels_print_length = len(max(var_channels_print, key=len))
+                                                var_channels_print = [str_print.ljust(var_channels_print_length, ' ') for str_print in var_channels_print]
                                             logging.info(multi_line_list(var_channels_print, LOGGING_CAPTION_INDENT_LENGTH, '    - Channels: ', 5, '   ', str(len(var_channels_print)) + ' of ' + str(len(late_reref.groups[group]))))
 
-                                            # check minimum number of channels within the condition
-                                            # TODO: now set to 5, discuss a default and put in config
-                                            if len(lowest_var_channels) < 5:
-                                                logging.error('Too few channels (' + str(len(lowest_var_channels))  + ' from a group of ' + str(len(late_reref.groups[group])) + ') left for re-referencing after applying the variance threshold (' + str(variance_threshold_per_condition[condition_index]) + ') for this stim-pair/condition.\n'
-                                                              'If re-referencing with CAR per headbox, consider using just CAR.\n')
-                                                raise RuntimeError('Too few channel after variance thresholding to perform channel selection')
-
-                                            # calculate condition common average
-                                            group_CAR_per_condition[condition_index, :] = np.nanmean(data[lowest_var_channels, condition_index, :], axis=0)
-
+                                        # check minimum number of channels within the condition
+                                        # TODO: now set to 5, discuss a default and put in config
+                                        if len(lowest_var_channels) < 5:
+                                            logging.error('Too few channels (' + str(len(lowest_var_channels))  + ' from a group of ' + str(len(late_reref.groups[group])) + ') left for re-referencing after applying the variance threshold (' + str(variance_threshold_per_condition[condition_index]) + ') for this stim-pair/condition.\n'
+                                                          'If re-referencing with CAR per headbox, consider using just CAR.\n')
+                                            raise RuntimeError('Too few channel after variance thresholding to perform channel selection')
 
-                                        # clear variance data and instead store the group common averages (per condition) there
-                                        del late_group_data[str(group)]
-                                        late_group_data[str(group)] = group_CAR_per_condition
+                                        # calculate condition common average
+                                        group_CAR_per_condition[condition_index, :] = _nanmean(data[lowest_var_channels, condition_index, :], axis=0)
 
 
-                        # flag that for this channel the late re-ref values have been collected
-                        channel_late_reref_collected[channel] = True
+                                    # clear variance data and instead store the group common averages (per condition) there
+                                    del late_group_data[group_key]
+                                    late_group_data[group_key] = group_CAR_per_condition
 
                         # update the progress bar
                         update_progressbar()
 
                         # check if channel is no longer needed after this (for epoching)
                         # Note: this also means the channel was only loaded for early or late re-referencing
-                        if channel not in channel_epoched.keys():
+                        if channel_state_idx >= num_epoch_channels:
                             # channel-data is no longer needed at all
 
                             # remove the reference to the numpy array, this way the memory should be available for collection
                             channel_data[channel] = None
-                            gc.collect()
 
                             # skip to next channel
                             continue
@@ -1891,10 +2985,10 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                     # late re-referenced and epoched (and the channel-data cleared)
 
                     # retrieve the late re-ref group for this channel
-                    group = late_reref.channel_group[channel]
+                    group_key = str(late_reref.channel_group[channel])
 
                     # check if all the late re-referencing information is available yet (late average for this group)
-                    if all(late_group_channels_collected[str(group)].values()):
+                    if late_group_remaining[group_key] == 0:
                         # all required information is available, perform late re-referencing on the channel
                         # print(channel + ": performing late reref on channel")
 
@@ -1902,7 +2996,7 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                             # late re-referencing does not require channel selection based on variance
 
                             # perform late re-ref using reref_values
-                            channel_data[channel] -= late_group_data[str(group)]
+                            channel_data[channel] -= late_group_data[group_key]
 
                             # TODO: if this is the latest channel to use the late group average, see if we can safely clear the group average array
 
@@ -1917,13 +3011,12 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
 
                             # remove the reference to the numpy array, this way the memory should be available for collection
                             channel_data[channel] = None
-                            gc.collect()
 
                             # since we need to reload the channel the next iteration, we will also have to high-pass, early
                             # re-ref and remove line-noise again
-                            channel_hp_applied[channel] = False
-                            channel_early_applied[channel] = False
-                            channel_lnr_applied[channel] = False
+                            channels_hp_applied[channel_state_idx] = False
+                            channels_early_applied[channel_state_idx] = False
+                            channels_lnr_applied[channel_state_idx] = False
 
                         # continue to the next channel
                         continue
@@ -1952,13 +3045,13 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                     if late_reref is not None and late_reref.late_group_reselect_varPerc is not None:
 
                         # retrieve the late re-ref group for this channel
-                        group = late_reref.channel_group[channel]
+                        group_key = str(late_reref.channel_group[channel])
 
                         # clear the data for this channel
                         data[channel_idx, :, :] = np.nan
 
                         #
-                        CAR_per_condition = late_group_data[str(group)]
+                        CAR_per_condition = late_group_data[group_key]
 
 
                     if average:
@@ -1978,7 +3071,8 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                                                                    channel_idx, channel_data[channel],
                                                                    data_reader.sampling_rate,
                                                                    onsets, trial_epoch,
-                                                                   baseline_method, baseline_epoch, out_of_bound_method)
+                                                                   baseline_method, baseline_epoch, out_of_bound_method,
+                                                                   trial_bounds_cache=trial_bounds_cache)
 
                 except (MemoryError, RuntimeError):
                     raise RuntimeError('Error upon loading and epoching data')
@@ -1988,14 +3082,33 @@ def _load_data_epochs__by_channels__withPrep(average, data_reader, retrieve_chan
                 # clear channel data from the channel-data matrix
                 # (all we needed from this channel is either in the re-ref average arrays or in the epoch data-matrix now)
                 channel_data[channel] = None
-                gc.collect()
 
                 # mark channel as epoch-ed (fully processed)
-                channel_epoched[channel] = True
+                channels_epoched[channel_state_idx] = True
+                num_channels_epoched += 1
 
                 # update the progress bar
                 update_progressbar()
 
+            # retain the channels that still need processing for the next pass
+            needs_processing = channels_need_processing()
+            pending_channels = [channel for channel in pending_channels if needs_processing[channel_indices[channel]]]
+
+    finally:
+        # stop the retrieval thread
+        retrieve_executor.shutdown(wait=True, cancel_futures=True)
+
+    # a channel that is listed more than once is only epoch-ed into the row of its first occurrence, copy those
+    # epochs (and metrics) into the rows of the other occurrences (the output matrix is not initialized)
+    first_channel_idx = dict()
+    for channel_idx, channel in enumerate(retrieve_channels):
+        if channel not in first_channel_idx:
+            first_channel_idx[channel] = channel_idx
+            continue
+        data[channel_idx] = data[first_channel_idx[channel]]
+        if average and metric_values is not None:
+            metric_values[channel_idx] = metric_values[first_channel_idx[channel]]
+
     #
     if average:
         return data_reader.sampling_rate, data, metric_values
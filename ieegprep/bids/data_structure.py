@@ -101,7 +101,7 @@ def list_bids_datasets(bids_search_directory, dataset_extensions=None, subjects_
     #         as '/desktop/sub-test/BIDS_root' will work as an input path
     # Note 2: next/os.walk is a fast method to find subject folders, see test_list_subject_dirs_perf.py
     sub_folders = next(os.walk(bids_search_directory))[1]
-    sub_folders = [f for f in sub_folders if f.lower().startswith('sub-')]
+    sub_folders = [f for f in sub_folders if f[:4].lower() == 'sub-']
     if sub_folders:
         # the input directory is in a BIDS root
 
@@ -305,36 +305,46 @@ def _search_directory_for_datasets(search_path, dataset_extensions, name_search_
     # reproduce the filter function from fnmatch but compile a case-insensitive regex
     # Note: this allows the search to be case-insensitive, but will leave the casing intact on the returned filenames (important file unix filepaths)
     # (which would be more complicated in a solution where all the search patterns and all filenames would be lowered)
-    def filter_case_insensitive(names, pat):
-        result = []
-        pat = os.path.normcase(pat)
-        regex = fnmatch.translate(pat)
-        match = re.compile(regex, re.IGNORECASE).match
+    # Note: for each extension, the search patterns are combined into a single regex (compiled once), so that the names in
+    #       each directory are only matched once per extension instead of once per extension and search pattern. Since
+    #       a name can then only match once per extension, this also prevents duplicates in the results
+    # Note: the names are first selected on their extension (a plain, case-insensitive string comparison) and only the
+    #       names with a dataset extension are matched against the regexes. Most of the files in a BIDS directory are
+    #       sidecar files (e.g. .json or .tsv) and are skipped without having to run a regex on them
+    search_patterns = ['*' + search_pattern + '*' if search_pattern else '*' for search_pattern in dict.fromkeys(name_search_patterns)]
+    lower_extensions = tuple(extension.lower() for extension in dataset_extensions)
+    extension_matchers = []
+    for extension in dataset_extensions:
+        regex = '|'.join(fnmatch.translate(os.path.normcase(search_pattern + extension)) for search_pattern in search_patterns)
+        extension_matchers.append(re.compile(regex, re.IGNORECASE).match)
+
+    def filter_case_insensitive(names, match):
         if os.path is posixpath:
-            for name in names:
-                if match(name):
-                    result.append(name)
+            return [name for name in names if match(name)]
         else:
-            for name in names:
-                if match(os.path.normcase(name)):
-                    result.append(name)
-        return result
+            return [name for name in names if match(os.path.normcase(name))]
 
 
     # loop over all folders within the search path
+    # Note: the results are ordered by extension within each folder (in order of occurrence in the extension var), which
+    #       is the order of priority when subsets with multiple formats/extensions are brought down to one format below
+    # Note: directories that are datasets themselves (e.g. MEF3 '.mefd') only hold the data of that dataset, so os.walk
+    #       does not need to descend into (and list the many channel and segment directories of) those directories
     subsets = []
     for root, dirs, files in os.walk(search_path):
         if modalities is None or root.lower().endswith(modalities):
-            for extension in dataset_extensions:
-                for search_pattern in name_search_patterns:
-                    search_pattern = '*' + search_pattern + '*' if search_pattern else '*'
-                    subsets.extend([os.path.join(root, f) for f in filter_case_insensitive(files, search_pattern + extension)])
-                    subsets.extend([os.path.join(root, f) for f in filter_case_insensitive(dirs, search_pattern + extension)])
-
-    # in the case of multiple search patterns, filenames can satisfy multiple patterns and therefore occur multiple
-    # times in the results. Check and remove duplicates here
-    if len(name_search_patterns) > 1:
-        subsets = [*set(subsets)]
+            dataset_files = [f for f in files if f.lower().endswith(lower_extensions)]
+            candidate_dirs = [d for d in dirs if d.lower().endswith(lower_extensions)]
+            dataset_dirs = []
+            for match in extension_matchers:
+                subsets.extend([os.path.join(root, f) for f in filter_case_insensitive(dataset_files, match)])
+                extension_dirs = filter_case_insensitive(candidate_dirs, match)
+                subsets.extend([os.path.join(root, f) for f in extension_dirs])
+                dataset_dirs.extend(extension_dirs)
+
+            # prune the dataset directories from the walk (in-place, which os.walk allows when walking top-down)
+            if dataset_dirs:
+                dirs[:] = [d for d in dirs if d not in dataset_dirs]
 
     # bring subsets with multiple formats/extensions down to one format (prioritized to occurrence in the extension var)
     for subset in subsets:
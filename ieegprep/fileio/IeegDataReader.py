@@ -59,6 +59,12 @@ class IeegDataReader(object):
         self.data_path = data_path
         self.preload_data = preload_data
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @abstractmethod
     def close(self): pass
 
@@ -15,20 +15,29 @@ import subprocess
 from ieegprep.utils.console import ConsoleColors
 
 
-def allocate_array(dimensions, fill_value=float('nan'), dtype=float):
+def allocate_array(dimensions, fill_value=float('nan'), dtype=float, spill_to_disk=False):
     """
-    Create and immediately allocate the memory for an x-dimensional array
+    Create and immediately allocate the memory for an x-dimensional array (or, when no fill value is given, create an
+    uninitialized array after checking that enough memory is available)
 
     Before allocating the memory, this function checks if is enough memory is available (this is needed since when a
     numpy array is allocated and there is not enough memory, sometimes python crashes without the chance to catch an error).
 
     Args:
         dimensions (int or tuple):
-        fill_value (any numeric):
+        fill_value (any numeric or None):   The value to initialize the array with. If None, the array is not initialized
+                                            (and the memory is only committed by the OS when the array is written to)
         dtype (str):
+        spill_to_disk (bool):               When there is not enough memory available, back the array by a temporary
+                                            file (a memory-mapped array) instead of raising a MemoryError. The OS then
+                                            pages the array between memory and disk as it is written and read
 
     Returns:
-        data (ndarray):             An initialized x-dimensional array, or None if insufficient memory available
+        data (ndarray):             An x-dimensional array (initialized with the fill value, or uninitialized when no
+                                    fill value is given). When the array spilled to disk, this is a memory-mapped array
+
+    Raises:
+        MemoryError:                Raised when there is not enough memory (or, when spilling, disk space) available
 
     """
 
@@ -53,12 +62,17 @@ def allocate_array(dimensions, fill_value=float('nan'), dtype=float):
             raise MemoryError()
 
         # allocate the memory
-        data.fill(fill_value)
+        if fill_value is not None:
+            data.fill(fill_value)
 
         #
         return data
 
     except MemoryError:
+        if spill_to_disk and mem is not None:
+            logging.warning('Not enough memory available to create array, the array (' + str(int(data_bytes_needed / (1024.0 ** 2))) + ' MB) will be backed by a temporary file instead')
+            return _allocate_disk_array(dimensions, fill_value, dtype)
+
         if mem is None:
             logging.error('Not enough memory available to create array.\n(for docker users: extend the memory resources available to the docker service)')
         else:
@@ -66,6 +80,43 @@ def allocate_array(dimensions, fill_value=float('nan'), dtype=float):
         raise MemoryError('Not enough memory available to create array.')
 
 
+def _allocate_disk_array(dimensions, fill_value, dtype):
+    """
+    Create an x-dimensional array that is backed by an (anonymous) temporary file
+
+    Note: the temporary file is removed by the OS as soon as the array (and thereby the memory-map) is released, also
+          when an error occurs while the array is in use
+    Note: a memory-mapped file is sparse, the disk space is only claimed when the pages are written. If the disk would
+          fill up while the array is being written, python crashes (SIGBUS) without the chance to catch an error. So
+          the free disk space is checked up front and, where the OS supports it, the disk space is reserved
+    """
+    import numpy as np
+    import tempfile
+    import shutil
+
+    # check if there is enough disk space available
+    data_bytes_needed = int(np.prod(dimensions, dtype=np.int64)) * np.dtype(dtype).itemsize
+    disk_free = shutil.disk_usage(tempfile.gettempdir()).free
+    if disk_free <= data_bytes_needed:
+        logging.error('Not enough disk space available to back the array by a temporary file.\nAt least ' + str(int(data_bytes_needed / (1024.0 ** 2))) + ' MB of free disk space is needed, ' + str(int(disk_free / (1024.0 ** 2))) + ' MB available in ' + tempfile.gettempdir())
+        raise MemoryError('Not enough memory or disk space available to create array.')
+
+    try:
+        with tempfile.TemporaryFile() as temp_file:
+            if hasattr(os, 'posix_fallocate') and data_bytes_needed > 0:
+                os.posix_fallocate(temp_file.fileno(), 0, data_bytes_needed)
+            data = np.memmap(temp_file, dtype=dtype, mode='w+', shape=dimensions)
+    except OSError as e:
+        logging.error('Could not create a temporary file to back the array: ' + str(e))
+        raise MemoryError('Not enough memory or disk space available to create array.')
+
+    # a new memory-mapped file is zero initialized, only fill when another value is requested
+    if fill_value is not None and fill_value != 0:
+        data.fill(fill_value)
+
+    return data
+
+
 def is_number(value):
     try:
         float(value)
@@ -135,6 +186,41 @@ def time_func(fun, pre_fun = None, loop = 5, *args, **kwargs):
     return times.mean(), times.std(), (times.min(), times.max()), times
 
 
+def run_and_report_peak_memory(connection, fun, args, kwargs):
+    """
+    Run a function and report the peak memory usage of the process afterwards. Intended as the target of a child
+    process (multiprocessing.Process), so that the peak is not carried over from earlier work in the parent process
+
+    Args:
+        connection (Connection):        The (sending end of a) multiprocessing pipe to report the peak memory usage
+                                        (in MiB) through
+        fun (function):                 The function to measure the peak memory usage of
+        args (tuple):                   The positional arguments to call the function with
+        kwargs (dict):                  The keyword arguments to call the function with
+
+    Note: the peak is read once from the OS after the function finished, so unlike sampling the memory usage (e.g. with
+          memory_profiler) there is no overhead while the function runs and no short peaks are missed in between samples
+    Note: when the PERF_CPU environment variable is set, the process is pinned to that core (where the OS supports
+          setting the affinity). This serializes any thread pools in the function, which makes the number of thread
+          buffers that are alive at the same time (and thereby the peak) the same between runs and machines, but can
+          give a lower peak than an unpinned run
+    """
+    from sys import platform
+    import psutil
+    process = psutil.Process()
+    if 'PERF_CPU' in os.environ and hasattr(process, 'cpu_affinity'):
+        process.cpu_affinity([int(os.environ['PERF_CPU'])])
+
+    fun(*args, **kwargs)
+    if platform == "win32":
+        peak_mem = process.memory_info().peak_wset / (1024 ** 2)
+    else:
+        import resource
+        peak_mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if platform == "darwin" else 1024)
+    connection.send(peak_mem)
+    connection.close()
+
+
 def clear_virtual_cache():
     """
     Try to clear the virtual memory (pagefile)
@@ -158,9 +244,11 @@ def clear_virtual_cache():
 
     elif platform in ("linux", "linux2"):
 
+        # Note: besides the page cache, also drop the dentry and inode caches, so that directory listings and file
+        #       lookups are uncached as well
         os.sync()
         with open('/proc/sys/vm/drop_caches', 'w') as f:
-            f.write("1\n")
+            f.write("3\n")
         print('Cleared virtual memory')
 
     elif platform == "darwin":
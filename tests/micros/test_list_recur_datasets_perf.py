@@ -8,7 +8,9 @@ Timing method adapted from a StackOverflow by users 'user136036' and 'poppie' (h
 
 import time
 import os
+import re
 import fnmatch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from glob import glob
 from pathlib import Path
 from ieegprep.fileio import VALID_FORMAT_EXTENSIONS
@@ -28,78 +30,122 @@ modalities = ('eeg', 'ieeg')  # ieeg and eeg
 directory = os.path.abspath(os.path.expanduser(os.path.expandvars(directory)))
 
 def run_os_walk():
-    a = time.time_ns()
+    a = time.perf_counter_ns()
     for i in range(RUNS):
         fu = []
 
+        # combine all (unique) patterns and extensions into a single regex, so each name is matched only once
+        combined_match = re.compile('|'.join(fnmatch.translate(('*' + subset_pattern + '*' if subset_pattern else '*') + extension)
+                                             for subset_pattern in dict.fromkeys(subset_patterns) for extension in extensions)).match
+
         for root, dirs, files in os.walk(directory):
-            for extension in extensions:
-                for subset_pattern in subset_patterns:
-                    subset_pattern = '*' + subset_pattern + '*' if subset_pattern else '*'
-                    fu.extend([x for x in fnmatch.filter(files, subset_pattern + extension)])
-                    fu.extend([x for x in fnmatch.filter(dirs, subset_pattern + extension)])
+            fu.extend([x for x in files if combined_match(x)])
+            fu.extend([x for x in dirs if combined_match(x)])
 
         #for f in fu:
         #    print(f)
 
 
-    print(f"os.walk\t\t\ttook {(time.time_ns() - a) / 1000 / 1000 / RUNS:.0f} ms. Found dirs: {len(fu)}")
+    elapsed = time.perf_counter_ns() - a
+    print(f"os.walk\t\t\ttook {elapsed / 1000 / 1000 / RUNS:.0f} ms. Found dirs: {len(fu)}")
+
+def run_os_scandir_parallel():
+    a = time.perf_counter_ns()
+    for i in range(RUNS):
+        fu = []
+
+        # combine all (unique) patterns and extensions into a single regex, so each name is matched only once
+        combined_match = re.compile('|'.join(fnmatch.translate(('*' + subset_pattern + '*' if subset_pattern else '*') + extension)
+                                             for subset_pattern in dict.fromkeys(subset_patterns) for extension in extensions)).match
+
+        # scan a single directory, return the matching names and the sub-directories to scan next
+        def scan_dir(scan_directory):
+            matches = []
+            sub_dirs = []
+            with os.scandir(scan_directory) as entries:
+                for entry in entries:
+                    if combined_match(entry.name):
+                        matches.append(entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.path)
+            return matches, sub_dirs
+
+        # scan the directories on a pool of threads (the GIL is released during the scandir and stat system calls),
+        # the sub-directories are submitted as the scans of their parent directories complete
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            pending = {executor.submit(scan_dir, directory)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    matches, sub_dirs = future.result()
+                    fu.extend(matches)
+                    pending.update(executor.submit(scan_dir, sub_dir) for sub_dir in sub_dirs)
+
+    elapsed = time.perf_counter_ns() - a
+    print(f"os.scandir_par\t\ttook {elapsed / 1000 / 1000 / RUNS:.0f} ms. Found dirs: {len(fu)}")
 
 def run_os_walk_with_modality():
-    a = time.time_ns()
+    a = time.perf_counter_ns()
     for i in range(RUNS):
         fu = []
 
+        # a single regex that matches any of the (unique, literal) patterns followed by any of the extensions at the end
+        name_match = re.compile('(?:' + '|'.join('.*' + re.escape(subset_pattern) for subset_pattern in sorted(set(subset_patterns))) + ').*' +
+                                '(?:' + '|'.join(re.escape(extension) for extension in extensions) + r')\Z', re.DOTALL).match
+
         for root, dirs, files in os.walk(directory):
+
+            # do not descend into the BIDS directories that do not hold raw data (in-place, top-down walk)
+            dirs[:] = [d for d in dirs if d not in ('sourcedata', 'derivatives', 'code') and not d.startswith('.')]
+
             if modalities is None or root.lower().endswith(modalities):
-                for extension in extensions:
-                    for subset_pattern in subset_patterns:
-                        subset_pattern = '*' + subset_pattern + '*' if subset_pattern else '*'
-                        fu.extend([os.path.join(root, x) for x in fnmatch.filter(files, subset_pattern + extension)])
-                        fu.extend([os.path.join(root, x) for x in fnmatch.filter(dirs, subset_pattern + extension)])
+                fu.extend([os.path.join(root, x) for x in files if name_match(x)])
+                fu.extend([os.path.join(root, x) for x in dirs if name_match(x)])
 
         #for f in fu:
         #    print(f)
 
 
-    print(f"os.walk_with_m\t\t\ttook {(time.time_ns() - a) / 1000 / 1000 / RUNS:.0f} ms. Found dirs: {len(fu)}")
+    elapsed = time.perf_counter_ns() - a
+    print(f"os.walk_with_m\t\t\ttook {elapsed / 1000 / 1000 / RUNS:.0f} ms. Found dirs: {len(fu)}")
 
 def run_single_glob():
-    a = time.time_ns()
+    a = time.perf_counter_ns()
     for i in range(RUNS):
         fu = []
 
-        for modality in modalities:
-            for subset_pattern in subset_patterns:
-                subset_pattern = '*' + subset_pattern + '*' if subset_pattern else '*'
-                fu.extend([p.resolve() for p in Path(directory).glob('**/' + subset_pattern) if p.suffix in extensions])
+        # walk the tree once and check the extension and (unique) patterns of each entry in memory
+        unique_patterns = set(subset_patterns)
+        fu.extend([p.resolve() for p in Path(directory).rglob('*')
+                   if p.suffix in extensions and any(subset_pattern in p.name for subset_pattern in unique_patterns)])
 
 
     #for f in fu:
     #    print(f)
 
-    print(f"run_single_glob\t\ttook {(time.time_ns() - a) / 1000:.2f}\t{(time.time_ns() - a) / 1000 / 1000 / RUNS:.0f} ms.\tFound dirs: {len(fu)}")
+    elapsed = time.perf_counter_ns() - a
+    print(f"run_single_glob\t\ttook {elapsed / 1000:.2f}\t{elapsed / 1000 / 1000 / RUNS:.0f} ms.\tFound dirs: {len(fu)}")
 
 def run_multi_glob():
-    a = time.time_ns()
+    a = time.perf_counter_ns()
     for i in range(RUNS):
         fu = []
 
-        subsets = []
+        # one recursive glob per extension and (unique) pattern, the modality is not part of the glob pattern
         for extension in extensions:
-            for modality in modalities:
-                for subset_pattern in subset_patterns:
-                    subset_pattern = '*' + subset_pattern + '*' if subset_pattern else '*'
-                    fu.extend([x for x in Path(directory).glob('**/' + subset_pattern + extension)])
-        #fu = [*set(fu)]
+            for subset_pattern in dict.fromkeys(subset_patterns):
+                subset_pattern = '*' + subset_pattern + '*' if subset_pattern else '*'
+                fu.extend([x for x in Path(directory).glob('**/' + subset_pattern + extension)])
     #for f in fu:
     #    print(f)
 
-    print(f"run_multi_glob\t\ttook {(time.time_ns() - a) / 1000:.2f}\t{(time.time_ns() - a) / 1000 / 1000 / RUNS:.0f} ms.\tFound dirs: {len(subsets)}")
+    elapsed = time.perf_counter_ns() - a
+    print(f"run_multi_glob\t\ttook {elapsed / 1000:.2f}\t{elapsed / 1000 / 1000 / RUNS:.0f} ms.\tFound dirs: {len(fu)}")
 
 
 if __name__ == '__main__':
     run_os_walk()
+    run_os_scandir_parallel()
     run_os_walk_with_modality()
     run_single_glob()
     run_multi_glob()
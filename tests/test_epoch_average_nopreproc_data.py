@@ -10,6 +10,8 @@ This program is distributed in the hope that it will be useful, but WITHOUT ANY
 You should have received a copy of the GNU General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import unittest
+from unittest import mock
+import ieegprep.bids.data_epoch as data_epoch
 from ieegprep.bids.data_epoch import _prepare_input, _load_data_epoch_averages__by_channel_condition_trial, _load_data_epoch_averages__by_condition_trials, _load_data_epochs__by_channels__withPrep
 from ieegprep.bids.sidecars import load_elec_stim_events
 from ieegprep.utils.console import ConsoleColors
@@ -118,17 +120,40 @@ class TestEpochAverageNoPreProcData(unittest.TestCase):
                                                                        high_pass=False, early_reref=None, line_noise_removal=None, late_reref=None,
                                                                        priority='speed')
 
+        # by_channel_condition_trial with each condition epoched in blocks (of a single trial)
+        with mock.patch.object(data_epoch, '_CONDITION_BLOCK_MAX_BYTES', 1):
+            _, channel_condition_trial_blocks__data, _ = _load_data_epoch_averages__by_channel_condition_trial(data_reader, data_reader.channel_names, conditions_onsets,
+                                                                                                               trial_epoch=self.test_trial_epoch,
+                                                                                                               baseline_method=baseline_method, baseline_epoch=self.test_baseline_epoch,
+                                                                                                               out_of_bound_method=out_of_bound_method, metric_callbacks=None)
+
+        # by_condition_trials with the trials averaged on multiple threads (regardless of the size of the data)
+        with mock.patch.object(data_epoch, '_PARALLEL_AVERAGE_MIN_BYTES', 0), mock.patch.object(data_epoch.os, 'cpu_count', return_value=4):
+            _, condition_trials_threaded__data, _ = _load_data_epoch_averages__by_condition_trials(data_reader, data_reader.channel_names, conditions_onsets,
+                                                                                                   trial_epoch=self.test_trial_epoch,
+                                                                                                   baseline_method=baseline_method, baseline_epoch=self.test_baseline_epoch,
+                                                                                                   out_of_bound_method=out_of_bound_method, metric_callbacks=None)
+
         # compare by_channel_condition_trial and by_condition_trials
         diff1 = abs(channel_condition_trial__data - condition_trials__data)
         self.assertEqual((diff1 == 0).sum(), channel_condition_trial__data.size, ('Validation of test \'' + test_name + '\' failed while comparing to \'by_channel_condition_trial\' and \'by_condition_trials\''))
 
-        # compare by_channel_condition_trial and by_channels__withPrep (mem)
+        # compare by_channel_condition_trial (which averages the trials of each channel-condition in a per-trial loop)
+        # and by_channels__withPrep (mem), which - without pre-processing - extracts the trials of all conditions at once
         diff2 = abs(channel_condition_trial__data - prep_mem__data)
         self.assertEqual((diff2 == 0).sum(), channel_condition_trial__data.size, ('Validation of test \'' + test_name + '\' failed while comparing to \'by_channel_condition_trial\' and \'by_channels__withPrep (mem)\''))
 
         diff3 = abs(channel_condition_trial__data - prep_speed__data)
         self.assertEqual((diff3 == 0).sum(), channel_condition_trial__data.size, ('Validation of test \'' + test_name + '\' failed while comparing to \'by_channel_condition_trial\' and \'by_channels__withPrep (speed)\''))
 
+        # compare the per-trial loop with the block-wise per-trial loop
+        diff4 = abs(channel_condition_trial__data - channel_condition_trial_blocks__data)
+        self.assertEqual((diff4 == 0).sum(), channel_condition_trial__data.size, ('Validation of test \'' + test_name + '\' failed while comparing to \'by_channel_condition_trial\' and \'by_channel_condition_trial (blocks)\''))
+
+        # compare the per-trial loop with the threaded averaging of by_condition_trials
+        diff5 = abs(channel_condition_trial__data - condition_trials_threaded__data)
+        self.assertEqual((diff5 == 0).sum(), channel_condition_trial__data.size, ('Validation of test \'' + test_name + '\' failed while comparing to \'by_channel_condition_trial\' and \'by_condition_trials (threaded)\''))
+
         #
         data_reader.close()
         ConsoleColors.print_green('Test ' + test_name + ' successful\n\n\n')
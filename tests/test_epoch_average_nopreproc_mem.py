@@ -12,12 +12,12 @@ You should have received a copy of the GNU General Public License along with thi
 import os
 import sys
 import unittest
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from ieegprep.bids.data_epoch import _prepare_input, _load_data_epoch_averages__by_channel_condition_trial, _load_data_epoch_averages__by_condition_trials, _load_data_epochs__by_channels__withPrep
 from ieegprep.bids.sidecars import load_elec_stim_events
 from ieegprep.utils.console import ConsoleColors
-from ieegprep.utils.misc import clear_virtual_cache
-from memory_profiler import memory_usage, profile
-
+from ieegprep.utils.misc import clear_virtual_cache, run_and_report_peak_memory
 
 class TestEpochAverageNoPreProcMem(unittest.TestCase):
     """
@@ -35,6 +35,14 @@ class TestEpochAverageNoPreProcMem(unittest.TestCase):
     test_baseline_epoch = (-1, -0.1)
     test_trial_epoch = (-1, 3)
 
+    # whether to trace the memory usage (line-by-line, by sampling with memory_profiler) instead of only reading the peak
+    # memory usage afterwards. Note that the sampling slows down the code being measured and adds to its memory usage
+    trace_memory = False
+
+    # the onsets loaded from the events file of each dataset (shared by all the tests in the class), keyed by the path
+    # and modification time of the events file, so that an events file that changes during the run is reloaded
+    events_onsets = dict()
+
 
     #
     # by_channel_condition_trial
@@ -184,35 +192,35 @@ class TestEpochAverageNoPreProcMem(unittest.TestCase):
         self._run_test(test_name, self.mef_data_path, 'prep_speed', preload_data=True)
 
 
-    @profile
-    def _prepare_and_epoch(self, data_path, by_routine, conditions_onsets, preload_data, set_bv_orientation=None):
+    @classmethod
+    def _prepare_and_epoch(cls, data_path, by_routine, conditions_onsets, preload_data, set_bv_orientation=None):
         """
 
         """
 
         #
         data_reader, baseline_method, out_of_bound_method = _prepare_input(data_path,
-                                                                           trial_epoch=self.test_trial_epoch, baseline_norm=self.test_baseline_norm, baseline_epoch=self.test_baseline_epoch,
+                                                                           trial_epoch=cls.test_trial_epoch, baseline_norm=cls.test_baseline_norm, baseline_epoch=cls.test_baseline_epoch,
                                                                            out_of_bound_handling='error', preload_data=preload_data)
         if set_bv_orientation is not None:
             data_reader.bv_hdr['data_orientation'] = set_bv_orientation
 
         if by_routine == 'channel_condition_trial':
             sampling_rate, data, _ = _load_data_epoch_averages__by_channel_condition_trial(data_reader, data_reader.channel_names, conditions_onsets,
-                                                       trial_epoch=self.test_trial_epoch,
-                                                       baseline_method=baseline_method, baseline_epoch=self.test_baseline_epoch,
+                                                       trial_epoch=cls.test_trial_epoch,
+                                                       baseline_method=baseline_method, baseline_epoch=cls.test_baseline_epoch,
                                                        out_of_bound_method=out_of_bound_method, metric_callbacks=None)
 
         elif by_routine == 'condition_trials':
             sampling_rate, data, _ = _load_data_epoch_averages__by_condition_trials(data_reader, data_reader.channel_names, conditions_onsets,
-                                                     trial_epoch=self.test_trial_epoch,
-                                                     baseline_method=baseline_method, baseline_epoch=self.test_baseline_epoch,
+                                                     trial_epoch=cls.test_trial_epoch,
+                                                     baseline_method=baseline_method, baseline_epoch=cls.test_baseline_epoch,
                                                      out_of_bound_method=out_of_bound_method, metric_callbacks=None)
 
         elif by_routine in ('prep_mem', 'prep_speed'):
             sampling_rate, data, _ = _load_data_epochs__by_channels__withPrep(True, data_reader, data_reader.channel_names, conditions_onsets,
-                                                                              trial_epoch=self.test_trial_epoch,
-                                                                              baseline_method=baseline_method, baseline_epoch=self.test_baseline_epoch,
+                                                                              trial_epoch=cls.test_trial_epoch,
+                                                                              baseline_method=baseline_method, baseline_epoch=cls.test_baseline_epoch,
                                                                               out_of_bound_method=out_of_bound_method, metric_callbacks=None,
                                                                               high_pass=False, early_reref=None, line_noise_removal=None, late_reref=None,
                                                                               priority='mem' if by_routine == 'prep_mem' else 'speed')
@@ -229,17 +237,40 @@ class TestEpochAverageNoPreProcMem(unittest.TestCase):
             print('  - set_bv_orientation: ' + set_bv_orientation)
 
         # load the trial onsets for each of the stimulation conditions
-        clear_virtual_cache()
-        _, _, conditions_onsets, _ = load_elec_stim_events(data_path[0:data_path.rindex('_ieeg')] + '_events.tsv',
-                                                                                concat_bidirectional_stimpairs=True)
+        # (only once for each dataset, the other tests on the same dataset re-use the onsets)
+        # Note: the events are loaded on a thread while the cache is cleared (the events file is not part of the test)
+        events_path = data_path[0:data_path.rindex('_ieeg')] + '_events.tsv'
+        events_key = (events_path, os.stat(events_path).st_mtime_ns)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            events_future = None
+            if events_key not in self.events_onsets:
+                events_future = executor.submit(load_elec_stim_events, events_path, concat_bidirectional_stimpairs=True)
+
+            #
+            clear_virtual_cache()
+            if events_future is not None:
+                _, _, self.events_onsets[events_key], _ = events_future.result()
+        conditions_onsets = self.events_onsets[events_key]
 
         # test the memory usage of the preparation and average epoch
-        if set_bv_orientation is None:
-            mem_usage = memory_usage((self._prepare_and_epoch, (data_path, by_routine, conditions_onsets, preload_data)),
-                                     interval=0.005, include_children=True, multiprocess=True, max_usage=True)
+        epoch_args = (data_path, by_routine, conditions_onsets, preload_data)
+        epoch_kwargs = dict() if set_bv_orientation is None else {'set_bv_orientation': set_bv_orientation}
+        if self.trace_memory:
+            # Note: the epoching does not spawn child processes, so the process tree does not need to be walked on
+            #       every sample (include_children/multiprocess), and a 50ms interval suffices to catch the peak
+            from memory_profiler import memory_usage, profile
+            mem_usage = memory_usage((profile(self._prepare_and_epoch), epoch_args, epoch_kwargs),
+                                     interval=0.05, include_children=False, multiprocess=False, max_usage=True)
         else:
-            mem_usage = memory_usage((self._prepare_and_epoch, (data_path, by_routine, conditions_onsets, preload_data), {'set_bv_orientation': set_bv_orientation}),
-                                     interval=0.005, include_children=True, multiprocess=True, max_usage=True)
+            # run in a child process, so that the peak memory usage is not carried over from previous tests
+            receive_connection, send_connection = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_and_report_peak_memory,
+                                              args=(send_connection, self._prepare_and_epoch, epoch_args, epoch_kwargs))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                self.fail('Error while preparing and epoching in the child process')
+            mem_usage = receive_connection.recv()
 
         #
         print('Peak memory usage: ' + str(mem_usage))
@@ -0,0 +1,161 @@
+"""
+Unit tests to validate the data-type of the epoch output, the response of the one-pole high-pass filter and the
+warning filters after averaging
+
+This class tests (on a synthetic BrainVision dataset that is written to a temporary directory):
+   - the data-type of the epochs for both high_precision values            --> test01_epoch__high_precision_dtype
+   - the data-type of the epoch averages for both high_precision values    --> test02_epoch_average__high_precision_dtype
+   - the DC and passband response of the 'onepole' high-pass filter        --> test03_epoch__high_pass_onepole_response
+   - the global warning filters after averaging (with several CPUs)        --> test04_epoch_average__warning_filters
+   - epoching an empty list of channels                                    --> test05_epoch__no_channels
+   - epoching and averaging an empty list of channels                      --> test06_epoch_average__no_channels
+
+
+=====================================================
+Copyright 2023, Max van den Boom (Multimodal Neuroimaging Lab, Mayo Clinic, Rochester MN)
+
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+import numpy as np
+import ieegprep.bids.data_epoch as data_epoch
+from ieegprep.bids.data_epoch import load_data_epochs, load_data_epochs_averages, _prepare_input, _load_data_epoch_averages__by_channel_condition_trial
+from ieegprep.utils.console import ConsoleColors
+
+
+class TestEpochPreProcData(unittest.TestCase):
+    """
+    ...
+    """
+
+    sampling_rate = 1000
+    num_samples = 60 * 1000
+    channels = ['CH01', 'CH02', 'CH03', 'CH04']
+    channel_offsets = (100.0, -250.0, 400.0, 20.0)          # the DC offset of each channel
+    sine_freq = 40                                          # the frequency (in Hz) of the sine on each channel
+    sine_amplitude = 10.0
+
+    test_trial_epoch = (-1, 3)
+    test_onsets = [30.0, 35.5, 40.0, 45.25, 50.0]
+    test_conditions_onsets = {'a': [30.0, 35.5], 'b': [40.0, 45.25, 50.0]}
+
+    @classmethod
+    def setUpClass(cls):
+
+        # write a (vectorized, 32-bit float) BrainVision dataset with a DC offset and a sine on each channel
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.data_path = os.path.join(cls.temp_dir.name, 'sub-01_ieeg.vhdr')
+        time = np.arange(cls.num_samples) / cls.sampling_rate
+        data = np.array([offset + cls.sine_amplitude * np.sin(2 * np.pi * cls.sine_freq * time) for offset in cls.channel_offsets], dtype=np.float32)
+        data.tofile(os.path.join(cls.temp_dir.name, 'sub-01_ieeg.eeg'))
+
+        header = ['BrainVision Data Exchange Header File Version 1.0', '',
+                  '[Common Infos]', 'Codepage=UTF-8', 'DataFile=sub-01_ieeg.eeg', 'MarkerFile=sub-01_ieeg.vmrk',
+                  'DataFormat=BINARY', 'DataOrientation=VECTORIZED', 'NumberOfChannels=' + str(len(cls.channels)),
+                  'SamplingInterval=' + str(int(1e6 / cls.sampling_rate)), '',
+                  '[Binary Infos]', 'BinaryFormat=IEEE_FLOAT_32', '',
+                  '[Channel Infos]']
+        header += ['Ch' + str(index + 1) + '=' + channel + ',,1,µV' for index, channel in enumerate(cls.channels)]
+        with open(cls.data_path, 'w', encoding='utf-8') as header_file:
+            header_file.write('\n'.join(header) + '\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+
+    def test01_epoch__high_precision_dtype(self):
+        ConsoleColors.print_green('Test data: Epoch, high_precision data-type')
+
+        # without and with pre-processing
+        for preproc_kwargs in (dict(), dict(line_noise_removal=60)):
+            _, data_32 = load_data_epochs(self.data_path, self.channels, self.test_onsets, trial_epoch=self.test_trial_epoch, **preproc_kwargs)
+            _, data_64 = load_data_epochs(self.data_path, self.channels, self.test_onsets, trial_epoch=self.test_trial_epoch, high_precision=True, **preproc_kwargs)
+            self.assertEqual(data_32.dtype, np.float32)
+            self.assertEqual(data_64.dtype, np.float64)
+            self.assertTrue(np.allclose(data_32, data_64, rtol=1e-6, atol=1e-4, equal_nan=True))
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+    def test02_epoch_average__high_precision_dtype(self):
+        ConsoleColors.print_green('Test data: Epoch & Average, high_precision data-type')
+
+        # without and with pre-processing
+        for preproc_kwargs in (dict(), dict(line_noise_removal=60)):
+            _, data_32, _ = load_data_epochs_averages(self.data_path, self.channels, self.test_conditions_onsets, trial_epoch=self.test_trial_epoch, **preproc_kwargs)
+            _, data_64, _ = load_data_epochs_averages(self.data_path, self.channels, self.test_conditions_onsets, trial_epoch=self.test_trial_epoch, high_precision=True, **preproc_kwargs)
+            self.assertEqual(data_32.dtype, np.float32)
+            self.assertEqual(data_64.dtype, np.float64)
+            self.assertTrue(np.allclose(data_32, data_64, rtol=1e-6, atol=1e-4, equal_nan=True))
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+    def test03_epoch__high_pass_onepole_response(self):
+        ConsoleColors.print_green('Test data: Epoch, high-pass (onepole) response')
+
+        _, data = load_data_epochs(self.data_path, self.channels, self.test_onsets, trial_epoch=self.test_trial_epoch,
+                                   high_pass=True, high_pass_method='onepole', high_precision=True)
+
+        # the DC offset of each channel should be removed (the epochs hold a whole number of sine cycles)
+        self.assertTrue(np.all(np.abs(data.mean(axis=2)) < 0.01 * self.sine_amplitude))
+
+        # the sine (well within the passband) should pass with unit gain
+        amplitudes = np.sqrt(2 * np.mean(data ** 2, axis=2))
+        self.assertTrue(np.allclose(amplitudes, self.sine_amplitude, rtol=0.01))
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+    def test04_epoch_average__warning_filters(self):
+        ConsoleColors.print_green('Test data: Epoch & Average, global warning filters')
+
+        # average many channels, with a condition of which all trials lie outside of the data (the averaging of which
+        # emits warnings that are suppressed), as if there are multiple CPUs available
+        data_reader, baseline_method, out_of_bound_method = _prepare_input(self.data_path,
+                                                                           trial_epoch=self.test_trial_epoch, baseline_norm='median', baseline_epoch=(-1, -0.1),
+                                                                           out_of_bound_handling='allow', preload_data=False)
+        conditions_onsets = {'a': [30.0, 35.5], 'out': [70.0, 75.0]}
+        filters_before = list(warnings.filters)
+        with mock.patch.object(data_epoch.os, 'cpu_count', return_value=8):
+            _, data, _ = _load_data_epoch_averages__by_channel_condition_trial(data_reader, self.channels * 16, conditions_onsets,
+                                                                               trial_epoch=self.test_trial_epoch,
+                                                                               baseline_method=baseline_method, baseline_epoch=(-1, -0.1),
+                                                                               out_of_bound_method=out_of_bound_method, metric_callbacks=None)
+        data_reader.close()
+
+        # the warning filters of the process should be left unchanged
+        self.assertEqual(warnings.filters, filters_before)
+        self.assertTrue(np.isnan(data[:, 1, :]).all())
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+    def test05_epoch__no_channels(self):
+        ConsoleColors.print_green('Test data: Epoch, no channels')
+
+        # both epoched by channels (no preload) and by trials (preloaded)
+        for preload_data in (False, True):
+            _, data = load_data_epochs(self.data_path, [], self.test_onsets, trial_epoch=self.test_trial_epoch, preload_data=preload_data)
+            self.assertEqual(data.shape, (0, len(self.test_onsets), 4000))
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+    def test06_epoch_average__no_channels(self):
+        ConsoleColors.print_green('Test data: Epoch & Average, no channels')
+
+        # with and without baseline normalization, not preloaded and preloaded
+        for baseline_norm in (None, 'median'):
+            for preload_data in (False, True):
+                _, data, _ = load_data_epochs_averages(self.data_path, [], self.test_conditions_onsets, trial_epoch=self.test_trial_epoch,
+                                                       baseline_norm=baseline_norm, preload_data=preload_data)
+                self.assertEqual(data.shape, (0, len(self.test_conditions_onsets), 4000))
+
+        ConsoleColors.print_green('Test successful\n\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()